@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+"""
+Benchmark of the NRTidal-D source models and of a full likelihood call.
+
+Times nrtidal_d.source, source_binary_love, source_binary_love_noXi,
+source_binary_love_relative_binning and GravitationalWaveTransient.log_likelihood() (time and phase marginalized, as in the runners)
+for a grid of approximants, durations, sampling frequencies and detector networks.
+The data is a GW170817-like injection into zero noise, so no strain data is needed.
+
+Results are written to a JSON file; compare two of them with compare_benchmarks.py.
+"""
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Waveform-Model"))
+
+import datetime
+import itertools
+import json
+import platform
+import subprocess
+import time
+
+import bilby
+import numpy as np
+
+import nrtidal_d
+import networks
+
+logger = bilby.core.utils.logger
+
+#-----------------------------------------------------------------
+
+import argparse
+parser = argparse.ArgumentParser()
+
+parser.add_argument("-o", "--output", type=str, default=None,
+                    help="Output JSON file (default: benchmark_[git commit].json).")
+
+parser.add_argument("-a", "--approximants", type=str, nargs="+",
+                    default=["IMRPhenomD_NRTidal", "IMRPhenomPv2_NRTidal"],
+                    help="Base waveform approximants.")
+
+parser.add_argument("-d", "--durations", type=float, nargs="+", default=[128, 256],
+                    help="Analysis segment durations (s).")
+
+parser.add_argument("-f", "--sampling_frequencies", type=float, nargs="+", default=[2048, 4096],
+                    help="Sampling frequencies (Hz).")
+
+parser.add_argument("-N", "--networks", type=str, nargs="+", default=["O4", "O5", "CE"],
+                    choices=list(networks.NETWORKS),
+                    help="Detector networks.")
+
+parser.add_argument("-r", "--repeats", type=int, default=20,
+                    help="Number of timed calls per benchmark.")
+
+parser.add_argument("-fm", "--minimum_frequency", type=float, default=40.,
+                    help="Minimum frequency (Hz).")
+
+parser.add_argument("-ad", "--asd_dir", type=str,
+                    default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ASD-Files"),
+                    help="Location of the ASD files.")
+
+#-----------------------------------------------------------------
+
+SOURCE_MODELS = {
+    "source": nrtidal_d.source,
+    "source_binary_love": nrtidal_d.source_binary_love,
+    "source_binary_love_noXi": nrtidal_d.source_binary_love_noXi,
+    "source_binary_love_relative_binning": nrtidal_d.source_binary_love_relative_binning,
+}
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (subprocess.CalledProcessError, OSError):
+        return "unknown"
+
+def metadata():
+    import lal
+    return dict(
+        commit=git_commit(),
+        date=datetime.datetime.now().isoformat(),
+        host=platform.node(),
+        machine=platform.machine(),
+        cpu_count=os.cpu_count(),
+        python=platform.python_version(),
+        numpy=np.__version__,
+        bilby=bilby.__version__,
+        lal=lal.__version__,
+    )
+
+def time_calls(function, parameter_list):
+    """
+    Per-call wall times of function(parameters) for each parameters in parameter_list.
+    """
+    times = np.zeros(len(parameter_list))
+    for i, parameters in enumerate(parameter_list):
+        start = time.perf_counter()
+        function(parameters)
+        times[i] = time.perf_counter() - start
+    return times
+
+def summarize(times):
+    return dict(
+        calls=len(times),
+        min_s=float(np.min(times)),
+        median_s=float(np.median(times)),
+        mean_s=float(np.mean(times)),
+        std_s=float(np.std(times)),
+    )
+
+def parameter_draws(n, rng):
+    """
+    Parameters scattered around the injection, so that no call hits the waveform generator cache.
+    """
+    draws = []
+    for i in range(n):
+        p = dict(networks.GW170817_LIKE_INJECTION)
+        p["lambda_s"] += rng.uniform(-50, 50)
+        p["xi_tilde"] = rng.uniform(0, 1000)
+        p["mass_2"] -= rng.uniform(0, 0.05)
+        draws.append(p)
+    return draws
+
+def source_arguments(parameters, waveform_arguments):
+    """
+    Keyword arguments of a direct call to an nrtidal_d source model.
+    """
+    kwargs = dict(parameters)
+    # for the model that samples on lambda_1, lambda_2
+    kwargs.update(lambda_1=parameters["lambda_s"], lambda_2=parameters["lambda_s"])
+    for key in ["geocent_time", "psi", "ra", "dec", "fiducial"]:
+        kwargs.pop(key)
+    kwargs.update(waveform_arguments)
+    return kwargs
+
+def run_case(approximant, duration, sampling_frequency, network, args, rng):
+    ifo_list, waveform_generator = networks.make_injection(
+        network, args.asd_dir,
+        approximant=approximant,
+        duration=duration,
+        sampling_frequency=sampling_frequency,
+        minimum_frequency=args.minimum_frequency)
+    waveform_arguments = waveform_generator.waveform_arguments
+
+    frequency_array = waveform_generator.frequency_array
+    draws = parameter_draws(args.repeats, rng)
+
+    results = []
+    case = dict(
+        approximant=approximant,
+        duration=duration,
+        sampling_frequency=sampling_frequency,
+        network=network,
+        frequency_bins=len(frequency_array),
+    )
+
+    for name, model in SOURCE_MODELS.items():
+        parameter_names = bilby.core.utils.infer_parameters_from_function(model)
+        def call(parameters):
+            kwargs = source_arguments(parameters, waveform_arguments)
+            return model(frequency_array, **{k: kwargs[k] for k in parameter_names},
+                         **waveform_arguments)
+        call(draws[0]) # warm up
+        results.append(dict(case, benchmark=name, **summarize(time_calls(call, draws))))
+        logger.info("{} {}: {:.3g} s/call".format(case, name, results[-1]["median_s"]))
+
+    # as in the injection/recovery scripts: time and phase marginalization
+    likelihood = bilby.gw.GravitationalWaveTransient(
+        interferometers=ifo_list,
+        waveform_generator=waveform_generator,
+        time_marginalization=True,
+        phase_marginalization=True,
+        distance_marginalization=False,
+        priors=networks.injection_priors(networks.GW170817_LIKE_INJECTION))
+
+    def call(parameters):
+        return likelihood.log_likelihood(dict(parameters, time_jitter=0.))
+
+    call(dict(networks.GW170817_LIKE_INJECTION)) # warm up
+    times = time_calls(call, draws)
+    results.append(dict(case, benchmark="log_likelihood", **summarize(times)))
+    logger.info("{} log_likelihood: {:.3g} s/call".format(case, results[-1]["median_s"]))
+
+    return results
+
+#-----------------------------------------------------------------
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    bilby.core.utils.setup_logger(log_level="info")
+
+    info = metadata()
+    output = args.output
+    if output is None:
+        output = "benchmark_{}.json".format(info["commit"][:12])
+
+    rng = np.random.default_rng(1234)
+
+    results = []
+    for approximant, duration, sampling_frequency, network in itertools.product(
+            args.approximants, args.durations, args.sampling_frequencies, args.networks):
+        results.extend(run_case(approximant, duration, sampling_frequency, network, args, rng))
+
+    with open(output, "w") as f:
+        json.dump(dict(metadata=info, repeats=args.repeats, results=results), f, indent=2)
+    logger.info("Wrote {} benchmarks to {}".format(len(results), output))
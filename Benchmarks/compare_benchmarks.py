@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""
+Compare two benchmark files written by benchmark.py.
+
+Prints the ratio new/old of the median time per call for every benchmark
+present in both files, and exits with status 1 if any ratio exceeds the
+regression threshold.
+"""
+import sys
+import json
+
+#-----------------------------------------------------------------
+
+import argparse
+parser = argparse.ArgumentParser()
+
+parser.add_argument("old", type=str,
+                    help="Reference benchmark file.")
+
+parser.add_argument("new", type=str,
+                    help="Benchmark file to compare against the reference.")
+
+parser.add_argument("-t", "--threshold", type=float, default=1.1,
+                    help="Flag benchmarks that are slower than threshold times the reference.")
+
+#-----------------------------------------------------------------
+
+KEYS = ["benchmark", "approximant", "network", "duration", "sampling_frequency"]
+
+def load(fname):
+    with open(fname) as f:
+        data = json.load(f)
+    return data["metadata"], {tuple(r[k] for k in KEYS): r for r in data["results"]}
+
+def compare(old, new, threshold):
+    """
+    List of (key, old median, new median, ratio, regressed) for the benchmarks in both old and new.
+    """
+    rows = []
+    for key in old:
+        if key not in new:
+            continue
+        ratio = new[key]["median_s"] / old[key]["median_s"]
+        rows.append((key, old[key]["median_s"], new[key]["median_s"], ratio, ratio > threshold))
+    return rows
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    old_meta, old = load(args.old)
+    new_meta, new = load(args.new)
+
+    print("old: {} ({})".format(old_meta["commit"][:12], old_meta["date"]))
+    print("new: {} ({})".format(new_meta["commit"][:12], new_meta["date"]))
+    print("{:<38} {:<22} {:<7} {:>6} {:>6} {:>10} {:>10} {:>7}".format(
+        "benchmark", "approximant", "network", "T [s]", "fs", "old [s]", "new [s]", "ratio"))
+
+    rows = compare(old, new, args.threshold)
+    for key, old_t, new_t, ratio, regressed in rows:
+        print("{:<38} {:<22} {:<7} {:>6g} {:>6g} {:>10.4g} {:>10.4g} {:>7.3f}{}".format(
+            *key, old_t, new_t, ratio, "  <-- slower" if regressed else ""))
+
+    nregressed = sum(row[-1] for row in rows)
+    print("{} of {} benchmarks slower than {}x the reference".format(nregressed, len(rows), args.threshold))
+    sys.exit(1 if nregressed > 0 else 0)
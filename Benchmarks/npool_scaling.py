@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+"""
+npool scaling study.
+
+Runs a short, fixed-iteration dynesty sampling of an NRTidal-D injection/recovery
+configuration for several pool sizes (and, optionally, several nlive/nact settings),
+and reports the wall time, likelihood calls per second, and parallel efficiency.
+Recommends, for each nlive/nact setting, the largest pool size whose efficiency
+is above a threshold.
+
+Parallel efficiency is measured on iterations per second (i.e. time to solution),
+since dynesty discards part of the proposals made in parallel: with K workers
+and N live points the ideal speedup is only N*ln(1 + K/N), and the calls per
+iteration grow with K. Longer rwalk chains (larger nact) amortize the serial
+work done by the main process between batches.
+"""
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Waveform-Model"))
+
+import csv
+import json
+import shutil
+import tempfile
+import time
+
+import bilby
+import numpy as np
+
+import networks
+import thread_budget
+
+logger = bilby.core.utils.logger
+
+#-----------------------------------------------------------------
+
+import argparse
+parser = argparse.ArgumentParser()
+
+parser.add_argument("-o", "--outdir", type=str, default="npool_scaling",
+                    help="Output directory for the report.")
+
+parser.add_argument("-n", "--npools", type=int, nargs="+", default=[1, 2, 4, 8, 16],
+                    help="Pool sizes to test.")
+
+parser.add_argument("--nlive", type=int, nargs="+", default=[500],
+                    help="Numbers of live points to test.")
+
+parser.add_argument("--nact", type=int, nargs="+", default=[5],
+                    help="Values of nact to test.")
+
+parser.add_argument("-i", "--maxiter", type=int, default=500,
+                    help="Number of dynesty iterations per run.")
+
+parser.add_argument("-e", "--efficiency", type=float, default=0.7,
+                    help="Minimum parallel efficiency of the recommended pool size.")
+
+parser.add_argument("-N", "--network", type=str, default="O4", choices=list(networks.NETWORKS),
+                    help="Detector network.")
+
+parser.add_argument("-a", "--approximant", type=str, default="IMRPhenomPv2_NRTidal",
+                    help="Base waveform approximant.")
+
+parser.add_argument("-d", "--duration", type=float, default=128,
+                    help="Analysis segment duration (s).")
+
+parser.add_argument("-f", "--sampling_frequency", type=float, default=2048,
+                    help="Sampling frequency (Hz).")
+
+parser.add_argument("-x", "--xitilde", type=float, default=0,
+                    help="Injected value of xi tilde.")
+
+parser.add_argument("-ad", "--asd_dir", type=str,
+                    default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ASD-Files"),
+                    help="Location of the ASD files.")
+
+#-----------------------------------------------------------------
+
+def ideal_efficiency(npool, nlive):
+    """
+    Efficiency of dynesty's parallel proposals when the likelihood cost dominates:
+    K = npool queued proposals compress the prior volume like N ln(1 + K/N) serial ones.
+    """
+    return nlive * np.log1p(npool / nlive) / npool
+
+def run_one(likelihood, priors, npool, nlive, nact, maxiter, outdir):
+    """
+    Fixed-iteration sampling. Returns wall time, iterations and likelihood calls.
+    """
+    label = "npool{}_nlive{}_nact{}".format(npool, nlive, nact)
+    thread_budget.apply(npool)
+
+    start = time.perf_counter()
+    result = bilby.run_sampler(
+            likelihood=likelihood,
+            priors=priors,
+            sampler="dynesty",
+            sample="rwalk",
+            bound="live",
+            nlive=nlive,
+            nact=nact,
+            maxiter=maxiter,
+            maxmcmc=5000,
+            check_point=False,
+            npool=npool,
+            outdir=outdir, label=label,
+            save=False, plot=False)
+    wall = time.perf_counter() - start
+
+    return dict(
+        npool=npool,
+        nlive=nlive,
+        nact=nact,
+        wall_s=wall,
+        sampling_s=float(result.sampling_time.total_seconds()
+                         if hasattr(result.sampling_time, "total_seconds") else result.sampling_time),
+        # the final live points are appended to the nested samples
+        iterations=max(len(result.nested_samples) - nlive, 1),
+        likelihood_calls=int(result.num_likelihood_evaluations),
+    )
+
+def add_efficiencies(rows):
+    """
+    Speedups and efficiencies relative to the smallest pool size with the same nlive/nact.
+    """
+    for row in rows:
+        ref = min((r for r in rows if r["nlive"] == row["nlive"] and r["nact"] == row["nact"]),
+                  key=lambda r: r["npool"])
+        row["calls_per_s"] = row["likelihood_calls"] / row["wall_s"]
+        row["iterations_per_s"] = row["iterations"] / row["wall_s"]
+        row["calls_per_iteration"] = row["likelihood_calls"] / row["iterations"]
+
+        scale = row["npool"] / ref["npool"]
+        row["throughput_efficiency"] = (
+            row["calls_per_s"] / (ref["likelihood_calls"] / ref["wall_s"])) / scale
+        row["parallel_efficiency"] = (
+            row["iterations_per_s"] / (ref["iterations"] / ref["wall_s"])) / scale
+        row["ideal_efficiency"] = ideal_efficiency(row["npool"], row["nlive"]) / ideal_efficiency(ref["npool"], row["nlive"])
+    return rows
+
+def recommend(rows, efficiency):
+    """
+    Largest pool size with parallel efficiency >= efficiency, for each nlive/nact.
+    """
+    recommendation = {}
+    for row in sorted(rows, key=lambda r: r["npool"]):
+        key = "nlive={},nact={}".format(row["nlive"], row["nact"])
+        if key not in recommendation:
+            recommendation[key] = row["npool"]
+        if row["parallel_efficiency"] >= efficiency:
+            recommendation[key] = row["npool"]
+    return recommendation
+
+#-----------------------------------------------------------------
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    bilby.core.utils.check_directory_exists_and_if_not_mkdir(args.outdir)
+    bilby.core.utils.setup_logger(outdir=args.outdir, label="npool_scaling")
+
+    injection_parameters = dict(networks.GW170817_LIKE_INJECTION, xi_tilde=args.xitilde)
+    ifo_list, waveform_generator = networks.make_injection(
+        args.network, args.asd_dir,
+        approximant=args.approximant,
+        duration=args.duration,
+        sampling_frequency=args.sampling_frequency,
+        injection_parameters=injection_parameters)
+    priors = networks.injection_priors(injection_parameters)
+
+    likelihood = bilby.gw.GravitationalWaveTransient(
+        interferometers=ifo_list,
+        waveform_generator=waveform_generator,
+        time_marginalization=True,
+        phase_marginalization=True,
+        distance_marginalization=False,
+        priors=priors)
+
+    rundir = tempfile.mkdtemp(dir=args.outdir)
+    rows = []
+    try:
+        for nlive in args.nlive:
+            for nact in args.nact:
+                for npool in sorted(args.npools):
+                    logger.info("Scaling run: npool={}, nlive={}, nact={}".format(npool, nlive, nact))
+                    rows.append(run_one(likelihood, priors, npool, nlive, nact, args.maxiter, rundir))
+    finally:
+        shutil.rmtree(rundir, ignore_errors=True)
+
+    add_efficiencies(rows)
+    recommendation = recommend(rows, args.efficiency)
+
+    config = {k: v for k, v in vars(args).items() if k not in ["outdir"]}
+    with open(os.path.join(args.outdir, "npool_scaling.json"), "w") as f:
+        json.dump(dict(config=config, runs=rows, recommended_npool=recommendation), f, indent=2)
+    with open(os.path.join(args.outdir, "npool_scaling.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+
+    print("{:>6} {:>6} {:>5} {:>9} {:>9} {:>8} {:>9} {:>9} {:>9}".format(
+        "npool", "nlive", "nact", "wall [s]", "calls/s", "calls/it", "eff", "eff(thr)", "eff(ideal)"))
+    for row in rows:
+        print("{npool:>6} {nlive:>6} {nact:>5} {wall_s:>9.1f} {calls_per_s:>9.1f} {calls_per_iteration:>8.1f} "
+              "{parallel_efficiency:>9.2f} {throughput_efficiency:>9.2f} {ideal_efficiency:>9.2f}".format(**row))
+    for key, npool in recommendation.items():
+        print("Recommended npool for {} (efficiency >= {}): {}".format(key, args.efficiency, npool))
@@ -0,0 +1,158 @@
+"""
+Tidal deformabilities Lambda_bar, Xi_bar and the effective viscosity, vectorized.
+
+The calculation of calculate-xi-bar.ipynb (see arXiv:2306.15633) as functions of
+numpy arrays (masses, radii, Love numbers, viscosities, EOS tables, posterior
+samples), which broadcast against each other. Units are plain floats, in CGS
+except for the inputs: masses in solar masses, radii in km, kinematic
+viscosities in cm^2/s, lag times in s.
+
+    C       = G m / (R c^2)
+    Lambda  = (2/3) k_2 / C^5
+    Xi      = (2/3) k_2 / C^6 * c tau_2 / R
+    tau_2   = p_2 nu R / (G m)
+
+As in the notebook we use the magnitude of p_2 (p_2 ~ 0.1 for bulk viscosity),
+so that Xi > 0 for nu > 0. For the causal maximum viscosity nu = c R,
+c tau_2 / R = p_2 / C, and Xi = (2/3) k_2 p_2 / C^7.
+
+    Lambda_bar = f(eta)  (Lambda_A + Lambda_B)/2 + g(eta)  (Lambda_A - Lambda_B)/2
+    Xi_bar     = f1(eta) (Xi_A + Xi_B)/2         + g1(eta) (Xi_A - Xi_B)/2
+
+Xi_bar is the xi_tilde of our papers, i.e. 8 times the xi_tilde of the code.
+
+    python xi_bar.py
+
+prints the reference values of the notebook (GW170817-like binary).
+"""
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Waveform-Model"))
+
+from astropy.constants import G, c, M_sun
+import numpy as np
+
+import nrtidal_d
+
+G_CGS = G.cgs.value
+C_CGS = c.cgs.value
+M_SUN_CGS = M_sun.cgs.value
+KM_CGS = 1e5
+
+def calc_symmratio(m_1, m_2):
+    m_1 = np.asarray(m_1, dtype=float)
+    m_2 = np.asarray(m_2, dtype=float)
+    return m_1 * m_2 / (m_1 + m_2) ** 2
+
+def _sqrt_1_minus_4eta(symmratio):
+    # eta <= 1/4, up to rounding
+    return np.sqrt(np.maximum(1 - 4 * symmratio, 0.))
+
+def f(symmratio):
+    return (16/13) * (1 + 7*symmratio - 31*symmratio**2)
+
+def g(symmratio):
+    return - (16/13) * _sqrt_1_minus_4eta(symmratio) * (1 + 9*symmratio - 11*symmratio**2)
+
+def f1(symmratio):
+    return 8 * (2*symmratio**2 - 4*symmratio + 1)
+
+def g1(symmratio):
+    return - 8 * _sqrt_1_minus_4eta(symmratio) * (1 - 2*symmratio)
+
+def compactness(mass, radius):
+    """
+    C = G m / (R c^2), mass in solar masses, radius in km.
+    """
+    return G_CGS * M_SUN_CGS * np.asarray(mass, dtype=float) / (KM_CGS * np.asarray(radius, dtype=float) * C_CGS**2)
+
+def causal_viscosity(radius):
+    """
+    Rough maximal kinematic viscosity nu = c R (cm^2/s), radius in km.
+    """
+    return C_CGS * KM_CGS * np.asarray(radius, dtype=float)
+
+def kinematic_viscosity(bulk_viscosity, mass, radius):
+    """
+    nu = zeta / rho (cm^2/s), for a bulk viscosity zeta in g/(cm s) and the mean density.
+    """
+    volume = (4*np.pi/3) * (KM_CGS * np.asarray(radius, dtype=float))**3
+    return np.asarray(bulk_viscosity, dtype=float) * volume / (M_SUN_CGS * np.asarray(mass, dtype=float))
+
+def lag_time(viscosity, mass, radius, p2=0.1):
+    """
+    Tidal lag time tau_2 = |p_2| nu R / (G m) (s).
+    """
+    return (np.abs(p2) * np.asarray(viscosity, dtype=float) * KM_CGS * np.asarray(radius, dtype=float)
+            / (G_CGS * M_SUN_CGS * np.asarray(mass, dtype=float)))
+
+def tidal_deformability(mass, radius, k2=1.):
+    """
+    Lambda = (2/3) k_2 / C^5.
+    """
+    return (2/3) * k2 * compactness(mass, radius)**-5
+
+def dissipative_tidal_deformability(mass, radius, viscosity=None, k2=1., p2=0.1):
+    """
+    Xi = (2/3) k_2 / C^6 * c tau_2 / R, for the kinematic viscosity nu
+    (default: the causal maximum c R).
+    """
+    if viscosity is None:
+        viscosity = causal_viscosity(radius)
+    tau = lag_time(viscosity, mass, radius, p2)
+    return (2/3) * k2 * compactness(mass, radius)**-6 * C_CGS * tau / (KM_CGS * np.asarray(radius, dtype=float))
+
+def lambda_bar(lambda_a, lambda_b, m_a, m_b):
+    symmratio = calc_symmratio(m_a, m_b)
+    return 0.5*(lambda_a + lambda_b)*f(symmratio) + 0.5*(lambda_a - lambda_b)*g(symmratio)
+
+def xi_bar(xi_a, xi_b, m_a, m_b):
+    symmratio = calc_symmratio(m_a, m_b)
+    return 0.5*(xi_a + xi_b)*f1(symmratio) + 0.5*(xi_a - xi_b)*g1(symmratio)
+
+def xi_bar_from_viscosity(viscosity, m_a, m_b, r_a, r_b, k2_a=1., k2_b=1., p2_a=0.1, p2_b=0.1):
+    """
+    Xi_bar of a binary whose stars have the same kinematic viscosity nu (cm^2/s).
+    """
+    xi_a = dissipative_tidal_deformability(m_a, r_a, viscosity, k2_a, p2_a)
+    xi_b = dissipative_tidal_deformability(m_b, r_b, viscosity, k2_b, p2_b)
+    return xi_bar(xi_a, xi_b, m_a, m_b)
+
+def viscosity_from_xi_bar(xi_bar_value, m_a, m_b, r_a, r_b, k2_a=1., k2_b=1., p2_a=0.1, p2_b=0.1):
+    """
+    Effective kinematic viscosity (cm^2/s, the same for both stars) implied by Xi_bar.
+    Xi_bar is linear in nu, so this is Xi_bar / Xi_bar(nu = 1 cm^2/s).
+    """
+    return np.asarray(xi_bar_value, dtype=float) / xi_bar_from_viscosity(
+        1., m_a, m_b, r_a, r_b, k2_a, k2_b, p2_a, p2_b)
+
+def xi_bar_from_xi_tilde(xi_tilde):
+    """
+    Xi_bar from the xi_tilde of the code (e.g. posterior samples).
+    """
+    return nrtidal_d.XI_TILDE_PAPER_FACTOR * np.asarray(xi_tilde, dtype=float)
+
+def interpolate_eos(mass, eos_mass, eos_radius, eos_k2=None):
+    """
+    Radius (km) and k_2 at the given masses, from an EOS table (the stable
+    branch, with increasing eos_mass). Returns the radius, and k_2 if eos_k2 is given.
+    """
+    order = np.argsort(eos_mass)
+    radius = np.interp(mass, np.asarray(eos_mass)[order], np.asarray(eos_radius)[order])
+    if eos_k2 is None:
+        return radius
+    return radius, np.interp(mass, np.asarray(eos_mass)[order], np.asarray(eos_k2)[order])
+
+#-----------------------------------------------------------------
+
+if __name__ == "__main__":
+    # GW170817-like event (arXiv:1805.11581), causal maximum viscosity
+    m_a = m_b = 1.38
+    r_a = r_b = 11.
+
+    print("C_A        {:.8g}".format(compactness(m_a, r_a)))
+    print("nu_A       {:.8g} cm^2/s".format(causal_viscosity(r_a)))
+    print("tau_A/p2   {:.8g} s".format(lag_time(causal_viscosity(r_a), m_a, r_a, p2=1.)))
+    print("Lambda_bar {:.8g}".format(lambda_bar(tidal_deformability(m_a, r_a), tidal_deformability(m_b, r_b), m_a, m_b)))
+    print("Xi_bar/p2  {:.8g}".format(xi_bar_from_viscosity(causal_viscosity(r_a), m_a, m_b, r_a, r_b, p2_a=1., p2_b=1.)))
+    print("p2 Xi_bar  {:.8g} (p2 = 0.1, k2 = 1)".format(xi_bar_from_viscosity(causal_viscosity(r_a), m_a, m_b, r_a, r_b)))
@@ -8,6 +8,20 @@ The script makes use of the updated marginalized binary love relations arXiv:190
 import sys
 import bilby
 import nrtidal_d
+import checkpointing
+import eos_priors
+import mixed_precision
+import postprocessing
+import posterior_store
+import profiling
+import progress
+import psd_estimation
+import rapid
+import run_cache
+import sampler_budget
+import surrogate
+import thread_budget
+import warm_start
 import numpy as np
 from gwpy.timeseries import TimeSeries
 
@@ -25,6 +39,81 @@ parser.add_argument("-l", "--label", type=str, default="bilby_GW170817_4",
 parser.add_argument("-n", "--npool", type=int, default=1, 
                     help="Number of CPUs.")
 
+parser.add_argument("-nt", "--threads_per_worker", type=int, default=1,
+                    help="Number of BLAS/FFTW/OpenMP threads per pool worker.")
+
+parser.add_argument("--affinity", type=str, default="none", choices=["none", "core", "numa"],
+                    help="Pin pool workers to cores or NUMA domains.")
+
+parser.add_argument("--profile", action="store_true",
+                    help="Time the stages of each likelihood call and write a profile next to the result.")
+
+parser.add_argument("--budget_hours", type=float, default=None,
+                    help="Wall-clock budget (hours): choose nlive, nact and dlogz to fit it.")
+
+parser.add_argument("--budget_core_hours", type=float, default=None,
+                    help="Core-hour budget: choose nlive, nact and dlogz to fit it.")
+
+parser.add_argument("--xi_precision", type=float, default=0.05,
+                    help="Target relative precision of the posterior mass above the 90%% upper bound on xi tilde (with a budget).")
+
+parser.add_argument("--log_evidence_error", type=float, default=0.2,
+                    help="Target statistical error (nats) of ln Z (with a budget).")
+
+parser.add_argument("--metrics", action="store_true",
+                    help="Stream sampler progress and running xi tilde quantiles to a metrics file.")
+
+parser.add_argument("--metrics_port", type=int, default=None,
+                    help="Also serve the progress metrics on this local port.")
+
+parser.add_argument("--preemptible", action="store_true",
+                    help="Incremental checkpoints, also written on SIGTERM/SIGUSR1 (see Waveform-Model/checkpointing.py).")
+
+parser.add_argument("--checkpoint_interval", type=float, default=600,
+                    help="Seconds between incremental checkpoints, with --preemptible.")
+
+parser.add_argument("--cache_dir", type=str, default=None,
+                    help="Run cache: reuse the result (or checkpoint) of an identical earlier run.")
+
+parser.add_argument("--defer_plots", action="store_true",
+                    help="Skip the corner plot (make it later with Waveform-Model/postprocessing.py).")
+
+parser.add_argument("--store_nested_samples", action="store_true",
+                    help="Also write the nested samples (dead points) to {label}_posterior.h5.")
+
+parser.add_argument("--rapid", action="store_true",
+                    help="Only find the maximum likelihood and a coarse lambda_s, xi tilde grid posterior (see Waveform-Model/rapid.py).")
+
+parser.add_argument("--rapid_grid_points", type=int, nargs=2, default=[40, 50], metavar=("LAMBDA_S", "XI_TILDE"),
+                    help="Points of the lambda_s and xi tilde grids, with --rapid.")
+
+parser.add_argument("--warm_start", type=str, default=None,
+                    help="Earlier result (or posterior store) of a related run to start the sampler from (see Waveform-Model/warm_start.py).")
+
+parser.add_argument("--surrogate_file", type=str, default=None,
+                    help="Compute the base waveform with this surrogate, for aligned spins (see Waveform-Model/surrogate.py).")
+
+parser.add_argument("--eos_tables", type=str, nargs="+", default=None,
+                    help="EOS tables (mass, Lambda[, Xi] columns): EOS-informed lambda_s (and xi tilde) priors.")
+
+parser.add_argument("--eos_cache_dir", type=str, default=None,
+                    help="Where to cache the tabulated EOS priors (default: the output directory).")
+
+parser.add_argument("--estimate_psd", action="store_true",
+                    help="Estimate the PSDs from off-source strain of the HDF5 files (see Waveform-Model/psd_estimation.py) instead of reading GWTC1_GW170817_PSDs.dat.")
+
+parser.add_argument("--psd_duration", type=float, default=None,
+                    help="Off-source duration of the PSD estimate (default: 32 times the analysis duration, as much as the files hold).")
+
+parser.add_argument("--psd_cache_dir", type=str, default=None,
+                    help="Where to cache the estimated PSDs (default: the output directory).")
+
+parser.add_argument("--mixed_precision", action="store_true",
+                    help="Inner products in mixed precision, checked against full precision before sampling (see Waveform-Model/mixed_precision.py).")
+
+parser.add_argument("--mixed_precision_points", type=int, default=mixed_precision.CHECK_POINTS,
+                    help="Prior draws of the check against full precision, with --mixed_precision.")
+
 parser.add_argument("-sd", "--strain_dir", type=str, 
                     default = "/Users/abhi/Work/Projects/BDNK-Critical-Collapse/Data-Analysis/Cluster-Data/scratch/GW170817_files/Strain-Data-GW170817/no-glitch",
                     help="Path to directory that contains the strain data.")
@@ -37,6 +126,11 @@ args = parser.parse_args()
 bilby.core.utils.setup_logger(outdir=args.outdir, label=args.label, log_level = "debug")
 logger = bilby.core.utils.logger
 
+thread_budget.apply(args.npool, threads_per_worker=args.threads_per_worker, affinity=args.affinity)
+
+if args.profile:
+    profiling.enable(args.outdir, args.label)
+
 #-----------------------------------------------------------------
 """
 Set up sampling frequency and start, end times of the signal
@@ -68,14 +162,21 @@ hdf5_filenames = {
 Read in detector PSD files
 """
 
-datapsd=np.loadtxt(args.strain_dir + "/GWTC1_GW170817_PSDs.dat")
+if args.estimate_psd:
+    farray, psd_array = psd_estimation.estimate_psds(
+        hdf5_filenames, start_time, duration, sampling_frequency=sampling_frequency,
+        psd_duration=args.psd_duration, cache_dir=args.psd_cache_dir or args.outdir)
+    psd_files = []
+else:
+    datapsd=np.loadtxt(args.strain_dir + "/GWTC1_GW170817_PSDs.dat")
 
-farray=datapsd[:,0]
-h1psd = datapsd[:,1]
-l1psd= datapsd[:,2]
-v1psd = datapsd[:,3]
+    farray=datapsd[:,0]
+    h1psd = datapsd[:,1]
+    l1psd= datapsd[:,2]
+    v1psd = datapsd[:,3]
 
-psd_array = {"H1":h1psd, "L1":l1psd, "V1": v1psd}
+    psd_array = {"H1":h1psd, "L1":l1psd, "V1": v1psd}
+    psd_files = [args.strain_dir + "/GWTC1_GW170817_PSDs.dat"]
 
 det_names = np.array(["H1,L1,V1"])
 ifo_list = bilby.gw.detector.InterferometerList([])
@@ -132,6 +233,7 @@ priors["psi"] = bilby.gw.prior.Uniform(name="psi", minimum=0, maximum=np.pi, bou
 priors["lambda_1"] = bilby.core.prior.Constraint( name="lambda_1", minimum=0, maximum=3000)
 priors["lambda_2"] = bilby.core.prior.Constraint(name="lambda_2", minimum=0, maximum=3000)
 priors["lambda_s"] = bilby.core.prior.Triangular(name="lambda_s", mode=1500,minimum = 0, maximum = 3000,latex_label="$\\Lambda_s$")
+priors["binary_love_residual"] = bilby.core.prior.Gaussian(name="binary_love_residual", mu=0, sigma=1, latex_label="$\\delta_{\\rm BL}$")
 
 priors["geocent_time"] = bilby.core.prior.Uniform(
     minimum=trigger_time - 0.2,
@@ -147,6 +249,12 @@ priors["ra"] =  bilby.gw.prior.Uniform(name="ra", minimum=0, maximum=2 * np.pi,
 
 priors["xi_tilde"] = bilby.core.prior.Uniform(0,1000,name="xi_tilde")
 
+if args.eos_tables is not None:
+    # GW170817 is at ~40 Mpc
+    eos_priors.use_eos_priors(priors, args.eos_tables,
+                              redshift=bilby.gw.conversion.luminosity_distance_to_redshift(40.),
+                              cache_dir=args.eos_cache_dir or args.outdir)
+
 #-----------------------------------------------------------------
 """
 Set up waveform generator and waveform source model
@@ -156,10 +264,15 @@ waveform_arguments = dict(
     reference_frequency=20.0
 )
 
+if args.surrogate_file is not None:
+    surrogate.check(args.surrogate_file, priors, waveform_arguments)
+    waveform_arguments["surrogate_file"] = args.surrogate_file
+
 waveform_generator = bilby.gw.WaveformGenerator(
     duration=duration,
     sampling_frequency=sampling_frequency,
-    frequency_domain_source_model=nrtidal_d.source_binary_love,
+    frequency_domain_source_model=(surrogate.source_binary_love if args.surrogate_file is not None
+                                   else nrtidal_d.source_binary_love),
     parameter_conversion=bilby.gw.conversion.convert_to_lal_binary_neutron_star_parameters,
     waveform_arguments=waveform_arguments
 )
@@ -168,26 +281,80 @@ waveform_generator = bilby.gw.WaveformGenerator(
 """
 Set up likelihood. We marginalize over the phase.
 """
-likelihood = bilby.gw.GravitationalWaveTransient(
+likelihood_class = bilby.gw.GravitationalWaveTransient
+if args.mixed_precision:
+    likelihood_class = mixed_precision.MixedPrecisionGravitationalWaveTransient
+
+likelihood = likelihood_class(
     interferometers=ifo_list, waveform_generator=waveform_generator,
     time_marginalization=False, phase_marginalization=True,
     distance_marginalization=False, priors=priors)
 
 #-----------------------------------------------------------------
 
-result = bilby.run_sampler(
+if args.mixed_precision:
+    mixed_precision.check(likelihood, priors, points=args.mixed_precision_points)
+
+if args.profile:
+    profiling.instrument_likelihood(likelihood)
+
+if args.rapid:
+    rapid.run(likelihood, priors, args.outdir, args.label, npool=args.npool, grid_points=args.rapid_grid_points)
+    sys.exit()
+
+conversion_function = postprocessing.generate_all_nrtidal_d_parameters
+if args.warm_start is not None:
+    priors = warm_start.start(priors, args.warm_start, conversion_function)
+    conversion_function = warm_start.conversion_function
+
+sampler_settings = dict(nlive=1500, nact=10, dlogz=0.01)
+if args.budget_hours is not None or args.budget_core_hours is not None:
+    sampler_settings = sampler_budget.choose_settings(
+        likelihood, priors, npool=args.npool,
+        wall_hours=args.budget_hours, core_hours=args.budget_core_hours,
+        precision=args.xi_precision, log_evidence_error=args.log_evidence_error)
+
+if args.metrics:
+    progress.start(args.outdir, args.label, priors, port=args.metrics_port, dlogz=sampler_settings["dlogz"])
+    sampler_settings["print_func"] = progress.print_func
+
+sampler = "dynesty"
+if args.preemptible:
+    sampler = checkpointing.register()
+    sampler_settings["checkpoint_interval"] = args.checkpoint_interval
+
+run_sampler = bilby.run_sampler
+if args.cache_dir is not None:
+    run_sampler = run_cache.RunCache(
+        args.cache_dir, input_files=list(hdf5_filenames.values()) + psd_files + (args.eos_tables or [])).run_sampler
+
+result = run_sampler(
         likelihood=likelihood, 
         priors=priors, 
-        sampler="dynesty", 
+        sampler=sampler, 
         sample = "rwalk",
         bound = "live",
-        nlive=1500, 
-        nact=10, 
-        dlogz=0.01, 
+        **sampler_settings,
         maxmcmc=5000,
         check_point_delta_t=3600,
         npool=args.npool, 
         outdir=args.outdir, label=args.label,
-        conversion_function=bilby.gw.conversion.generate_all_bns_parameters)
+        conversion_function=conversion_function)
+
+if args.warm_start is not None:
+    warm_start.finish(result)
+
+if args.mixed_precision:
+    mixed_precision.finish(result)
+
+if args.metrics:
+    progress.stop()
+
+if args.profile:
+    profiling.write_profile(args.outdir, args.label)
+
+posterior_store.write(posterior_store.store_file(args.outdir, args.label), result,
+                      nested_samples=args.store_nested_samples)
 
-result.plot_corner()
+if not args.defer_plots:
+    result.plot_corner()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+"""
+Summary of an injection/recovery campaign.
+
+Scans a campaign output tree (e.g. {outstem}/{network}-recover-Xi{xitilde}/output/,
+see launch-injection-recovery.sh) for posterior stores ({label}_posterior.h5,
+see Waveform-Model/posterior_store.py) and reads only the xi_tilde column and
+the run summary of each, in parallel over the files. Results without a
+posterior store are read from their bilby result file (slower).
+
+For each run it reports:
+
+    + the xi_tilde credible bounds (quantiles of the posterior)
+    + ln BF signal/noise, and ln BF of xi_tilde = 0 against the xi_tilde prior
+      (Savage-Dickey density ratio at xi_tilde = 0, with a reflected Gaussian KDE
+      since xi_tilde = 0 is the edge of the prior)
+    + the recovery bias: posterior median - injected xi_tilde, in absolute terms
+      and in units of the posterior standard deviation, and the credible level
+      of the injected value
+
+and writes the table to {output}.csv and {output}.json.
+"""
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Waveform-Model"))
+
+import csv
+import glob
+import json
+import multiprocessing
+import re
+
+import bilby
+import numpy as np
+
+import nrtidal_d
+import posterior_store
+
+logger = bilby.core.utils.logger
+
+QUANTILES = [0.05, 0.5, 0.9, 0.95]
+
+# Run directories of launch-injection-recovery.sh.
+RUN_DIRECTORY = re.compile(r"(?P<network>[A-Za-z0-9]+)-recover-Xi(?P<xitilde>[0-9.eE+-]+)")
+
+#-----------------------------------------------------------------
+
+import argparse
+parser = argparse.ArgumentParser()
+
+parser.add_argument("campaign", type=str,
+                    help="Output tree of the campaign.")
+
+parser.add_argument("-o", "--output", type=str, default="campaign_summary",
+                    help="Output file stem (.csv and .json are written).")
+
+parser.add_argument("-p", "--parameter", type=str, default="xi_tilde",
+                    help="Parameter to summarize.")
+
+parser.add_argument("-n", "--npool", type=int, default=1,
+                    help="Number of files read in parallel.")
+
+parser.add_argument("--paper_units", action="store_true",
+                    help="Report xi_tilde with the factor of 8 of our papers.")
+
+#-----------------------------------------------------------------
+
+def find_runs(campaign):
+    """
+    Posterior stores in the tree, and the result files that have none.
+    """
+    stores = sorted(glob.glob(os.path.join(campaign, "**", "*_posterior.h5"), recursive=True))
+    results = []
+    for extension in ["json", "pkl"]:
+        for result_file in sorted(glob.glob(os.path.join(campaign, "**", "*_result." + extension), recursive=True)):
+            stem = result_file[:-len("_result." + extension)]
+            if not os.path.isfile(stem + "_posterior.h5"):
+                results.append(result_file)
+    return stores + results
+
+def read_run(filename, parameter):
+    """
+    Samples of parameter, ln BF signal/noise, injection parameters and prior of
+    a run (None if the prior cannot be read: no Savage-Dickey value).
+    """
+    if filename.endswith(".h5"):
+        with posterior_store.PosteriorStore(filename) as store:
+            attrs = store.attrs
+            samples = store[parameter]
+        injection_parameters = attrs.get("injection_parameters") or {}
+        prior = attrs.get("priors", {}).get(parameter)
+        log_bayes_factor = attrs.get("log_bayes_factor", np.nan)
+        if not np.isfinite(log_bayes_factor):
+            log_bayes_factor = attrs.get("log_evidence", np.nan) - attrs.get("log_noise_evidence", np.nan)
+    else:
+        result = bilby.core.result.read_in_result(filename)
+        samples = result.posterior[parameter].to_numpy()
+        injection_parameters = result.injection_parameters or {}
+        prior = result.priors.get(parameter)
+        log_bayes_factor = result.log_bayes_factor
+    if isinstance(prior, str):
+        # stores written before the priors were stored as bilby JSON
+        try:
+            prior = bilby.core.prior.PriorDict(dictionary={parameter: prior})[parameter]
+        except (AttributeError, ImportError, NameError, SyntaxError, TypeError, ValueError) as e:
+            logger.warning("Cannot read the {} prior of {} ({}): no Savage-Dickey ln BF".format(parameter, filename, e))
+            prior = None
+    return samples, log_bayes_factor, injection_parameters, prior
+
+def density_at_lower_edge(samples, edge):
+    """
+    Gaussian KDE (Scott's bandwidth) of the samples at the lower edge of their
+    support, with the samples reflected about the edge.
+    """
+    x = np.asarray(samples, dtype=float) - edge
+    if len(x) < 2 or np.std(x) == 0:
+        return np.nan
+    bandwidth = np.std(x) * len(x) ** (-1. / 5)
+    return float(2 * np.mean(np.exp(-0.5 * (x / bandwidth) ** 2)) / (np.sqrt(2 * np.pi) * bandwidth))
+
+def summarize_run(filename, parameter="xi_tilde", scale=1.):
+    samples, log_bayes_factor, injection_parameters, prior = read_run(filename, parameter)
+
+    directory = RUN_DIRECTORY.search(os.path.relpath(filename))
+    injected = injection_parameters.get(parameter)
+    if injected is None and directory is not None and parameter == "xi_tilde":
+        injected = float(directory.group("xitilde"))
+
+    row = dict(
+        file=filename,
+        network=directory.group("network") if directory is not None else None,
+        injected=injected * scale if injected is not None else np.nan,
+        samples=len(samples),
+        log_bayes_factor=float(log_bayes_factor) if log_bayes_factor is not None else np.nan,
+    )
+
+    quantiles = np.quantile(samples, QUANTILES)
+    for q, value in zip(QUANTILES, quantiles):
+        row["q{:g}".format(100 * q)] = float(value) * scale
+    row["mean"] = float(np.mean(samples)) * scale
+    row["std"] = float(np.std(samples)) * scale
+
+    if prior is not None and np.isfinite(prior.minimum):
+        prior_density = float(prior.prob(prior.minimum))
+        posterior_density = density_at_lower_edge(samples, prior.minimum)
+        with np.errstate(divide="ignore"):
+            row["log_bayes_factor_{}_zero".format(parameter)] = (
+                float(np.log(posterior_density) - np.log(prior_density)) if prior_density > 0 else np.nan)
+
+    if injected is not None:
+        median = row["q50"]
+        row["bias"] = median - row["injected"]
+        row["bias_sigma"] = row["bias"] / row["std"] if row["std"] > 0 else np.nan
+        row["injected_credible_level"] = float(np.mean(samples < injected))
+    return row
+
+def _summarize(args):
+    filename, parameter, scale = args
+    try:
+        return summarize_run(filename, parameter, scale)
+    except (AttributeError, ImportError, KeyError, OSError, ValueError) as e:
+        # e.g. a store whose priors cannot be decoded
+        logger.warning("Skipping {}: {}".format(filename, e))
+        return None
+
+def summarize_campaign(campaign, parameter="xi_tilde", npool=1, scale=1.):
+    files = find_runs(campaign)
+    logger.info("Found {} runs in {}".format(len(files), campaign))
+    tasks = [(f, parameter, scale) for f in files]
+    if npool > 1:
+        with multiprocessing.Pool(npool) as pool:
+            rows = pool.map(_summarize, tasks, chunksize=1)
+    else:
+        rows = [_summarize(task) for task in tasks]
+    rows = [row for row in rows if row is not None]
+    return sorted(rows, key=lambda r: (str(r["network"]), r["injected"], r["file"]))
+
+#-----------------------------------------------------------------
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    scale = nrtidal_d.XI_TILDE_PAPER_FACTOR if args.paper_units and args.parameter == "xi_tilde" else 1.
+    rows = summarize_campaign(args.campaign, args.parameter, args.npool, scale)
+    if len(rows) == 0:
+        sys.exit("No results found in {}".format(args.campaign))
+
+    fieldnames = []
+    for row in rows:
+        fieldnames += [key for key in row if key not in fieldnames]
+    with open(args.output + ".json", "w") as f:
+        json.dump(dict(campaign=args.campaign, parameter=args.parameter, scale=scale, runs=rows), f, indent=2)
+    with open(args.output + ".csv", "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    print("{:>8} {:>9} {:>9} {:>9} {:>9} {:>9} {:>9} {:>8}".format(
+        "network", "injected", "median", "90%", "95%", "ln BF", "ln BF0", "bias/sd"))
+    for row in rows:
+        print("{:>8} {:>9.4g} {:>9.4g} {:>9.4g} {:>9.4g} {:>9.4g} {:>9.4g} {:>8.3g}".format(
+            str(row["network"]), row["injected"], row["q50"], row["q90"], row["q95"],
+            row["log_bayes_factor"], row.get("log_bayes_factor_{}_zero".format(args.parameter), np.nan),
+            row.get("bias_sigma", np.nan)))
@@ -22,8 +22,7 @@ for det in "${detectors[@]}"; do
     d="$outstem/${det}-recover-Xi${xitilde}"
     mkdir $d
     cd $d
-    cp $nrtd/Waveform-Model/nrtidal_d.py nrtidal_d.py 
-    cp $nrtd/Waveform-Model/updated_binary_love_marginalized.py updated_binary_love_marginalized.py 
+    cp $nrtd/Waveform-Model/*.py . 
     cp $nrtd/Injection-Recovery/$main main.py 
     cp $nrtd/ASD-Files/*.txt . 
     cp $nrtd/Injection-Recovery/launch.slurm launch.slurm
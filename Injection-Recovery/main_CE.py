@@ -3,6 +3,20 @@
 import sys
 import bilby
 import nrtidal_d
+import checkpointing
+import long_duration
+import mixed_precision
+import noise_realizations
+import postprocessing
+import posterior_store
+import profiling
+import progress
+import rapid
+import run_cache
+import sampler_budget
+import surrogate
+import thread_budget
+import warm_start
 import numpy as np
 
 #-----------------------------------------------------------------
@@ -19,6 +33,87 @@ parser.add_argument("-l", "--label", type=str, default="GW170817",
 parser.add_argument("-n", "--npool", type=int, default=1, 
                     help="Number of CPUs.")
 
+parser.add_argument("-nt", "--threads_per_worker", type=int, default=1,
+                    help="Number of BLAS/FFTW/OpenMP threads per pool worker.")
+
+parser.add_argument("--affinity", type=str, default="none", choices=["none", "core", "numa"],
+                    help="Pin pool workers to cores or NUMA domains.")
+
+parser.add_argument("--profile", action="store_true",
+                    help="Time the stages of each likelihood call and write a profile next to the result.")
+
+parser.add_argument("--budget_hours", type=float, default=None,
+                    help="Wall-clock budget (hours): choose nlive, nact and dlogz to fit it.")
+
+parser.add_argument("--budget_core_hours", type=float, default=None,
+                    help="Core-hour budget: choose nlive, nact and dlogz to fit it.")
+
+parser.add_argument("--xi_precision", type=float, default=0.05,
+                    help="Target relative precision of the posterior mass above the 90%% upper bound on xi tilde (with a budget).")
+
+parser.add_argument("--log_evidence_error", type=float, default=0.2,
+                    help="Target statistical error (nats) of ln Z (with a budget).")
+
+parser.add_argument("--metrics", action="store_true",
+                    help="Stream sampler progress and running xi tilde quantiles to a metrics file.")
+
+parser.add_argument("--metrics_port", type=int, default=None,
+                    help="Also serve the progress metrics on this local port.")
+
+parser.add_argument("--preemptible", action="store_true",
+                    help="Incremental checkpoints, also written on SIGTERM/SIGUSR1 (see Waveform-Model/checkpointing.py).")
+
+parser.add_argument("--checkpoint_interval", type=float, default=600,
+                    help="Seconds between incremental checkpoints, with --preemptible.")
+
+parser.add_argument("--cache_dir", type=str, default=None,
+                    help="Run cache: reuse the result (or checkpoint) of an identical earlier run.")
+
+parser.add_argument("--defer_plots", action="store_true",
+                    help="Skip the corner plot (make it later with Waveform-Model/postprocessing.py).")
+
+parser.add_argument("--store_nested_samples", action="store_true",
+                    help="Also write the nested samples (dead points) to {label}_posterior.h5.")
+
+parser.add_argument("--rapid", action="store_true",
+                    help="Only find the maximum likelihood and a coarse lambda_s, xi tilde grid posterior (see Waveform-Model/rapid.py).")
+
+parser.add_argument("--rapid_grid_points", type=int, nargs=2, default=[40, 50], metavar=("LAMBDA_S", "XI_TILDE"),
+                    help="Points of the lambda_s and xi tilde grids, with --rapid.")
+
+parser.add_argument("--warm_start", type=str, default=None,
+                    help="Earlier result (or posterior store) of a related run to start the sampler from (see Waveform-Model/warm_start.py).")
+
+parser.add_argument("--surrogate_file", type=str, default=None,
+                    help="Compute the base waveform with this surrogate, for aligned spins (see Waveform-Model/surrogate.py).")
+
+parser.add_argument("--noise_store", type=str, default=None,
+                    help="Inject into a noise realization of this store instead of zero noise (see Waveform-Model/noise_realizations.py).")
+
+parser.add_argument("--noise_index", type=int, default=0,
+                    help="Noise realization of the store, with --noise_store.")
+
+parser.add_argument("--duration", type=float, default=128,
+                    help="Analysis segment duration (ending at 1187008883).")
+
+parser.add_argument("--minimum_frequency", type=float, default=40.,
+                    help="Minimum frequency of the analysis.")
+
+parser.add_argument("--long_duration", action="store_true",
+                    help="Memory-bounded block-wise likelihood for long segments and low minimum frequencies, geocent_time sampled (see Waveform-Model/long_duration.py).")
+
+parser.add_argument("--block_memory", type=float, default=256,
+                    help="Memory budget (MB per worker) of the frequency blocks, with --long_duration.")
+
+parser.add_argument("--block_dir", type=str, default=None,
+                    help="Memory-map the data of the frequency blocks from this directory, with --long_duration (default a temporary directory).")
+
+parser.add_argument("--mixed_precision", action="store_true",
+                    help="Inner products in mixed precision, checked against full precision before sampling (see Waveform-Model/mixed_precision.py).")
+
+parser.add_argument("--mixed_precision_points", type=int, default=mixed_precision.CHECK_POINTS,
+                    help="Prior draws of the check against full precision, with --mixed_precision.")
+
 parser.add_argument("-x", "--xitilde", type=float, default=0, 
                     help="Value of xi tilde")
 
@@ -27,19 +122,27 @@ parser.add_argument("-ad", "--asd_dir", type=str, default = "",
 
 args = parser.parse_args()
 
+if args.long_duration and args.mixed_precision:
+    parser.error("--mixed_precision is not available with --long_duration")
+
 #-----------------------------------------------------------------
 
 bilby.core.utils.setup_logger(outdir=args.outdir, label=args.label)#, log_level = "debug")
 logger = bilby.core.utils.logger
 
+thread_budget.apply(args.npool, threads_per_worker=args.threads_per_worker, affinity=args.affinity)
+
+if args.profile:
+    profiling.enable(args.outdir, args.label)
+
 #-----------------------------------------------------------------
 trigger_time = 1187008882.43
 
 roll_off = 0.2  # Roll off duration of tukey window in seconds
 
-duration = 128   # Analysis segment duration
-start_time = 1187008755
-end_time = start_time + duration
+duration = args.duration   # Analysis segment duration
+end_time = 1187008883
+start_time = end_time - duration
 
 sampling_frequency = 2048 
 #-----------------------------------------------------------------
@@ -61,6 +164,7 @@ injection_parameters = dict(
         ra=3.4,
         dec=-0.401,
         lambda_s=584,
+        binary_love_residual=0.,
         xi_tilde=args.xitilde,
         fiducial=1,
     )
@@ -85,21 +189,37 @@ priors["lambda_2"] = bilby.core.prior.Constraint(
     name="lambda_2", minimum=0, maximum=3000
 )
 priors["lambda_s"] = bilby.core.prior.Triangular(mode=1500,minimum=0,maximum=3000)
+priors["binary_love_residual"] = bilby.core.prior.Gaussian(mu=0,sigma=1,name="binary_love_residual")
 
 priors["xi_tilde"] = bilby.core.prior.Uniform(0,1000,name="xi_tilde")
 
-del priors["geocent_time"], priors["phase"]
+if args.long_duration:
+    # no time marginalization in the block-wise likelihood
+    priors["geocent_time"] = bilby.core.prior.Uniform(
+        injection_parameters["geocent_time"] - 0.1, injection_parameters["geocent_time"] + 0.1,
+        name="geocent_time", latex_label="$t_c$", unit="$s$")
+    del priors["phase"]
+else:
+    del priors["geocent_time"], priors["phase"]
 #-----------------------------------------------------------------
 waveform_arguments = dict(
     waveform_approximant="IMRPhenomPv2_NRTidal",
     reference_frequency=50.0,
-    minimum_frequency=40.0
+    minimum_frequency=args.minimum_frequency
 )
+
+if args.surrogate_file is not None:
+    if args.long_duration:
+        parser.error("--surrogate_file does not apply to --long_duration")
+    surrogate.check(args.surrogate_file, priors, waveform_arguments)
+    waveform_arguments["surrogate_file"] = args.surrogate_file
 #-----------------------------------------------------------------
 waveform_generator = bilby.gw.WaveformGenerator(
     duration=duration,
     sampling_frequency=sampling_frequency,
-    frequency_domain_source_model=nrtidal_d.source_binary_love,
+    frequency_domain_source_model=(nrtidal_d.source_binary_love_frequency_sequence if args.long_duration
+                                   else surrogate.source_binary_love if args.surrogate_file is not None
+                                   else nrtidal_d.source_binary_love),
     parameter_conversion=bilby.gw.conversion.convert_to_lal_binary_neutron_star_parameters,
     waveform_arguments=waveform_arguments
 )
@@ -131,9 +251,13 @@ for det in ["CE"]:
 for ifo in ifo_list:
     ifo.minimum_frequency = waveform_arguments["minimum_frequency"]
 
-ifo_list.set_strain_data_from_zero_noise(
-    sampling_frequency=sampling_frequency, duration=duration, start_time=start_time
-)
+if args.noise_store is not None:
+    noise_realizations.NoiseStore(args.noise_store).set_strain_data(
+        ifo_list, args.noise_index, sampling_frequency=sampling_frequency, duration=duration, start_time=start_time)
+else:
+    ifo_list.set_strain_data_from_zero_noise(
+        sampling_frequency=sampling_frequency, duration=duration, start_time=start_time
+    )
 ifo_list.inject_signal(
     parameters=injection_parameters, waveform_generator=waveform_generator
 )
@@ -144,28 +268,90 @@ bilby.core.utils.check_directory_exists_and_if_not_mkdir(args.outdir)
 ifo_list.plot_data(outdir=args.outdir, label=args.label)
 
 #-----------------------------------------------------------------
-likelihood = bilby.gw.GravitationalWaveTransient(
-    interferometers=ifo_list, 
-    waveform_generator=waveform_generator,
-    time_marginalization=True, 
-    phase_marginalization=True,
-    distance_marginalization=False, 
-    priors=priors)
+likelihood_class = bilby.gw.GravitationalWaveTransient
+if args.mixed_precision:
+    likelihood_class = mixed_precision.MixedPrecisionGravitationalWaveTransient
+
+if args.long_duration:
+    likelihood = long_duration.BlockedGravitationalWaveTransient(
+        ifo_list, waveform_generator, priors=priors,
+        block_memory=int(args.block_memory * 2 ** 20), directory=args.block_dir)
+else:
+    likelihood = likelihood_class(
+        interferometers=ifo_list, 
+        waveform_generator=waveform_generator,
+        time_marginalization=True, 
+        phase_marginalization=True,
+        distance_marginalization=False, 
+        priors=priors)
 
 #-----------------------------------------------------------------
-result = bilby.run_sampler(
+if args.mixed_precision:
+    mixed_precision.check(likelihood, priors, points=args.mixed_precision_points, parameters=[injection_parameters])
+
+if args.profile:
+    profiling.instrument_likelihood(likelihood)
+
+if args.rapid:
+    rapid.run(likelihood, priors, args.outdir, args.label, npool=args.npool, grid_points=args.rapid_grid_points)
+    sys.exit()
+
+conversion_function = postprocessing.generate_all_nrtidal_d_parameters
+if args.long_duration:
+    conversion_function = long_duration.conversion_function
+if args.warm_start is not None:
+    priors = warm_start.start(priors, args.warm_start, conversion_function)
+    conversion_function = warm_start.conversion_function
+
+sampler_settings = dict(nlive=1500, nact=5, dlogz=0.1)
+if args.budget_hours is not None or args.budget_core_hours is not None:
+    sampler_settings = sampler_budget.choose_settings(
+        likelihood, priors, npool=args.npool,
+        wall_hours=args.budget_hours, core_hours=args.budget_core_hours,
+        precision=args.xi_precision, log_evidence_error=args.log_evidence_error)
+
+if args.metrics:
+    progress.start(args.outdir, args.label, priors, port=args.metrics_port, dlogz=sampler_settings["dlogz"])
+    sampler_settings["print_func"] = progress.print_func
+
+sampler = "dynesty"
+if args.preemptible:
+    sampler = checkpointing.register()
+    sampler_settings["checkpoint_interval"] = args.checkpoint_interval
+
+run_sampler = bilby.run_sampler
+if args.cache_dir is not None:
+    run_sampler = run_cache.RunCache(
+        args.cache_dir, input_files=[args.asd_dir + "cosmic_explorer_strain.txt"]).run_sampler
+
+result = run_sampler(
         likelihood=likelihood, 
         priors=priors, 
-        sampler="dynesty", 
+        sampler=sampler, 
         sample = 'rwalk',
         bound = 'live',
-        nlive=1500, 
-        nact=5, 
-        dlogz=0.1, 
+        **sampler_settings,
         maxmcmc=5000,
         check_point_delta_t=7200,
         npool=args.npool, 
         outdir=args.outdir, label=args.label,
-        conversion_function=bilby.gw.conversion.generate_all_bns_parameters)
+        injection_parameters=injection_parameters,
+        conversion_function=conversion_function)
+
+if args.warm_start is not None:
+    warm_start.finish(result)
+
+if args.mixed_precision:
+    mixed_precision.finish(result)
+
+if args.metrics:
+    progress.stop()
+
+if args.profile:
+    profiling.write_profile(args.outdir, args.label)
+
+posterior_store.write(posterior_store.store_file(args.outdir, args.label), result,
+                      nested_samples=args.store_nested_samples)
 
-result.plot_corner()
+if not args.defer_plots:
+    result.plot_corner()
@@ -0,0 +1,382 @@
+"""
+Preemption-safe, incremental checkpointing of bilby's dynesty sampler.
+
+PreemptibleDynesty is bilby's Dynesty sampler with three changes:
+
+    + SIGTERM/SIGINT (e.g. preemption) and SIGUSR1 set a flag, and the checkpoint
+      is written at the end of the current batch of likelihood calls, so it
+      never catches dynesty in the middle of an iteration. The batches are made
+      short enough (checkpoint_latency seconds) to fit in a scheduler's grace period.
+      SIGTERM/SIGINT then exit, as in bilby; SIGUSR1 carries on (e.g. sbatch
+      --signal=B:USR1@600 to checkpoint ahead of the time limit).
+      A second SIGTERM/SIGINT checkpoints and exits at once.
+    + The dead points are not pickled with the sampler: each checkpoint appends
+      only the new ones to {outdir}/{label}_dead_points.log, so a checkpoint
+      costs the same at the end of a run as at the start, and can be written
+      every checkpoint_interval seconds (the diagnostic plots are still only
+      made every check_point_delta_t seconds).
+    + The log is fsync'd before the resume file is replaced. Each log frame
+      carries a chained sha256 digest, and the resume file records the size and
+      digest of the log it refers to, so on resume the dead points are checked
+      against the digest of the checkpoint (a frame left half-written by an
+      interrupted checkpoint is dropped).
+
+Checkpoints are only written between batches, so a batch lasts at most
+min(checkpoint_latency, checkpoint_interval) seconds: a checkpoint is written
+at the end of the first batch after checkpoint_interval seconds, or after a
+signal. Unlike bilby's, the resume file also holds the random states (dynesty's,
+bilby's, and the state that bilby's walks keep between calls) and dynesty's
+queue of proposed points, so with npool=1 a resumed run has the same dead points
+and posterior, bit for bit, as a run that was not interrupted (see
+test_checkpointing.py). With a pool, bilby's walks keep that state in each
+worker, and a run is not reproducible even when it is not interrupted.
+
+Use it with bilby.run_sampler(sampler=checkpointing.register(), ...).
+"""
+import hashlib
+import os
+import pickle
+import signal
+import struct
+import time
+import warnings
+
+import bilby
+import numpy as np
+from bilby.core.sampler.dynesty import Dynesty
+try:
+    from bilby.core.sampler import dynesty3_utils
+except ImportError:
+    dynesty3_utils = None
+
+logger = bilby.core.utils.logger
+
+SAMPLER_NAME = "preemptible_dynesty"
+
+# Evidence integrals of the run record, which dynesty recomputes over the
+# whole run at the end of each run_nested call.
+INTEGRALS = ["logwt", "logz", "logzvar", "h"]
+
+# Class attributes in which bilby's walks keep state between calls
+WALK_STATE = [("ACTTrackingEnsembleWalk", "_cache"), ("AcceptanceTrackingRWalk", "old_act")]
+
+class CheckpointError(Exception):
+    pass
+
+def _fsync(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class DeadPointLog(object):
+    """
+    Append-only log of dynesty's run record (the dead points).
+    Pickled in place of the run record in the resume file: only its
+    size, digest, the lengths of the record's lists and the evidence
+    integrals (as float64 arrays) are stored.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.size = 0
+        self.digest = b""
+        self.lengths = {}
+        self.record = None
+        self.integrals = {}
+        self._logged = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_logged"] = {}
+        return state
+
+    def append(self, run):
+        """
+        Append the entries of the run record added since the last call
+        (dynesty appends to its lists, and only removes the final live points
+        it adds at the end of a run), and keep a copy of the evidence integrals.
+        Returns the number of entries written.
+        """
+        frame = {}
+        written = 0
+        self.integrals = {key: np.asarray(run[key], dtype=np.float64) for key in INTEGRALS}
+        for key in run.keys():
+            if key in INTEGRALS:
+                continue
+            values = run[key]
+            length = self.lengths.get(key, 0)
+            count = length if values is self._logged.get(key) else 0
+            count = min(count, len(values))
+            if count < len(values) or count < length:
+                frame[key] = (count, values[count:])
+                written = max(written, len(values) - count)
+            self.lengths[key] = len(values)
+            self._logged[key] = values
+
+        if self.record is None:
+            self.record = type(run)()
+            for key in run.keys():
+                self.record[key] = []
+
+        if len(frame) > 0:
+            payload = pickle.dumps(frame, protocol=pickle.HIGHEST_PROTOCOL)
+            digest = hashlib.sha256(self.digest + payload).digest()
+            with open(self.filename, "r+b" if self.size > 0 else "wb") as f:
+                f.seek(self.size)
+                f.truncate()
+                f.write(struct.pack("<Q", len(payload)))
+                f.write(payload)
+                f.write(digest)
+                f.flush()
+                os.fsync(f.fileno())
+            self.size += 8 + len(payload) + len(digest)
+            self.digest = digest
+        return written
+
+    def restore(self, directory):
+        """
+        Rebuild the run record from the log (in directory) and verify it
+        against the size, digest and lengths stored in the resume file.
+        """
+        self.filename = os.path.join(directory, os.path.basename(self.filename))
+        if not os.path.isfile(self.filename) or os.path.getsize(self.filename) < self.size:
+            raise CheckpointError("dead point log {} is missing or truncated".format(self.filename))
+
+        lists = {key: [] for key in self.record.keys()}
+        digest = b""
+        position = 0
+        with open(self.filename, "rb") as f:
+            while position < self.size:
+                (length,) = struct.unpack("<Q", f.read(8))
+                payload = f.read(length)
+                digest = hashlib.sha256(digest + payload).digest()
+                if f.read(len(digest)) != digest:
+                    raise CheckpointError("digest mismatch at byte {} of {}".format(position, self.filename))
+                for key, (start, values) in pickle.loads(payload).items():
+                    del lists[key][start:]
+                    lists[key].extend(values)
+                position += 8 + length + len(digest)
+
+        if position != self.size or digest != self.digest:
+            raise CheckpointError("{} does not match the resume file".format(self.filename))
+        for key in INTEGRALS:
+            lists[key] = self.integrals[key].tolist()
+        for key, values in lists.items():
+            if key not in INTEGRALS and len(values) != self.lengths.get(key, 0):
+                raise CheckpointError("{} has {} entries of {}, expected {}".format(
+                    self.filename, len(values), key, self.lengths.get(key, 0)))
+
+        # drop a frame appended by a checkpoint that was interrupted before the resume file was replaced
+        with open(self.filename, "r+b") as f:
+            f.truncate(self.size)
+
+        run = self.record
+        self.record = type(run)()
+        for key, values in lists.items():
+            run[key] = values
+            self.record[key] = []
+            self._logged[key] = values
+        logger.info("Verified {} dead points from {} (sha256 {})".format(
+            len(lists.get("logl", [])), self.filename, self.digest.hex()[:16]))
+        return run
+
+class PreemptibleDynesty(Dynesty):
+    """
+    bilby's Dynesty sampler with signal-triggered, incremental checkpoints.
+
+    checkpoint_interval: seconds between (incremental) checkpoints
+    checkpoint_latency: target seconds between a signal and its checkpoint
+    (the batches last at most the smaller of the two)
+    """
+    def __init__(self, likelihood, priors, checkpoint_interval=600., checkpoint_latency=60., **kwargs):
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_latency = checkpoint_latency
+        self._checkpoint_requested = False
+        self._exit_signal = None
+        self._sampling = False
+        super(PreemptibleDynesty, self).__init__(likelihood, priors, **kwargs)
+
+        self._dead_points = DeadPointLog(os.path.join(self.outdir, "{}_dead_points.log".format(self.label)))
+        if self.check_point:
+            npool = max(self.npool or 1, 1)
+            batch_seconds = min(self.checkpoint_latency, self.checkpoint_interval)
+            self.n_check_point = min(self.n_check_point, max(
+                int(batch_seconds * npool / self._log_likelihood_eval_time / 2), 10))
+            logger.info("Incremental checkpoint every {}s, and within ~{}s of SIGTERM/SIGUSR1 "
+                        "(batches of {} likelihood calls)".format(
+                            self.checkpoint_interval, self.checkpoint_latency, self.n_check_point))
+
+    @property
+    def external_sampler_name(self):
+        return "dynesty"
+
+    def run_sampler(self):
+        try:
+            old_usr1 = signal.signal(signal.SIGUSR1, self._request_checkpoint)
+        except (AttributeError, ValueError):
+            old_usr1 = None
+        try:
+            return super(PreemptibleDynesty, self).run_sampler()
+        finally:
+            if old_usr1 is not None:
+                signal.signal(signal.SIGUSR1, old_usr1)
+
+    def _request_checkpoint(self, signum=None, frame=None):
+        self._checkpoint_requested = True
+
+    def write_current_state_and_exit(self, signum=None, frame=None):
+        if self._sampling and self._exit_signal is None:
+            self._exit_signal = signum
+            return
+        super(PreemptibleDynesty, self).write_current_state_and_exit(signum=signum, frame=frame)
+
+    def _run_external_sampler_with_checkpointing(self):
+        """
+        As in bilby, run the sampler in short batches, checkpointing between them:
+        every checkpoint_interval seconds, or when a signal was received.
+        """
+        logger.debug("Running sampler with incremental checkpointing")
+
+        old_ncall = self.sampler.ncall
+        sampler_kwargs = self.sampler_function_kwargs.copy()
+        warnings.filterwarnings(
+            "ignore",
+            message="The sampling was stopped short due to maxiter/maxcall limit*",
+            category=UserWarning,
+            module="dynesty.sampler",
+        )
+        last_checkpoint = last_plot = time.time()
+        self._sampling = True
+        while True:
+            self.finalize_sampler_kwargs(sampler_kwargs)
+            self._remove_live()
+            self.sampler.run_nested(**sampler_kwargs)
+            if self.sampler.ncall == old_ncall:
+                break
+            old_ncall = self.sampler.ncall
+
+            if self._exit_signal is not None:
+                self._sampling = False
+                self.write_current_state_and_exit(signum=self._exit_signal)
+
+            now = time.time()
+            if self._checkpoint_requested or now - last_checkpoint > self.checkpoint_interval:
+                if self._checkpoint_requested:
+                    logger.info("Checkpoint requested by signal")
+                self._checkpoint_requested = False
+                self.write_current_state()
+                last_checkpoint = now
+            if now - last_plot > self.check_point_delta_t:
+                self._add_live()
+                self.plot_current_state()
+                self._remove_live()
+                last_plot = now
+        self._sampling = False
+
+        self._remove_live()
+        self.write_current_state()
+        sampler_kwargs["add_live"] = self.kwargs.get("add_live", True)
+        self.sampler.run_nested(**sampler_kwargs)
+        self.plot_current_state()
+        return self.sampler.results
+
+    def write_current_state(self):
+        """
+        Append the new dead points to the log, then write the resume file
+        (bilby's, with the log in place of the run record).
+        """
+        if getattr(self, "sampler", None) is None or isinstance(self.sampler.saved_run, DeadPointLog):
+            # no sampler yet, or interrupted while checkpointing
+            return
+        if self._exit_signal is not None:
+            logger.info("Checkpointing on signal {}".format(self._exit_signal))
+
+        start = time.perf_counter()
+        self._remove_live()
+        bilby.core.utils.check_directory_exists_and_if_not_mkdir(self.outdir)
+        run = self.sampler.saved_run
+        written = self._dead_points.append(run)
+        self.sampler.saved_run = self._dead_points
+        self.sampler.random_state = self._random_state()
+        try:
+            super(PreemptibleDynesty, self).write_current_state()
+        finally:
+            self.sampler.saved_run = run
+            del self.sampler.random_state
+        if os.path.isfile(self.resume_file):
+            _fsync(self.resume_file)
+            _fsync(self.outdir)
+        logger.info("Incremental checkpoint: {} new dead points, {:.2f} MB log, {:.2f}s".format(
+            written, self._dead_points.size / 1e6, time.perf_counter() - start))
+
+    def read_saved_state(self, continuing=False):
+        """
+        Read the resume file (incremental, or written by bilby's Dynesty) and
+        rebuild and verify the run record from the dead point log.
+        """
+        if not super(PreemptibleDynesty, self).read_saved_state(continuing=False):
+            return False
+        run = self.sampler.saved_run
+        if isinstance(run, DeadPointLog):
+            try:
+                self.sampler.saved_run = run.restore(os.path.dirname(os.path.abspath(self.resume_file)))
+            except (CheckpointError, OSError, EOFError, struct.error, pickle.UnpicklingError) as e:
+                logger.warning("Cannot restore the dead points: {}. The resume file will be ignored.".format(e))
+                self.sampler = None
+                return False
+            self._dead_points = run
+        else:
+            logger.info("Resuming from a full checkpoint, incremental checkpoints from now on")
+        # bilby drops the queue of proposed points (nqueue = -1), which makes dynesty propose an extra point
+        self.sampler.nqueue = len(self.sampler.queue)
+        random_state = self.sampler.__dict__.pop("random_state", None)
+        if random_state is not None:
+            self._set_random_state(random_state)
+        else:
+            logger.info("No random state in the resume file: the resumed run will differ from an uninterrupted one")
+        if continuing:
+            self._remove_live()
+        return True
+
+    def _random_state(self):
+        """
+        The random states of dynesty and bilby, and the state of bilby's walks.
+        """
+        walks = {}
+        for name, attribute in WALK_STATE:
+            walk = getattr(dynesty3_utils, name, None)
+            if walk is not None and hasattr(walk, attribute):
+                walks[(name, attribute)] = pickle.loads(pickle.dumps(getattr(walk, attribute)))
+        return dict(sampler=self.sampler.rstate.bit_generator.state,
+                    bilby=bilby.core.utils.random.rng.bit_generator.state, walks=walks)
+
+    def _set_random_state(self, random_state):
+        self.sampler.rstate.bit_generator.state = random_state["sampler"]
+        bilby.core.utils.random.rng.bit_generator.state = random_state["bilby"]
+        for (name, attribute), value in random_state["walks"].items():
+            setattr(getattr(dynesty3_utils, name), attribute, value)
+
+    def _remove_checkpoint(self):
+        super(PreemptibleDynesty, self)._remove_checkpoint()
+        if os.path.isfile(self._dead_points.filename):
+            os.remove(self._dead_points.filename)
+
+class _EntryPoint(object):
+    def __init__(self, sampler_class):
+        self.sampler_class = sampler_class
+
+    def load(self):
+        return self.sampler_class
+
+def register():
+    """
+    Make PreemptibleDynesty available to bilby.run_sampler, and return its name.
+    """
+    samplers = bilby.core.sampler.IMPLEMENTED_SAMPLERS
+    if isinstance(samplers, dict):
+        samplers[SAMPLER_NAME] = PreemptibleDynesty
+    else:
+        # bilby >= 2.3 looks samplers up in a registry of entry points
+        samplers._samplers[SAMPLER_NAME] = _EntryPoint(PreemptibleDynesty)
+    return SAMPLER_NAME
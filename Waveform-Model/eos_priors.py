@@ -0,0 +1,187 @@
+"""
+EOS-informed priors on lambda_s (and xi_tilde) from tabulated EOSs.
+
+Each EOS table is a text file with columns
+
+    mass [M_sun]   Lambda   [Xi]
+
+(one row per stable star, Xi optional). The masses of the binary are drawn
+from the chirp mass and mass ratio priors of the run (in the source frame, for
+the given redshift), and for each EOS
+
+    lambda_s = (Lambda(m_1) + Lambda(m_2))/2
+    xi_tilde = [f1(eta) (Xi_1 + Xi_2)/2 + g1(eta) (Xi_1 - Xi_2)/2] / 8
+
+(xi_tilde in the units of the code, see the README), the EOSs weighted equally
+and masses above the maximum mass of an EOS discarded. The resulting marginal
+densities are tabulated once on the range of the run's priors (xi_tilde of the
+EOS tables reaches ~1e4), cached on disk, keyed by the sha256 of the tables and
+of the settings, and used as bilby Interped priors: draws are inverse-CDF
+interpolations. The lambda_1, lambda_2 Constraint priors of the run are kept.
+
+These are marginal priors (over the masses and EOSs), not conditional on the
+masses; for a well measured chirp mass (e.g. GW170817) the difference is small.
+"""
+import hashlib
+import json
+import os
+
+import bilby
+import numpy as np
+
+logger = bilby.core.utils.logger
+
+# Mass draws per EOS, and points of the tabulated densities.
+MASS_DRAWS = 100000
+GRID_POINTS = 1000
+
+# Floor of the tabulated densities (relative to their maximum), so that the
+# cumulative distribution is strictly increasing and can be inverted.
+DENSITY_FLOOR = 1e-6
+
+# Range of the tabulated densities if the run has no prior on the parameter
+# (a maximum of None is the largest sample).
+RANGES = dict(lambda_s=(0., None), xi_tilde=(0., 1000.))
+
+def read_eos_table(filename):
+    """
+    Masses, Lambdas and (if tabulated) Xis of an EOS, on its stable branch
+    (up to the maximum mass), sorted by mass.
+    """
+    table = np.atleast_2d(np.loadtxt(filename))
+    mass = table[:, 0]
+    stable = slice(0, int(np.argmax(mass)) + 1)
+    order = np.argsort(mass[stable])
+    columns = [table[stable, i][order] for i in range(table.shape[1])]
+    return dict(
+        mass=columns[0],
+        lambda_=columns[1],
+        xi=columns[2] if len(columns) > 2 else None,
+    )
+
+def _xi_tilde(xi_1, xi_2, mass_1, mass_2):
+    eta = mass_1 * mass_2 / (mass_1 + mass_2) ** 2
+    root = np.sqrt(np.maximum(1 - 4 * eta, 0.))
+    f1 = 8 * (2 * eta ** 2 - 4 * eta + 1)
+    g1 = - 8 * root * (1 - 2 * eta)
+    return (0.5 * (xi_1 + xi_2) * f1 + 0.5 * (xi_1 - xi_2) * g1) / 8
+
+def draw_source_masses(priors, n, redshift=0., seed=None):
+    """
+    Source-frame component masses from the chirp_mass and mass_ratio priors.
+    """
+    rng = np.random.default_rng(seed)
+    chirp_mass = priors["chirp_mass"].rescale(rng.uniform(size=n))
+    mass_ratio = priors["mass_ratio"].rescale(rng.uniform(size=n))
+    mass_1, mass_2 = bilby.gw.conversion.chirp_mass_and_mass_ratio_to_component_masses(chirp_mass, mass_ratio)
+    return mass_1 / (1 + redshift), mass_2 / (1 + redshift)
+
+def tidal_samples(tables, mass_1, mass_2):
+    """
+    lambda_s (and xi_tilde, if all tables have Xi) over the EOSs, for the given masses.
+    """
+    lambda_s = []
+    xi_tilde = []
+    with_xi = all(table["xi"] is not None for table in tables)
+    for table in tables:
+        valid = (mass_1 <= table["mass"][-1]) & (mass_2 >= table["mass"][0])
+        m_1, m_2 = mass_1[valid], mass_2[valid]
+        lambda_s.append(0.5 * (np.interp(m_1, table["mass"], table["lambda_"]) +
+                               np.interp(m_2, table["mass"], table["lambda_"])))
+        if with_xi:
+            xi_tilde.append(_xi_tilde(
+                np.interp(m_1, table["mass"], table["xi"]), np.interp(m_2, table["mass"], table["xi"]), m_1, m_2))
+    samples = dict(lambda_s=np.concatenate(lambda_s))
+    if with_xi:
+        samples["xi_tilde"] = np.concatenate(xi_tilde)
+    return samples
+
+def tabulate(samples, minimum=0., maximum=None, points=GRID_POINTS):
+    """
+    Histogram density of the samples in [minimum, maximum] (samples outside are
+    dropped), on the bin centres and the two edges.
+    """
+    if maximum is None:
+        maximum = np.max(samples)
+    edges = np.linspace(minimum, maximum, points + 1)
+    density, _ = np.histogram(samples, bins=edges, density=True)
+    density = np.maximum(density, DENSITY_FLOOR * np.max(density))
+    grid = np.concatenate([[minimum], 0.5 * (edges[1:] + edges[:-1]), [maximum]])
+    return grid, np.concatenate([density[:1], density, density[-1:]])
+
+def prior_ranges(priors):
+    """
+    Range of the tabulated densities: that of the run's priors, or RANGES.
+    """
+    ranges = {}
+    for name, (minimum, maximum) in RANGES.items():
+        prior = priors.get(name)
+        minimum, maximum = getattr(prior, "minimum", minimum), getattr(prior, "maximum", maximum)
+        ranges[name] = (float(minimum), None if maximum is None else float(maximum))
+    return ranges
+
+def _cache_key(eos_files, priors, redshift, ranges, seed):
+    sha = hashlib.sha256()
+    for filename in sorted(eos_files):
+        with open(filename, "rb") as f:
+            sha.update(hashlib.sha256(f.read()).digest())
+    settings = dict(
+        chirp_mass=repr(priors["chirp_mass"]), mass_ratio=repr(priors["mass_ratio"]),
+        redshift=redshift, ranges=ranges, mass_draws=MASS_DRAWS, grid_points=GRID_POINTS,
+        density_floor=DENSITY_FLOOR, seed=seed)
+    sha.update(json.dumps(settings, sort_keys=True).encode())
+    return sha.hexdigest()
+
+def tabulated_densities(eos_files, priors, redshift=0., cache_dir=None, seed=1234):
+    """
+    Tabulated densities {name: (grid, density)} of lambda_s (and xi_tilde) on
+    the range of their priors (see prior_ranges), read from cache_dir if they
+    have been computed before.
+    """
+    ranges = prior_ranges(priors)
+    cache_file = None
+    if cache_dir is not None:
+        bilby.core.utils.check_directory_exists_and_if_not_mkdir(cache_dir)
+        cache_file = os.path.join(cache_dir, "eos_prior_{}.npz".format(
+            _cache_key(eos_files, priors, redshift, ranges, seed)))
+        if os.path.isfile(cache_file):
+            logger.info("Reading the EOS priors from {}".format(cache_file))
+            with np.load(cache_file) as data:
+                names = [key[:-len("_grid")] for key in data.files if key.endswith("_grid")]
+                return {name: (data[name + "_grid"], data[name + "_density"]) for name in names}
+
+    tables = [read_eos_table(f) for f in eos_files]
+    mass_1, mass_2 = draw_source_masses(priors, MASS_DRAWS, redshift, seed)
+    samples = tidal_samples(tables, mass_1, mass_2)
+    if len(samples["lambda_s"]) == 0:
+        raise ValueError("No EOS supports the masses of the prior")
+    densities = {name: tabulate(values, *ranges[name]) for name, values in samples.items()}
+    logger.info("EOS priors from {} EOSs and {} mass draws: {}".format(
+        len(tables), MASS_DRAWS, ", ".join(densities)))
+
+    if cache_file is not None:
+        tmp = cache_file + ".tmp.npz"
+        np.savez(tmp, **{"{}_{}".format(name, part): array
+                         for name, (grid, density) in densities.items()
+                         for part, array in [("grid", grid), ("density", density)]})
+        os.replace(tmp, cache_file)
+    return densities
+
+def eos_tidal_priors(eos_files, priors, redshift=0., cache_dir=None, seed=1234):
+    """
+    bilby Interped priors on lambda_s (and on xi_tilde, if all tables have Xi).
+    """
+    latex_labels = dict(lambda_s="$\\Lambda_s$", xi_tilde="$\\tilde{\\Xi}$")
+    return {name: bilby.core.prior.Interped(
+                grid, density, minimum=grid[0], maximum=grid[-1], name=name, latex_label=latex_labels[name])
+            for name, (grid, density) in tabulated_densities(
+                eos_files, priors, redshift, cache_dir, seed).items()}
+
+def use_eos_priors(priors, eos_files, redshift=0., cache_dir=None):
+    """
+    Replace the lambda_s (and xi_tilde) priors of a binary Love run by EOS-informed
+    ones, on the same ranges (the lambda_1, lambda_2 constraints are kept).
+    """
+    for name, prior in eos_tidal_priors(eos_files, priors, redshift, cache_dir).items():
+        priors[name] = prior
+    return priors
@@ -0,0 +1,208 @@
+"""
+Memory-bounded likelihood for long-duration analyses (e.g. Cosmic Explorer
+from a few Hz, thousands of seconds of data).
+
+With GravitationalWaveTransient every likelihood call holds the polarizations,
+the detector responses and (with time marginalization) their FFTs on the whole
+frequency grid: tens of millions of bins per detector and pool worker. Here the
+analysis band of the interferometers is split into blocks of frequencies, and
+
+    <d, h> = sum_blocks sum_f 4/T conj(d) h/S
+    <h, h> = sum_blocks sum_f 4/T |h|^2/S
+
+are accumulated block by block: the waveform is evaluated only on the
+frequencies of one block at a time (nrtidal_d.source_binary_love_frequency_sequence,
+LAL's frequency sequence), so that the memory of a call is bounded by the block
+size, which is chosen from a memory budget per worker. The data are held as
+4/T conj(d)/S and 4/T /S on the band only, memory-mapped from files (in the
+given directory, or a temporary one) that the pool workers share through the
+page cache rather than each holding a copy. The noise log
+likelihood is computed once, and the likelihood pickled to the workers keeps
+only the geometry of the detectors, not their strain and PSDs on the full grid.
+
+The phase is marginalized (as GravitationalWaveTransient); time
+marginalization needs the FFT of the whole grid, so geocent_time is sampled.
+"""
+import atexit
+import os
+import shutil
+import tempfile
+
+import bilby
+import numpy as np
+from bilby_cython.geometry import get_polarization_tensor, three_by_three_matrix_contraction, time_delay_from_geocenter
+from scipy.special import i0e
+
+import postprocessing
+import profiling
+
+logger = bilby.core.utils.logger
+
+# Bytes per frequency of a block during a likelihood call: the polarizations (also
+# in LAL), the dissipative phase rotation, the detector response and time shift,
+# and the data of the block.
+BYTES_PER_FREQUENCY = 256
+
+# Default memory budget of the blocks (bytes per worker).
+BLOCK_MEMORY = 2 ** 28
+
+class FrequencyBlocks(object):
+    """
+    The data of the interferometers on their analysis band (below Nyquist),
+    for blocks of at most block_size frequencies: the frequencies,
+    4/T conj(d)/S and 4/T /S (zero outside the band of each detector). The
+    arrays are written to directory (default a temporary directory, removed at
+    exit) and memory-mapped.
+    """
+    def __init__(self, interferometers, block_size, directory=None):
+        frequency_array = interferometers[0].frequency_array
+        nyquist = interferometers[0].strain_data.sampling_frequency / 2
+        masks = np.array([ifo.frequency_mask & (frequency_array < nyquist) for ifo in interferometers])
+        band = np.flatnonzero(np.any(masks, axis=0))
+        self.start, self.stop = band[0], band[-1] + 1
+        self.block_size = int(block_size)
+        self.names = [ifo.name for ifo in interferometers]
+
+        arrays = dict(
+            frequency_array=frequency_array[self.start:self.stop],
+            data=np.array([
+                np.where(mask[self.start:self.stop], 4. / ifo.strain_data.duration * np.conj(
+                    ifo.frequency_domain_strain[self.start:self.stop]) /
+                    ifo.power_spectral_density_array[self.start:self.stop], 0.)
+                for ifo, mask in zip(interferometers, masks)]),
+            weight=np.array([
+                np.where(mask[self.start:self.stop],
+                         4. / ifo.strain_data.duration / ifo.power_spectral_density_array[self.start:self.stop], 0.)
+                for ifo, mask in zip(interferometers, masks)]))
+        if directory is None:
+            directory = tempfile.mkdtemp(prefix="frequency_blocks_")
+            atexit.register(shutil.rmtree, directory, True)
+        self.directory = directory
+        bilby.core.utils.check_directory_exists_and_if_not_mkdir(directory)
+        for name, array in arrays.items():
+            np.save(os.path.join(directory, "{}.npy".format(name)), array)
+        del arrays
+        self._map()
+        logger.info("{} frequencies of {} in {} blocks of {}, memory-mapped from {}".format(
+            len(self.frequency_array), ", ".join(self.names), len(self), self.block_size, directory))
+
+    def _map(self):
+        for name in ["frequency_array", "data", "weight"]:
+            setattr(self, name, np.load(os.path.join(self.directory, "{}.npy".format(name)), mmap_mode="r"))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # workers map the files again rather than receive copies of the data
+        for name in ["frequency_array", "data", "weight"]:
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._map()
+
+    def __len__(self):
+        return int(np.ceil(len(self.frequency_array) / self.block_size))
+
+    def __iter__(self):
+        for start in range(0, len(self.frequency_array), self.block_size):
+            yield slice(start, start + self.block_size)
+
+class BlockedGravitationalWaveTransient(bilby.core.likelihood.Likelihood):
+    """
+    GravitationalWaveTransient (phase marginalization, no time or distance
+    marginalization) accumulated over blocks of frequencies, the memory of a
+    call bounded by block_memory (bytes). The source model of waveform_generator
+    must take any frequencies (e.g. nrtidal_d.source_binary_love_frequency_sequence).
+    directory: memory-map the data from there (default a temporary directory).
+    The interferometers are not pickled (see __getstate__).
+    """
+    def __init__(self, interferometers, waveform_generator, priors=None, phase_marginalization=True,
+                 block_memory=BLOCK_MEMORY, directory=None):
+        super(BlockedGravitationalWaveTransient, self).__init__(dict())
+        self.interferometers = bilby.gw.detector.InterferometerList(interferometers)
+        self.waveform_generator = waveform_generator
+        self.phase_marginalization = phase_marginalization
+        self.time_marginalization = False
+        self.distance_marginalization = False
+        self.priors = priors
+        if self.phase_marginalization and priors is not None:
+            priors["phase"] = float(0)
+        self.block_memory = block_memory
+        self.blocks = FrequencyBlocks(
+            self.interferometers, max(block_memory // BYTES_PER_FREQUENCY, 1), directory)
+        self._source_keys = bilby.core.utils.infer_parameters_from_function(
+            waveform_generator.frequency_domain_source_model)
+        self.detectors = [(ifo.geometry.detector_tensor, ifo.geometry.vertex, ifo.strain_data.start_time)
+                          for ifo in self.interferometers]
+        self._noise_log_likelihood = sum(
+            -np.sum(np.abs(ifo.frequency_domain_strain[ifo.frequency_mask]) ** 2 /
+                    ifo.power_spectral_density_array[ifo.frequency_mask]) * 2. / ifo.strain_data.duration
+            for ifo in self.interferometers)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # the workers need the detector geometry and the blocks, not the strain and PSDs on the full grid
+        state["interferometers"] = None
+        return state
+
+    def __repr__(self):
+        return "{}(interferometers={}, block_memory={})".format(
+            self.__class__.__name__, self.blocks.names, self.block_memory)
+
+    def source_parameters(self, parameters=None):
+        parameters = dict(bilby.gw.likelihood.base._fallback_to_parameters(self, parameters))
+        if self.phase_marginalization:
+            parameters["phase"] = 0.
+        parameters, _ = self.waveform_generator.parameter_conversion(parameters)
+        return parameters, {key: parameters[key] for key in self._source_keys}
+
+    def inner_products(self, parameters=None):
+        """
+        <d, h> and <h, h>, summed over the interferometers and the blocks.
+        """
+        parameters, source_parameters = self.source_parameters(parameters)
+        waveform_arguments = self.waveform_generator.waveform_arguments
+        responses = []
+        for detector_tensor, vertex, start_time in self.detectors:
+            # as Interferometer.antenna_response and time_delay_from_geocenter
+            antenna = {mode: three_by_three_matrix_contraction(detector_tensor, get_polarization_tensor(
+                parameters["ra"], parameters["dec"], parameters["geocent_time"], parameters["psi"], mode))
+                for mode in ["plus", "cross"]}
+            # the GPS times first, as in bilby
+            dt = (parameters["geocent_time"] - start_time) + time_delay_from_geocenter(
+                vertex, parameters["ra"], parameters["dec"], parameters["geocent_time"])
+            responses.append((antenna, dt))
+
+        d_inner_h, optimal_snr_squared = 0j, 0.
+        for block in self.blocks:
+            frequency_array = np.asarray(self.blocks.frequency_array[block])
+            with profiling.timer("waveform_block"):
+                polarizations = self.waveform_generator.frequency_domain_source_model(
+                    frequency_array, **source_parameters, **waveform_arguments)
+            with profiling.timer("inner_products_block"):
+                for i, (antenna, dt) in enumerate(responses):
+                    signal = polarizations["plus"] * antenna["plus"] + polarizations["cross"] * antenna["cross"]
+                    signal *= np.exp(-2j * np.pi * dt * frequency_array)
+                    d_inner_h += np.dot(self.blocks.data[i, block], signal)
+                    optimal_snr_squared += np.dot(self.blocks.weight[i, block], np.abs(signal) ** 2)
+        return d_inner_h, optimal_snr_squared
+
+    def log_likelihood_ratio(self, parameters=None):
+        d_inner_h, optimal_snr_squared = self.inner_products(parameters)
+        if self.phase_marginalization:
+            return float(np.log(i0e(np.abs(d_inner_h))) + np.abs(d_inner_h) - optimal_snr_squared / 2)
+        return float(np.real(d_inner_h) - optimal_snr_squared / 2)
+
+    def noise_log_likelihood(self):
+        return self._noise_log_likelihood
+
+    def log_likelihood(self, parameters=None):
+        return self.log_likelihood_ratio(parameters) + self.noise_log_likelihood()
+
+def conversion_function(sample, likelihood=None, priors=None, npool=1):
+    """
+    postprocessing.generate_all_nrtidal_d_parameters without the likelihood: the
+    SNRs and the marginalized phase would need the waveforms on the whole grid.
+    """
+    return postprocessing.generate_all_nrtidal_d_parameters(sample, likelihood=None, priors=priors, npool=npool)
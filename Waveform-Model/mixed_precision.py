@@ -0,0 +1,207 @@
+"""
+Opt-in mixed-precision likelihood (runner flag --mixed_precision).
+
+GravitationalWaveTransient computes every product of a likelihood call in
+complex128 on the whole frequency grid: the detector response and time shift,
+conj(d) h/S for <d, h> (and its FFT with time marginalization) and |h|^2/S for
+<h, h>. Most of the time of these is memory traffic. Here
+
+    + the data are stored once, on the analysis band, whitened: as
+      conj(d) sqrt(4/T /S) in complex64 and sqrt(4/T /S) in float32 (|h|^2
+      would underflow in single precision, the whitened signal is of order one)
+    + the polarizations are cast to complex64 once per call, and the detector
+      response, the whitening and the products with the data are complex64
+    + the time shift exp(-2 pi i f dt) is the product of two tables of about
+      sqrt(len(band)) exponentials, each computed in double precision
+    + the sums, the FFT of the time marginalization and the dissipative phase
+      of nrtidal_d stay in double precision
+
+so that the error on ln L comes from the rounding of the stored factors
+(relative 6e-8 each) and grows with the SNR. check() reports the error against
+full precision on prior draws (and given points, e.g. the injection); the
+runners run it before sampling and keep the summary in the result meta data.
+"""
+import time
+
+import bilby
+import numpy as np
+import scipy.fft
+
+import rapid
+
+logger = bilby.core.utils.logger
+
+# Prior draws of the check against full precision.
+CHECK_POINTS = 20
+
+# Largest |Delta ln L| of the check accepted without a warning.
+CHECK_TOLERANCE = 0.01
+
+# Summary of the last check (see finish).
+_summary = None
+
+def time_shift(dt, start_frequency, duration, length):
+    """
+    exp(-2 pi i f dt) in complex64 on `length` frequencies from start_frequency
+    spaced by 1/duration: with f = start_frequency + (a n + b)/duration, the
+    outer product of two tables of n ~ sqrt(length) exponentials (in double
+    precision, then rounded).
+    """
+    n = int(np.ceil(np.sqrt(length)))
+    coarse = np.exp(-2j * np.pi * dt * (start_frequency + np.arange(n) * n / duration)).astype(np.complex64)
+    fine = np.exp(-2j * np.pi * dt * np.arange(n) / duration).astype(np.complex64)
+    return np.multiply.outer(coarse, fine).ravel()[:length]
+
+class MixedPrecisionGravitationalWaveTransient(bilby.gw.GravitationalWaveTransient):
+    """
+    GravitationalWaveTransient with the inner products in mixed precision (see
+    the module docstring), for the settings of the runners (phase and time
+    marginalization, no calibration marginalization); otherwise, and with
+    mixed_precision set to False, the inner products of GravitationalWaveTransient.
+    """
+    def __init__(self, interferometers, waveform_generator, **kwargs):
+        super(MixedPrecisionGravitationalWaveTransient, self).__init__(interferometers, waveform_generator, **kwargs)
+        self.mixed_precision = True
+        masks = np.array([ifo.frequency_mask for ifo in self.interferometers])
+        band = np.flatnonzero(np.any(masks, axis=0))
+        self._start, self._stop = band[0], band[-1] + 1
+        self._data = {}
+        for ifo, mask in zip(self.interferometers, masks):
+            whitening = np.where(mask[self._start:self._stop], np.sqrt(
+                4. / ifo.strain_data.duration / ifo.power_spectral_density_array[self._start:self._stop]), 0.)
+            self._data[ifo.name] = (
+                (np.conj(ifo.frequency_domain_strain[self._start:self._stop]) * whitening).astype(np.complex64),
+                whitening.astype(np.float32))
+        self._polarizations = None, None
+
+    def _single_precision_polarizations(self, waveform_polarizations):
+        """
+        The polarizations on the band in complex64, cast once per waveform.
+        """
+        source, polarizations = self._polarizations
+        if source is not waveform_polarizations["plus"]:
+            polarizations = {mode: np.asarray(value[self._start:self._stop], dtype=np.complex64)
+                             for mode, value in waveform_polarizations.items()}
+            self._polarizations = waveform_polarizations["plus"], polarizations
+        return polarizations
+
+    def _mixed_precision_supported(self, interferometer, parameters):
+        return (self.mixed_precision and not self.calibration_marginalization
+                and "recalib_index" not in parameters
+                and type(interferometer.calibration_model) is bilby.gw.calibration.Recalibrate)
+
+    def calculate_snrs(self, waveform_polarizations, interferometer, return_array=True, parameters=None):
+        parameters = bilby.gw.likelihood.base._fallback_to_parameters(self, parameters)
+        if not self._mixed_precision_supported(interferometer, parameters):
+            return super(MixedPrecisionGravitationalWaveTransient, self).calculate_snrs(
+                waveform_polarizations, interferometer, return_array=return_array, parameters=parameters)
+
+        polarizations = self._single_precision_polarizations(waveform_polarizations)
+        antenna_time = parameters["geocent_time"] if interferometer.reference_time is None else interferometer.reference_time
+        # the GPS times first, as in bilby
+        dt = (parameters["geocent_time"] - interferometer.strain_data.start_time) + interferometer.time_delay_from_geocenter(
+            parameters["ra"], parameters["dec"], parameters["geocent_time"])
+        signal = time_shift(dt, interferometer.frequency_array[self._start], interferometer.strain_data.duration,
+                            self._stop - self._start)
+        response = sum(polarizations[mode] * float(interferometer.antenna_response(
+            parameters["ra"], parameters["dec"], antenna_time, parameters["psi"], mode)) for mode in polarizations)
+        signal *= response
+
+        data, whitening = self._data[interferometer.name]
+        signal *= whitening
+        d_inner_h_integrand = data * signal
+        d_inner_h = complex(np.sum(d_inner_h_integrand, dtype=np.complex128))
+        power = np.abs(signal)
+        power *= power
+        optimal_snr_squared = float(np.sum(power, dtype=np.float64))
+
+        d_inner_h_array = None
+        if return_array and self.time_marginalization:
+            # as GravitationalWaveTransient, without the last (Nyquist) frequency
+            length = len(interferometer.frequency_array) - 1
+            integrand = np.zeros(length, dtype=np.complex128)
+            stop = min(self._stop, length)
+            integrand[self._start:stop] = d_inner_h_integrand[:stop - self._start]
+            d_inner_h_array = scipy.fft.fft(integrand, overwrite_x=True)
+
+        return self._CalculatedSNRs(
+            d_inner_h=d_inner_h,
+            optimal_snr_squared=optimal_snr_squared,
+            complex_matched_filter_snr=d_inner_h / optimal_snr_squared ** 0.5,
+            d_inner_h_array=d_inner_h_array,
+            optimal_snr_squared_array=None,
+        )
+
+def _log_likelihood_ratio(likelihood, parameters, mixed_precision):
+    likelihood.mixed_precision = mixed_precision
+    start = time.perf_counter()
+    log_likelihood_ratio = float(likelihood.log_likelihood_ratio(parameters))
+    return log_likelihood_ratio, time.perf_counter() - start
+
+def prior_draws(priors, points, seed=None):
+    """
+    `points` draws of priors (with the fixed parameters) that satisfy its constraints.
+    """
+    keys = rapid.search_keys(priors)
+    rng = np.random.default_rng(seed)
+    draws = []
+    for _ in range(100 * points):
+        if len(draws) == points:
+            break
+        parameters = rapid.fixed_parameters(priors)
+        parameters.update(zip(keys, priors.rescale(keys, rng.uniform(size=len(keys)))))
+        if priors.evaluate_constraints(parameters):
+            draws.append(parameters)
+    return draws
+
+def check(likelihood, priors, points=CHECK_POINTS, parameters=(), tolerance=CHECK_TOLERANCE, seed=None):
+    """
+    ln L/L_noise of the mixed-precision likelihood against full precision at
+    `points` draws of priors (set up by the likelihood) and at the points
+    (dicts) of parameters, e.g. the injection. The waveform is computed once
+    per point, so that the times per call are those of the inner products and
+    marginalization. Returns a summary (largest and rms error, times per call);
+    warns if the largest error is above tolerance.
+    """
+    global _summary
+    draws = prior_draws(priors, points, seed) + [dict(point) for point in parameters]
+    errors, seconds = [], np.zeros(2)
+    try:
+        for point in draws:
+            if likelihood.time_marginalization and likelihood.jitter_time:
+                point.setdefault("time_jitter", 0.)
+            # fills the waveform cache of the generator
+            _log_likelihood_ratio(likelihood, point, False)
+            full, full_seconds = _log_likelihood_ratio(likelihood, point, False)
+            mixed, mixed_seconds = _log_likelihood_ratio(likelihood, point, True)
+            if np.isfinite(full) and np.isfinite(mixed):
+                errors.append(mixed - full)
+            seconds += full_seconds, mixed_seconds
+    finally:
+        likelihood.mixed_precision = True
+    errors = np.abs(errors)
+    summary = dict(
+        points=len(errors),
+        max_error=float(np.max(errors)) if len(errors) else float("nan"),
+        rms_error=float(np.sqrt(np.mean(errors ** 2))) if len(errors) else float("nan"),
+        seconds_per_call=float(seconds[1] / max(len(draws), 1)),
+        full_precision_seconds_per_call=float(seconds[0] / max(len(draws), 1)))
+    logger.info("Mixed precision: largest |Delta ln L| {:.2e} (rms {:.2e}) over {} points, "
+                "{:.1f} ms per call against {:.1f} ms in full precision (without the waveform)".format(
+                    summary["max_error"], summary["rms_error"], summary["points"],
+                    1e3 * summary["seconds_per_call"], 1e3 * summary["full_precision_seconds_per_call"]))
+    if not summary["max_error"] <= tolerance:
+        logger.warning("The mixed-precision error on ln L ({:.2e}) is above {}: consider full precision".format(
+            summary["max_error"], tolerance))
+    _summary = summary
+    return summary
+
+def finish(result):
+    """
+    Record the check of the mixed precision in result.meta_data["mixed_precision"], and save it again.
+    """
+    if _summary is None or "mixed_precision" in result.meta_data:
+        return result
+    result.meta_data["mixed_precision"] = _summary
+    result.save_to_file(overwrite=True)
+    return result
@@ -0,0 +1,139 @@
+import os
+
+import bilby
+import numpy as np
+
+import nrtidal_d
+
+logger = bilby.core.utils.logger
+
+# ASD files (in ASD-Files) for each detector of the networks used in the injection/recovery scripts.
+NETWORKS = {
+    "O4": {
+        "H1": "aligo_O4high.txt",
+        "L1": "aligo_O4high.txt",
+        "V1": "avirgo_O4high_NEW.txt",
+        "K1": "kagra_25Mpc.txt",
+    },
+    "O5": {
+        "H1": "AplusDesign.txt",
+        "L1": "AplusDesign.txt",
+        "V1": "avirgo_O5high_NEW.txt",
+        "K1": "kagra_80Mpc.txt",
+        "A1": "AplusDesign.txt",
+    },
+    "CE": {
+        "CE": "cosmic_explorer_strain.txt",
+    },
+}
+
+# GW170817-like injection used in the injection/recovery scripts.
+GW170817_LIKE_INJECTION = dict(
+    mass_1=1.38,
+    mass_2=1.38,
+    a_1=0.0,
+    a_2=0.0,
+    tilt_1=0.0,
+    tilt_2=0.0,
+    phi_12=0.0,
+    phi_jl=0.0,
+    luminosity_distance=40.0,
+    geocent_time=1187008882.4,
+    theta_jn=2.64,
+    psi=1.8,
+    phase=0.0,
+    ra=3.4,
+    dec=-0.401,
+    lambda_s=584,
+    binary_love_residual=0.,
+    xi_tilde=0.,
+    fiducial=1,
+)
+
+def get_interferometers(network, asd_dir, minimum_frequency=40.):
+    """
+    Empty bilby interferometers of a network, with the PSDs set from the ASD files in asd_dir.
+    """
+    if network not in NETWORKS:
+        raise ValueError("Unknown network {}, must be one of {}".format(network, list(NETWORKS)))
+
+    ifo_list = bilby.gw.detector.InterferometerList([])
+    for det, fname in NETWORKS[network].items():
+        data = np.loadtxt(os.path.join(asd_dir, fname))
+        ifo = bilby.gw.detector.get_empty_interferometer(det)
+        ifo.power_spectral_density = bilby.gw.detector.PowerSpectralDensity(
+            frequency_array=data[:,0], asd_array=data[:,1])
+        ifo.minimum_frequency = minimum_frequency
+        ifo_list.append(ifo)
+    return ifo_list
+
+def injection_priors(injection_parameters):
+    """
+    Priors of the injection/recovery scripts: only the chirp mass, mass ratio,
+    lambda_s, the binary Love residual and xi_tilde are sampled, the other parameters are fixed to their
+    injected values (geocent_time and phase are marginalized over).
+    """
+    priors = bilby.core.prior.PriorDict()
+    for key in list(injection_parameters.keys()):
+        priors[key] = injection_parameters[key]
+
+    del priors["mass_1"], priors["mass_2"]
+
+    priors["chirp_mass"] = bilby.gw.prior.UniformInComponentsChirpMass(
+        1.18, 2.17, name="chirp_mass", unit="$M_{\\odot}$"
+    )
+    priors["mass_ratio"] = bilby.gw.prior.UniformInComponentsMassRatio(
+        0.1, 1.0, name="mass_ratio"
+    )
+
+    priors["lambda_1"] = bilby.core.prior.Constraint(
+        name="lambda_1", minimum=0, maximum=3000
+    )
+    priors["lambda_2"] = bilby.core.prior.Constraint(
+        name="lambda_2", minimum=0, maximum=3000
+    )
+    priors["lambda_s"] = bilby.core.prior.Triangular(mode=1500,minimum=0,maximum=3000)
+    priors["binary_love_residual"] = bilby.core.prior.Gaussian(mu=0,sigma=1,name="binary_love_residual")
+
+    priors["xi_tilde"] = bilby.core.prior.Uniform(0,1000,name="xi_tilde")
+
+    del priors["geocent_time"], priors["phase"]
+    return priors
+
+def make_injection(
+        network, asd_dir,
+        approximant="IMRPhenomPv2_NRTidal",
+        duration=128, sampling_frequency=2048, minimum_frequency=40.,
+        injection_parameters=None,
+        frequency_domain_source_model=None):
+    """
+    Zero-noise injection into a network, set up as in the injection/recovery scripts.
+    Returns the interferometers and the waveform generator.
+    """
+    if injection_parameters is None:
+        injection_parameters = GW170817_LIKE_INJECTION
+    if frequency_domain_source_model is None:
+        frequency_domain_source_model = nrtidal_d.source_binary_love
+
+    waveform_arguments = dict(
+        waveform_approximant=approximant,
+        reference_frequency=50.0,
+        minimum_frequency=minimum_frequency
+    )
+    waveform_generator = bilby.gw.WaveformGenerator(
+        duration=duration,
+        sampling_frequency=sampling_frequency,
+        frequency_domain_source_model=frequency_domain_source_model,
+        parameter_conversion=bilby.gw.conversion.convert_to_lal_binary_neutron_star_parameters,
+        waveform_arguments=waveform_arguments
+    )
+
+    ifo_list = get_interferometers(network, asd_dir, minimum_frequency)
+    ifo_list.set_strain_data_from_zero_noise(
+        sampling_frequency=sampling_frequency, duration=duration,
+        start_time=injection_parameters["geocent_time"] + 2 - duration
+    )
+    ifo_list.inject_signal(
+        parameters=injection_parameters, waveform_generator=waveform_generator
+    )
+    return ifo_list, waveform_generator
@@ -0,0 +1,222 @@
+"""
+Store of colored Gaussian noise realizations for injection campaigns.
+
+Realization i of a store with seed s is drawn from its own generator,
+numpy.random.SeedSequence(s, spawn_key=(i,)), so that it is the same however
+the store is generated (batch size, number of realizations) and can be redrawn
+on its own. The noise is drawn as bilby's
+PowerSpectralDensity.get_noise_realisation does (white noise of variance
+duration/4 per quadrature, times the square root of the PSD, zero at DC, at
+Nyquist and outside the frequency range of the PSD), but with the PSDs
+interpolated on the analysis grid once, and all the detectors of a network and
+a batch of realizations colored at once.
+
+    {directory}/
+        noise.npy     (realizations, detectors, frequencies) complex128, read memory-mapped
+        psd.npy       (detectors, frequencies): the PSDs on the analysis grid
+        store.json    detectors, duration, sampling_frequency, seed, realizations
+
+store.json is written last, so an interrupted generation leaves no store.
+
+    python noise_realizations.py --network O4 --asd_dir ../ASD-Files/ -N 500 --seed 1 -o O4_noise
+    python noise_realizations.py --psd_file GW170817_PSDs.dat --duration 128 --sampling_frequency 4096 -N 500 -o noise
+
+(--psd_file as written by psd_estimation.py). The injection runners take
+--noise_store O4_noise --noise_index i in place of their zero noise.
+"""
+import json
+import os
+
+import bilby
+import numpy as np
+
+import networks
+
+logger = bilby.core.utils.logger
+
+STORE_FILE = "store.json"
+NOISE_FILE = "noise.npy"
+PSD_FILE = "psd.npy"
+
+# Realizations colored at once (bounds the memory of the white noise draws).
+BATCH_SIZE = 32
+
+def psds_on_grid(interferometers, frequency_array):
+    """
+    PSDs of the interferometers on frequency_array (detectors x frequencies),
+    zero outside the frequency range of each PSD.
+    """
+    psds = np.zeros((len(interferometers), len(frequency_array)))
+    for i, ifo in enumerate(interferometers):
+        psd = ifo.power_spectral_density
+        inside = (frequency_array >= np.min(psd.frequency_array)) & (frequency_array <= np.max(psd.frequency_array))
+        psds[i, inside] = psd.power_spectral_density_interpolated(frequency_array[inside])
+    return np.nan_to_num(psds, nan=0., posinf=0.)
+
+def generator(seed, index):
+    """
+    Generator of realization `index` of a store with this seed.
+    """
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(index,)))
+
+def noise_amplitude(psds, duration, sampling_frequency):
+    """
+    Square root of the PSDs, zero at DC and Nyquist (as bilby).
+    """
+    amplitude = np.sqrt(psds)
+    amplitude[:, 0] = 0.
+    # no Nyquist frequency when the number of samples is odd
+    if int(np.round(duration * sampling_frequency)) % 2 == 0:
+        amplitude[:, -1] = 0.
+    return amplitude
+
+def colored_noise(amplitude, duration, indices, seed):
+    """
+    Noise realizations `indices` (realizations x detectors x frequencies) of
+    the amplitude (see noise_amplitude) on the frequency grid of duration.
+    """
+    noise = np.empty((len(indices),) + amplitude.shape, dtype=complex)
+    for k, i in enumerate(indices):
+        # real and imaginary parts drawn in place
+        generator(seed, i).standard_normal(out=noise[k].view(float))
+    noise *= amplitude * (0.5 * duration ** 0.5)
+    return noise
+
+def create(directory, interferometers, duration, sampling_frequency, realizations, seed, batch_size=BATCH_SIZE):
+    """
+    Draw `realizations` realizations of the noise of the interferometers (with
+    their PSDs) into a new store in directory.
+    """
+    frequency_array = bilby.core.utils.create_frequency_series(sampling_frequency, duration)
+    psds = psds_on_grid(interferometers, frequency_array)
+    amplitude = noise_amplitude(psds, duration, sampling_frequency)
+
+    bilby.core.utils.check_directory_exists_and_if_not_mkdir(directory)
+    if os.path.isfile(os.path.join(directory, STORE_FILE)):
+        os.remove(os.path.join(directory, STORE_FILE))
+    np.save(os.path.join(directory, PSD_FILE), psds)
+    noise = np.lib.format.open_memmap(
+        os.path.join(directory, NOISE_FILE), mode="w+", dtype=complex,
+        shape=(realizations, len(interferometers), len(frequency_array)))
+    for start in range(0, realizations, batch_size):
+        indices = np.arange(start, min(start + batch_size, realizations))
+        noise[indices] = colored_noise(amplitude, duration, indices, seed)
+    noise.flush()
+    del noise
+
+    store = dict(
+        detectors=[ifo.name for ifo in interferometers], duration=duration,
+        sampling_frequency=sampling_frequency, seed=seed, realizations=realizations)
+    with open(os.path.join(directory, STORE_FILE + ".tmp"), "w") as f:
+        json.dump(store, f, indent=2)
+    os.replace(os.path.join(directory, STORE_FILE + ".tmp"), os.path.join(directory, STORE_FILE))
+    logger.info("Wrote {} noise realizations of {} to {}".format(realizations, ", ".join(store["detectors"]), directory))
+    return NoiseStore(directory)
+
+class NoiseStore(object):
+    """
+    Noise realizations in directory (see create), read memory-mapped.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, STORE_FILE)) as f:
+            self.meta = json.load(f)
+        self.detectors = self.meta["detectors"]
+        self.duration = self.meta["duration"]
+        self.sampling_frequency = self.meta["sampling_frequency"]
+        self.noise = np.load(os.path.join(directory, NOISE_FILE), mmap_mode="r")
+        self.psds = np.load(os.path.join(directory, PSD_FILE))
+        self.frequency_array = bilby.core.utils.create_frequency_series(self.sampling_frequency, self.duration)
+
+    def __len__(self):
+        return len(self.noise)
+
+    def __getitem__(self, index):
+        """
+        Realization `index`, {detector: frequency-domain strain}.
+        """
+        return dict(zip(self.detectors, np.array(self.noise[index])))
+
+    def set_strain_data(self, interferometers, index, sampling_frequency, duration, start_time=0):
+        """
+        Set the strain data of the interferometers to realization `index`
+        (in place of set_strain_data_from_zero_noise).
+        """
+        if not (np.isclose(duration, self.duration) and np.isclose(sampling_frequency, self.sampling_frequency)):
+            raise ValueError("The noise store {} is for duration {}s and sampling frequency {}Hz, not {}s and {}Hz".format(
+                self.directory, self.duration, self.sampling_frequency, duration, sampling_frequency))
+        if not 0 <= index < len(self):
+            raise IndexError("Noise realization {} not in the {} realizations of {}".format(index, len(self), self.directory))
+        missing = [ifo.name for ifo in interferometers if ifo.name not in self.detectors]
+        if missing:
+            raise ValueError("No noise of {} in {}".format(", ".join(missing), self.directory))
+
+        psds = psds_on_grid(interferometers, self.frequency_array)
+        realization = self[index]
+        for ifo, psd in zip(interferometers, psds):
+            if not np.allclose(psd, self.psds[self.detectors.index(ifo.name)], rtol=1e-6, atol=0.):
+                logger.warning("The noise of {} in {} was drawn from another PSD".format(ifo.name, self.directory))
+            ifo.set_strain_data_from_frequency_domain_strain(
+                realization[ifo.name], sampling_frequency=sampling_frequency, duration=duration, start_time=start_time)
+        logger.info("Strain data set to noise realization {} of {}".format(index, self.directory))
+
+def interferometers_from_psd_file(filename, detectors=None):
+    """
+    Empty interferometers with the PSDs of a file with columns frequency, then
+    one PSD per detector (as written by psd_estimation.py).
+    """
+    data = np.loadtxt(filename)
+    if detectors is None:
+        with open(filename) as f:
+            detectors = f.readline().lstrip("#").split()[1:]
+    ifo_list = bilby.gw.detector.InterferometerList([])
+    for i, det in enumerate(detectors):
+        ifo = bilby.gw.detector.get_empty_interferometer(det)
+        ifo.power_spectral_density = bilby.gw.detector.PowerSpectralDensity(
+            frequency_array=data[:, 0], psd_array=data[:, i + 1])
+        ifo_list.append(ifo)
+    return ifo_list
+
+#-------------------------------------------------------------
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Store of colored Gaussian noise realizations.")
+
+    parser.add_argument("--network", type=str, default=None, choices=list(networks.NETWORKS),
+                        help="Network of the injection runners (PSDs from the ASD files in --asd_dir).")
+
+    parser.add_argument("--asd_dir", type=str, default="",
+                        help="Directory of the ASD files, with --network.")
+
+    parser.add_argument("--psd_file", type=str, default=None,
+                        help="PSD file (frequency, then one column per detector) instead of --network.")
+
+    parser.add_argument("--detectors", type=str, nargs="+", default=None,
+                        help="Detectors of the columns of --psd_file (default: its header).")
+
+    parser.add_argument("--duration", type=float, default=128,
+                        help="Duration of the analysis segment.")
+
+    parser.add_argument("--sampling_frequency", type=float, default=2048,
+                        help="Sampling frequency of the analysis.")
+
+    parser.add_argument("-N", "--realizations", type=int, required=True,
+                        help="Number of noise realizations.")
+
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Seed of the store (default: random, recorded in the store).")
+
+    parser.add_argument("-o", "--output", type=str, required=True,
+                        help="Directory of the store.")
+
+    args = parser.parse_args()
+
+    if (args.network is None) == (args.psd_file is None):
+        parser.error("Give one of --network and --psd_file")
+    if args.network is not None:
+        interferometers = networks.get_interferometers(args.network, args.asd_dir)
+    else:
+        interferometers = interferometers_from_psd_file(args.psd_file, args.detectors)
+    seed = np.random.SeedSequence().entropy if args.seed is None else args.seed
+    create(args.output, interferometers, args.duration, args.sampling_frequency, args.realizations, seed)
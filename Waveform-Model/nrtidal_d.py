@@ -2,11 +2,15 @@ from astropy.constants import GM_sun, c
 import bilby
 import numpy as np
 
+import profiling
 import updated_binary_love_marginalized as bn
 
 
 GC = GM_sun.value / pow(c.value,3) 
 
+# xi_tilde in our papers (Xi_bar) is 8 times the xi_tilde of the code
+XI_TILDE_PAPER_FACTOR = 8
+
 def _dissipative_tidal_phase_xi_tilde(frequency_array, mass_1, mass_2, xi_tilde):
     """
     Dissipative tidal deformability contribution to the phase in the frequency domain. 
@@ -24,6 +28,21 @@ def _dissipative_tidal_phase_xi_tilde(frequency_array, mass_1, mass_2, xi_tilde)
 
     return phi
 
+def binary_love_lambdas(mass_1, mass_2, lambda_s, binary_love_residual=None):
+    """
+    lambda_1, lambda_2 from lambda_s = (lambda_1 + lambda_2)/2 through the marginalized
+    binary Love relations. binary_love_residual is the error of the relations in units of
+    its standard deviation (sampled with a unit normal prior, so that the lambda_1, lambda_2
+    of each posterior sample are recorded); if None it is drawn at random.
+    """
+    mass_ratio = bilby.gw.conversion.component_masses_to_mass_ratio(mass_1,mass_2)
+
+    lambda_a = bn.convert_lambda_s_to_lambda_a_marginalized(lambda_s,mass_ratio,binary_love_residual)
+
+    lambda_1 = abs(lambda_s - lambda_a)
+    lambda_2 = abs(lambda_s + lambda_a)
+    return lambda_1, lambda_2
+
 def source(
         frequency_array, 
         mass_1, mass_2, 
@@ -37,19 +56,22 @@ def source(
     """
     freqs = np.append(frequency_array, kwargs['reference_frequency'])
 
-    phi = _dissipative_tidal_phase_xi_tilde(frequency_array, mass_1, mass_2, xi_tilde)
-
-    polarizations = bilby.gw.source.lal_binary_neutron_star(
-            frequency_array, 
-            mass_1, mass_2, 
-            luminosity_distance, 
-            a_1, tilt_1, phi_12, a_2, tilt_2, phi_jl, 
-            theta_jn, phase, 
-            lambda_1, lambda_2, 
-            **kwargs)
-
-    for k in polarizations:
-        polarizations[k] *= np.exp(-1j * phi)
+    with profiling.timer("dissipative_phase"):
+        phi = _dissipative_tidal_phase_xi_tilde(frequency_array, mass_1, mass_2, xi_tilde)
+
+    with profiling.timer("lal_binary_neutron_star"):
+        polarizations = bilby.gw.source.lal_binary_neutron_star(
+                frequency_array, 
+                mass_1, mass_2, 
+                luminosity_distance, 
+                a_1, tilt_1, phi_12, a_2, tilt_2, phi_jl, 
+                theta_jn, phase, 
+                lambda_1, lambda_2, 
+                **kwargs)
+
+    with profiling.timer("phase_rotation"):
+        for k in polarizations:
+            polarizations[k] *= np.exp(-1j * phi)
     
     return polarizations
 
@@ -58,33 +80,33 @@ def source_binary_love(
         mass_1, mass_2, 
         luminosity_distance, 
         a_1, tilt_1, phi_12, a_2, tilt_2, phi_jl, theta_jn, phase, 
-        lambda_s, xi_tilde, 
+        lambda_s, xi_tilde, binary_love_residual, 
         **kwargs):
     """
     Add dissipative tidal deformability to binary neutron star waveform in the frequency domain.
     Samples on lambda_s = (lambda_1 + lambda_2)/2 and the dissipative tidal number.
+    binary_love_residual: error of the binary Love relations (see binary_love_lambdas).
     """
     freqs = np.append(frequency_array, kwargs['reference_frequency'])
 
-    phi = _dissipative_tidal_phase_xi_tilde(frequency_array, mass_1, mass_2, xi_tilde)
+    with profiling.timer("dissipative_phase"):
+        phi = _dissipative_tidal_phase_xi_tilde(frequency_array, mass_1, mass_2, xi_tilde)
 
-    mass_ratio = bilby.gw.conversion.component_masses_to_mass_ratio(mass_1,mass_2)
+    with profiling.timer("binary_love"):
+        lambda_1, lambda_2 = binary_love_lambdas(mass_1, mass_2, lambda_s, binary_love_residual)
 
-    lambda_a = bn.convert_lambda_s_to_lambda_a_marginalized(lambda_s,mass_ratio)
+    with profiling.timer("lal_binary_neutron_star"):
+        polarizations = bilby.gw.source.lal_binary_neutron_star(
+                frequency_array, 
+                mass_1, mass_2, 
+                luminosity_distance, 
+                a_1, tilt_1, phi_12, a_2, tilt_2, phi_jl, theta_jn, phase, 
+                lambda_1, lambda_2, 
+                **kwargs)
 
-    lambda_2 = abs(lambda_s + lambda_a)
-    lambda_1 = abs(lambda_s - lambda_a)
-
-    polarizations = bilby.gw.source.lal_binary_neutron_star(
-            frequency_array, 
-            mass_1, mass_2, 
-            luminosity_distance, 
-            a_1, tilt_1, phi_12, a_2, tilt_2, phi_jl, theta_jn, phase, 
-            lambda_1, lambda_2, 
-            **kwargs)
-
-    for k in polarizations:
-        polarizations[k] *= np.exp(-1j * phi)
+    with profiling.timer("phase_rotation"):
+        for k in polarizations:
+            polarizations[k] *= np.exp(-1j * phi)
     
     return polarizations
 
@@ -93,93 +115,124 @@ def lambda_1_lambda_2_from_lambda_s_BL(
         mass_1, mass_2, 
         luminosity_distance, 
         a_1, tilt_1, phi_12, a_2, tilt_2, phi_jl, theta_jn, phase, 
-        lambda_s, 
+        lambda_s, binary_love_residual=None, 
         **kwargs):
     """
-    Add dissipative tidal deformability to binary neutron star waveform in the frequency domain.
-    Samples on lambda_s = (lambda_1 + lambda_2)/2, but NOT on the dissipative tidal number.
+    lambda_1, lambda_2 of the source_binary_love waveform with these parameters.
+    Exact if binary_love_residual is given (as recorded in the posterior),
+    otherwise a new draw from the binary Love relations.
     """
-    freqs = np.append(frequency_array, kwargs['reference_frequency'])
-
-    mass_ratio = bilby.gw.conversion.component_masses_to_mass_ratio(mass_1,mass_2)
-
-    lambda_a = bn.convert_lambda_s_to_lambda_a_marginalized(lambda_s,mass_ratio)
-
-    lambda_1 = abs(lambda_s - lambda_a)
-    lambda_2 = abs(lambda_s + lambda_a)
-
-    return [lambda_1,lambda_2]
-
-    return bilby.gw.source.lal_binary_neutron_star(
-            frequency_array, 
-            mass_1, mass_2, 
-            luminosity_distance, 
-            a_1, tilt_1, phi_12, a_2, tilt_2, phi_jl, theta_jn, phase, 
-            lambda_1, lambda_2, 
-            **kwargs)
+    return list(binary_love_lambdas(mass_1, mass_2, lambda_s, binary_love_residual))
 
 def source_binary_love_noXi(
         frequency_array, 
         mass_1, mass_2, 
         luminosity_distance, 
         a_1, tilt_1, phi_12, a_2, tilt_2, phi_jl, theta_jn, phase, 
-        lambda_s, 
+        lambda_s, binary_love_residual, 
         **kwargs):
     """
     Add dissipative tidal deformability to binary neutron star waveform in the frequency domain.
     Samples on lambda_s = (lambda_1 + lambda_2)/2, but NOT on the dissipative tidal number.
+    binary_love_residual: error of the binary Love relations (see binary_love_lambdas).
     """
     freqs = np.append(frequency_array, kwargs['reference_frequency'])
 
-    mass_ratio = bilby.gw.conversion.component_masses_to_mass_ratio(mass_1,mass_2)
-
-    lambda_a = bn.convert_lambda_s_to_lambda_a_marginalized(lambda_s,mass_ratio)
-
-    lambda_2 = abs(lambda_s + lambda_a)
-    lambda_1 = abs(lambda_s - lambda_a)
+    with profiling.timer("binary_love"):
+        lambda_1, lambda_2 = binary_love_lambdas(mass_1, mass_2, lambda_s, binary_love_residual)
 
-    return bilby.gw.source.lal_binary_neutron_star(
-            frequency_array, 
-            mass_1, mass_2, 
-            luminosity_distance, 
-            a_1, tilt_1, phi_12, a_2, tilt_2, phi_jl, theta_jn, phase, 
-            lambda_1, lambda_2, 
-            **kwargs)
+    with profiling.timer("lal_binary_neutron_star"):
+        return bilby.gw.source.lal_binary_neutron_star(
+                frequency_array, 
+                mass_1, mass_2, 
+                luminosity_distance, 
+                a_1, tilt_1, phi_12, a_2, tilt_2, phi_jl, theta_jn, phase, 
+                lambda_1, lambda_2, 
+                **kwargs)
 
 def source_binary_love_relative_binning(
         frequency_array, 
         mass_1, mass_2, 
         luminosity_distance, 
         a_1, tilt_1, phi_12, a_2, tilt_2, phi_jl, theta_jn, phase, 
-        lambda_s, xi_tilde, 
+        lambda_s, xi_tilde, binary_love_residual, 
         **kwargs):
     """
     Add dissipative tidal deformability to binary neutron star waveform in the frequency domain.
     Samples on lambda_s = (lambda_1 + lambda_2)/2 and the dissipative tidal number.
+    binary_love_residual: error of the binary Love relations (see binary_love_lambdas).
     Makes use of relative binning to speed up calculations.
     """
     freqs = np.append(frequency_array, kwargs['reference_frequency'])
 
-    phi = _dissipative_tidal_phase_xi_tilde(frequency_array, mass_1, mass_2, xi_tilde)
-
-    mass_ratio = bilby.gw.conversion.component_masses_to_mass_ratio(mass_1,mass_2)
-
-    lambda_a = bn.convert_lambda_s_to_lambda_a_marginalized(lambda_s,mass_ratio)
-
-    lambda_2 = abs(lambda_s + lambda_a)
-    lambda_1 = abs(lambda_s - lambda_a)
+    with profiling.timer("dissipative_phase"):
+        phi = _dissipative_tidal_phase_xi_tilde(frequency_array, mass_1, mass_2, xi_tilde)
+
+    with profiling.timer("binary_love"):
+        lambda_1, lambda_2 = binary_love_lambdas(mass_1, mass_2, lambda_s, binary_love_residual)
+
+    with profiling.timer("lal_binary_neutron_star"):
+        polarizations = bilby.gw.source.lal_binary_neutron_star_relative_binning(
+                frequency_array, 
+                mass_1, mass_2, 
+                luminosity_distance, 
+                a_1, tilt_1, phi_12, a_2, tilt_2, phi_jl,   
+                lambda_1, lambda_2,
+                theta_jn, phase,
+                fiducial=1,
+                **kwargs)
+
+    with profiling.timer("phase_rotation"):
+        for k in polarizations:
+            polarizations[k] *= np.exp(-1j * phi)
+    
+    return polarizations
 
-    polarizations = bilby.gw.source.lal_binary_neutron_star_relative_binning(
-            frequency_array, 
-            mass_1, mass_2, 
-            luminosity_distance, 
-            a_1, tilt_1, phi_12, a_2, tilt_2, phi_jl,   
-            lambda_1, lambda_2,
-            theta_jn, phase,
-            fiducial=1,
-            **kwargs)
-
-    for k in polarizations:
-        polarizations[k] *= np.exp(-1j * phi)
+def source_binary_love_frequency_sequence(
+        frequency_array, 
+        mass_1, mass_2, 
+        luminosity_distance, 
+        a_1, tilt_1, phi_12, a_2, tilt_2, phi_jl, theta_jn, phase, 
+        lambda_s, xi_tilde, binary_love_residual, 
+        **kwargs):
+    """
+    Add dissipative tidal deformability to binary neutron star waveform in the frequency domain.
+    Samples on lambda_s = (lambda_1 + lambda_2)/2 and the dissipative tidal number.
+    binary_love_residual: error of the binary Love relations (see binary_love_lambdas).
+    Evaluated only at the frequencies of frequency_array, which need not start at zero
+    (e.g. a block of the frequency grid, see long_duration.py); zero outside
+    [minimum_frequency, maximum_frequency).
+    """
+    frequency_array = np.asarray(frequency_array, dtype=np.float64)
+    kwargs = dict(kwargs)
+    minimum_frequency = kwargs.pop('minimum_frequency', 20.)
+    maximum_frequency = kwargs.pop('maximum_frequency', np.inf)
+    band = (frequency_array >= minimum_frequency) & (frequency_array < maximum_frequency)
+
+    polarizations = {k: np.zeros(len(frequency_array), dtype=complex) for k in ['plus', 'cross']}
+    if not np.any(band):
+        return polarizations
+
+    with profiling.timer("dissipative_phase"):
+        phi = _dissipative_tidal_phase_xi_tilde(frequency_array[band], mass_1, mass_2, xi_tilde)
+
+    with profiling.timer("binary_love"):
+        lambda_1, lambda_2 = binary_love_lambdas(mass_1, mass_2, lambda_s, binary_love_residual)
+
+    with profiling.timer("lal_binary_neutron_star"):
+        band_polarizations = bilby.gw.source.binary_neutron_star_frequency_sequence(
+                frequency_array[band], 
+                mass_1, mass_2, 
+                luminosity_distance, 
+                a_1, tilt_1, phi_12, a_2, tilt_2, phi_jl, 
+                lambda_1, lambda_2, 
+                theta_jn, phase, 
+                frequencies=frequency_array[band],
+                **kwargs)
+
+    with profiling.timer("phase_rotation"):
+        rotation = np.exp(-1j * phi)
+        for k in polarizations:
+            polarizations[k][band] = band_polarizations[k] * rotation
     
     return polarizations
@@ -0,0 +1,194 @@
+"""
+Columnar, compressed store of NRTidal-D posteriors (HDF5).
+
+Each column of the posterior (and optionally of the nested samples, i.e. the
+weighted dead points) is a chunked, compressed dataset, so that one column
+(e.g. xi_tilde) of a result can be read without loading the rest:
+
+    {label}_posterior.h5
+        /posterior/{column}        one dataset per column
+        /nested_samples/{column}   optional
+        attributes: label, log_evidence, log_evidence_err, log_noise_evidence,
+                    log_bayes_factor, num_likelihood_evaluations, sampling_time,
+                    injection_parameters (JSON), priors (bilby's JSON of the PriorDict)
+
+The runners write it next to the bilby result. Existing results can be
+converted with
+
+    python posterior_store.py {outdir}/{label}_result.json [--nested_samples]
+
+Reading:
+
+    with PosteriorStore(filename) as store:
+        xi_tilde = store["xi_tilde"]               # one column, as an array
+        lazy = store.dataset("xi_tilde")           # h5py dataset, read on slicing
+        frame = store.read(["xi_tilde", "lambda_s"])
+"""
+import json
+import os
+
+import bilby
+import h5py
+import numpy as np
+import pandas as pd
+
+logger = bilby.core.utils.logger
+
+# Rows per chunk of the datasets: the unit of (de)compression.
+CHUNK_ROWS = 4096
+
+COMPRESSION = "gzip"
+COMPRESSION_LEVEL = 4
+
+SUMMARY_ATTRIBUTES = [
+    "label", "log_evidence", "log_evidence_err", "log_noise_evidence",
+    "log_bayes_factor", "num_likelihood_evaluations",
+]
+
+def store_file(outdir, label):
+    return os.path.join(outdir, "{}_posterior.h5".format(label))
+
+def _json(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    return repr(value)
+
+def _write_frame(group, frame, chunk_rows):
+    for column in frame.columns:
+        values = frame[column].to_numpy()
+        if values.dtype.kind not in "biuf":
+            values = values.astype(str).astype(object)
+            dtype = h5py.string_dtype()
+        else:
+            dtype = values.dtype
+        group.create_dataset(
+            column, data=values, dtype=dtype,
+            chunks=(max(min(chunk_rows, len(values)), 1),) if len(values) > 0 else None,
+            compression=COMPRESSION if len(values) > 0 else None,
+            compression_opts=COMPRESSION_LEVEL if len(values) > 0 else None,
+            shuffle=len(values) > 0)
+
+def write(filename, result, nested_samples=False, chunk_rows=CHUNK_ROWS):
+    """
+    Write the posterior of a bilby result (and, with nested_samples, its
+    weighted dead points) to filename.
+    """
+    tmp = filename + ".tmp"
+    with h5py.File(tmp, "w") as f:
+        _write_frame(f.create_group("posterior"), result.posterior, chunk_rows)
+        if nested_samples and getattr(result, "nested_samples", None) is not None:
+            _write_frame(f.create_group("nested_samples"), result.nested_samples, chunk_rows)
+
+        for key in SUMMARY_ATTRIBUTES:
+            try:
+                value = getattr(result, key, None)
+            except ValueError:
+                # e.g. num_likelihood_evaluations of a result that did not record it
+                value = None
+            if value is not None:
+                f.attrs[key] = value
+        sampling_time = getattr(result, "sampling_time", None)
+        if hasattr(sampling_time, "total_seconds"):
+            sampling_time = sampling_time.total_seconds()
+        if sampling_time is not None:
+            f.attrs["sampling_time"] = float(sampling_time)
+        f.attrs["injection_parameters"] = json.dumps(result.injection_parameters, default=_json)
+        if result.priors is not None:
+            # bilby's own encoding, which (unlike repr) reads back Interped priors, e.g. the EOS priors
+            f.attrs["priors"] = json.dumps(
+                bilby.core.prior.PriorDict(dictionary=dict(result.priors))._get_json_dict(),
+                cls=bilby.core.utils.BilbyJsonEncoder)
+    os.replace(tmp, filename)
+    logger.info("Wrote {} posterior samples to {}".format(len(result.posterior), filename))
+    return filename
+
+class PosteriorStore(object):
+    """
+    Lazy reader of a posterior store: columns are only read when asked for.
+    group: "posterior" or "nested_samples"
+    """
+    def __init__(self, filename, group="posterior"):
+        self.filename = filename
+        self.group = group
+        self._file = h5py.File(filename, "r")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    @property
+    def columns(self):
+        return list(self._file[self.group].keys())
+
+    @property
+    def attrs(self):
+        """
+        Summary of the run (evidences, injection parameters, priors as a PriorDict, ...).
+        """
+        attrs = {}
+        for key, value in self._file.attrs.items():
+            if key == "priors":
+                value = json.loads(value, object_hook=bilby.core.utils.decode_bilby_json)
+            elif key == "injection_parameters":
+                value = json.loads(value)
+            elif isinstance(value, np.generic):
+                value = value.item()
+            attrs[key] = value
+        return attrs
+
+    def __len__(self):
+        columns = self.columns
+        return len(self._file[self.group][columns[0]]) if len(columns) > 0 else 0
+
+    def __contains__(self, column):
+        return column in self._file[self.group]
+
+    def dataset(self, column):
+        """
+        The h5py dataset of a column: nothing is read until it is sliced.
+        """
+        return self._file[self.group][column]
+
+    def __getitem__(self, column):
+        values = self.dataset(column)[()]
+        if values.dtype == object:
+            values = values.astype(str)
+        return values
+
+    def read(self, columns=None):
+        """
+        DataFrame of the given columns (default: all).
+        """
+        if columns is None:
+            columns = self.columns
+        return pd.DataFrame({column: self[column] for column in columns})
+
+def read_columns(filename, columns, group="posterior"):
+    """
+    The given columns of a posterior store, and its summary attributes.
+    """
+    with PosteriorStore(filename, group) as store:
+        return store.read(columns), store.attrs
+
+#-----------------------------------------------------------------
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Convert bilby result files to posterior stores.")
+
+    parser.add_argument("result_files", type=str, nargs="+",
+                        help="{outdir}/{label}_result.json (or .pkl)")
+
+    parser.add_argument("--nested_samples", action="store_true",
+                        help="Also store the nested samples (weighted dead points).")
+
+    args = parser.parse_args()
+    for result_file in args.result_files:
+        result = bilby.core.result.read_in_result(result_file)
+        write(store_file(os.path.dirname(result_file) or ".", result.label), result,
+              nested_samples=args.nested_samples)
@@ -0,0 +1,136 @@
+"""
+Post-processing of NRTidal-D posteriors.
+
+generate_all_nrtidal_d_parameters is a drop-in replacement for the
+conversion_function=bilby.gw.conversion.generate_all_bns_parameters of the
+runners. bilby's conversion starts a new pool for each of its per-sample
+stages (per-detector likelihoods, marginalized parameter reconstruction, SNRs)
+and does the rest serially; here the posterior is split into chunks, and each
+chunk goes through the whole (vectorized) conversion in one pool of npool workers.
+It also adds the NRTidal-D columns:
+
+    + lambda_1, lambda_2 (and lambda_tilde, delta_lambda_tilde) from lambda_s
+      through the marginalized binary Love relations, when sampling on lambda_s
+      (bilby sets them to 0 otherwise). These are the lambda_1, lambda_2 of the
+      likelihood evaluation of each sample, from its recorded binary_love_residual
+      (results without it get a new draw of the residual)
+    + xi_tilde_paper: xi_tilde with the factor of 8 of our papers (see the README)
+
+The corner plot can be made later, in a separate (low priority) job:
+
+    nice -n 19 python postprocessing.py {outdir}/{label}_result.json
+"""
+import multiprocessing
+
+import bilby
+import numpy as np
+import pandas as pd
+
+import nrtidal_d
+
+logger = bilby.core.utils.logger
+
+# Chunks per worker, to balance the load between the workers.
+CHUNKS_PER_WORKER = 4
+
+_likelihood = None
+_priors = None
+
+def add_nrtidal_d_parameters(sample):
+    """
+    Add lambda_1, lambda_2 (from lambda_s, through the binary Love relations),
+    the tidal parameters derived from them, and xi_tilde_paper.
+    Needs mass_1, mass_2, i.e. call after bilby's conversion.
+    """
+    output_sample = sample.copy()
+    if "lambda_s" in output_sample:
+        residual = None
+        if "binary_love_residual" in output_sample:
+            residual = np.asarray(output_sample["binary_love_residual"], dtype=float)
+        output_sample["lambda_1"], output_sample["lambda_2"] = nrtidal_d.binary_love_lambdas(
+            np.asarray(output_sample["mass_1"]), np.asarray(output_sample["mass_2"]),
+            np.asarray(output_sample["lambda_s"], dtype=float), residual)
+        output_sample = bilby.gw.conversion.generate_tidal_parameters(output_sample)
+    if "xi_tilde" in output_sample:
+        output_sample["xi_tilde_paper"] = nrtidal_d.XI_TILDE_PAPER_FACTOR * np.asarray(output_sample["xi_tilde"])
+    return output_sample
+
+def _convert(sample, likelihood, priors, seed=None):
+    if seed is not None:
+        # the binary Love relations (without a recorded residual) draw from
+        # numpy's global generator, the marginalized parameter reconstruction from bilby's
+        np.random.seed(seed)
+        bilby.core.utils.random.seed(seed)
+    output_sample = bilby.gw.conversion.generate_all_bns_parameters(
+        sample, likelihood=likelihood, priors=priors, npool=1)
+    return add_nrtidal_d_parameters(output_sample)
+
+def _initialize(likelihood, priors):
+    global _likelihood, _priors
+    _likelihood = likelihood
+    _priors = priors
+
+def _convert_chunk(args):
+    chunk, seed = args
+    return _convert(chunk, _likelihood, _priors, seed)
+
+def _use_marginalized_priors(likelihood, priors):
+    """
+    As bilby's conversion does (in the main process): the priors of the
+    reconstructed marginalized parameters are those of the likelihood.
+    """
+    misnamed_marginalizations = dict(
+        luminosity_distance="distance", geocent_time="time", recalib_index="calibration")
+    for par in getattr(likelihood, "_marginalized_parameters", []):
+        name = misnamed_marginalizations.get(par, par)
+        if getattr(likelihood, "{}_marginalization".format(name), False) and par in likelihood.priors:
+            priors[par] = likelihood.priors[par]
+
+def generate_all_nrtidal_d_parameters(sample, likelihood=None, priors=None, npool=1, chunk_size=None, seed=None):
+    """
+    bilby.gw.conversion.generate_all_bns_parameters, plus the NRTidal-D
+    parameters (add_nrtidal_d_parameters), done in chunks of the posterior
+    on a pool of npool workers.
+
+    chunk_size: samples per chunk (default: CHUNKS_PER_WORKER chunks per worker)
+    seed: seed of the random draws (binary Love relations, reconstruction of
+          the marginalized parameters); each chunk gets its own stream
+    """
+    if not isinstance(sample, pd.DataFrame) or likelihood is None or npool is None or npool <= 1 or len(sample) < 2:
+        return _convert(sample, likelihood, priors, seed)
+
+    if chunk_size is None:
+        chunk_size = int(np.ceil(len(sample) / (npool * CHUNKS_PER_WORKER)))
+    starts = range(0, len(sample), max(chunk_size, 1))
+    seeds = [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(seed).spawn(len(starts))]
+    chunks = [(sample.iloc[start:start + chunk_size], s) for start, s in zip(starts, seeds)]
+
+    logger.info("Converting {} samples in {} chunks on {} workers".format(len(sample), len(chunks), npool))
+    with multiprocessing.Pool(npool, initializer=_initialize, initargs=(likelihood, priors)) as pool:
+        output = pool.map(_convert_chunk, chunks, chunksize=1)
+
+    if priors is not None:
+        _use_marginalized_priors(likelihood, priors)
+    return pd.concat(output)
+
+def plot(result_file, parameters=None, **kwargs):
+    """
+    Corner plot of a saved result (by default, of its sampled parameters).
+    """
+    result = bilby.core.result.read_in_result(result_file)
+    return result.plot_corner(parameters=parameters, **kwargs)
+
+#-----------------------------------------------------------------
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Deferred corner plot of a result file.")
+
+    parser.add_argument("result_file", type=str,
+                        help="{outdir}/{label}_result.json")
+
+    parser.add_argument("-p", "--parameters", type=str, nargs="+", default=None,
+                        help="Parameters to plot (default: the sampled parameters).")
+
+    args = parser.parse_args()
+    plot(args.result_file, parameters=args.parameters)
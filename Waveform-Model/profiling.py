@@ -0,0 +1,199 @@
+"""
+Opt-in, low-overhead per-stage timers and call counters.
+
+Nothing is recorded unless enable() has been called. Each process (main
+process and npool workers) accumulates its own counters and dumps them to
+a per-process file; write_profile() aggregates them into a JSON and a CSV
+profile next to the bilby result.
+"""
+import contextlib
+import csv
+import functools
+import glob
+import json
+import os
+import time
+from multiprocessing import util
+
+_enabled = False
+_directory = None
+_counters = {}
+_finalizer_pid = None
+_last_dump = 0.
+
+DUMP_INTERVAL = 60. # seconds between periodic dumps of the per-process counters
+
+_null_timer = contextlib.nullcontext()
+
+class _Timer:
+    """
+    Context manager that adds the elapsed time to the counters of a stage.
+    """
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.start)
+        return False
+
+def timer(name):
+    """
+    Time the enclosed block as stage `name`. A no-op unless profiling is enabled.
+    """
+    if not _enabled:
+        return _null_timer
+    return _Timer(name)
+
+def record(name, seconds, calls=1):
+    """
+    Add `calls` calls taking `seconds` in total to stage `name`.
+    """
+    global _last_dump
+    _register_finalizer()
+
+    counter = _counters.get(name)
+    if counter is None:
+        counter = _counters[name] = [0, 0.]
+    counter[0] += calls
+    counter[1] += seconds
+
+    now = time.monotonic()
+    if now - _last_dump > DUMP_INTERVAL:
+        _last_dump = now
+        dump()
+
+def _register_finalizer():
+    """
+    Make sure every process (in particular pool workers) dumps its counters when it exits.
+    A forked worker starts from a copy of the parent's counters, which are
+    reported by the parent, so these are reset first.
+    """
+    global _finalizer_pid
+    pid = os.getpid()
+    if _finalizer_pid != pid:
+        if _finalizer_pid is not None:
+            _counters.clear()
+        _finalizer_pid = pid
+        util.Finalize(None, dump, exitpriority=10)
+
+def _process_file(pid=None):
+    return os.path.join(_directory, "{}.json".format(os.getpid() if pid is None else pid))
+
+def dump():
+    """
+    Write the counters of this process to its per-process file.
+    """
+    if not _enabled or _directory is None or len(_counters) == 0:
+        return
+    tmp = _process_file() + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(_counters, f)
+    os.replace(tmp, _process_file())
+
+def enable(outdir, label):
+    """
+    Turn on profiling. Must be called before bilby starts its worker pool,
+    so that the workers inherit it.
+    """
+    global _enabled, _directory, _last_dump
+    _directory = os.path.join(outdir, "{}_profile".format(label))
+    os.makedirs(_directory, exist_ok=True)
+    for fname in glob.glob(os.path.join(_directory, "*.json")):
+        os.remove(fname)
+    _counters.clear()
+    _last_dump = time.monotonic()
+    _enabled = True
+
+def is_enabled():
+    return _enabled
+
+class _TimedMethod:
+    """
+    Picklable wrapper that times calls to a method of an object, with the
+    signature of the method (bilby passes parameters only to a likelihood
+    whose methods declare them).
+    """
+    def __init__(self, method, name):
+        self.method = method
+        self.name = name
+        functools.update_wrapper(self, method)
+
+    def __call__(self, *args, **kwargs):
+        with timer(self.name):
+            return self.method(*args, **kwargs)
+
+def _wrap(obj, method_name, stage):
+    method = getattr(obj, method_name, None)
+    if method is None or isinstance(method, _TimedMethod):
+        return
+    setattr(obj, method_name, _TimedMethod(method, stage))
+
+def instrument_likelihood(likelihood):
+    """
+    Time the stages of a bilby GravitationalWaveTransient likelihood call:
+    the full call, the waveform generator, the inner products (calculate_snrs),
+    and the marginalization/combination of the inner products.
+    The source model stages are timed inside nrtidal_d.
+    """
+    _wrap(likelihood, "log_likelihood_ratio", "log_likelihood_ratio")
+    _wrap(likelihood, "calculate_snrs", "inner_products")
+    _wrap(likelihood, "compute_log_likelihood_from_snrs", "marginalization")
+    _wrap(likelihood.waveform_generator, "frequency_domain_strain", "waveform_generator")
+    return likelihood
+
+def collect():
+    """
+    Aggregate the counters of all processes.
+    Returns dict stage -> [calls, total seconds].
+    """
+    dump()
+    total = {}
+    for fname in glob.glob(os.path.join(_directory, "*.json")):
+        with open(fname) as f:
+            counters = json.load(f)
+        for name, (calls, seconds) in counters.items():
+            if name not in total:
+                total[name] = [0, 0.]
+            total[name][0] += calls
+            total[name][1] += seconds
+    return total
+
+def write_profile(outdir, label):
+    """
+    Aggregate the counters over the main process and all workers and write
+    {outdir}/{label}_profile.json and {outdir}/{label}_profile.csv.
+    Fractions are relative to the total time spent in log_likelihood_ratio
+    (or in the waveform generator if the likelihood was not instrumented).
+    """
+    if not _enabled:
+        return None
+    total = collect()
+
+    reference = total.get("log_likelihood_ratio", total.get("waveform_generator", [0, 0.]))[1]
+
+    rows = []
+    for name, (calls, seconds) in sorted(total.items(), key=lambda item: -item[1][1]):
+        rows.append(dict(
+            stage=name,
+            calls=calls,
+            total_s=seconds,
+            mean_us=1e6 * seconds / calls if calls > 0 else 0.,
+            fraction=seconds / reference if reference > 0 else float("nan"),
+        ))
+
+    nprocesses = len(glob.glob(os.path.join(_directory, "*.json")))
+    with open(os.path.join(outdir, "{}_profile.json".format(label)), "w") as f:
+        json.dump(dict(label=label, processes=nprocesses, stages=rows), f, indent=2)
+
+    with open(os.path.join(outdir, "{}_profile.csv".format(label)), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["stage", "calls", "total_s", "mean_us", "fraction"])
+        writer.writeheader()
+        writer.writerows(rows)
+
+    return rows
@@ -0,0 +1,207 @@
+"""
+Live progress and convergence metrics of a running dynesty analysis.
+
+progress.print_func replaces bilby's dynesty status printer (pass it as the
+print_func keyword of bilby.run_sampler). Every `interval` seconds it writes
+
+    {outdir}/{label}_metrics.prom     Prometheus text format, replaced atomically
+                                      (e.g. for the node_exporter textfile collector)
+    {outdir}/{label}_progress.jsonl   one JSON line per update, for dashboards
+
+and logs a status line. Optionally the metrics are also served over HTTP on
+127.0.0.1:port/metrics for a Prometheus-style scraper.
+
+print_func is a plain module-level function (so that bilby can serialize it
+into the result's sampler kwargs); its state lives in this module.
+"""
+import http.server
+import json
+import os
+import threading
+import time
+
+import bilby
+import numpy as np
+
+logger = bilby.core.utils.logger
+
+QUANTILES = [0.05, 0.5, 0.9, 0.95]
+
+_state = None
+
+class _State:
+    def __init__(self, outdir, label, index, parameter, interval, dlogz):
+        self.outdir = outdir
+        self.label = label
+        self.index = index
+        self.parameter = parameter
+        self.interval = interval
+        self.dlogz = dlogz
+        self.values = []
+        self.logwt = []
+        self.last_export = 0.
+        self.last_ncall = None
+        self.last_time = None
+        self.calls_per_second = float("nan")
+        self.metrics = ""
+        self.server = None
+
+def search_parameter_keys(priors):
+    """
+    Sampled parameters, in the order bilby passes them to dynesty.
+    Call after the likelihood is set up, since marginalized parameters are
+    fixed in the priors then.
+    """
+    return [key for key in priors
+            if isinstance(priors[key], bilby.core.prior.Prior) and not priors[key].is_fixed]
+
+def start(outdir, label, priors, parameter="xi_tilde", interval=30., port=None, dlogz=None):
+    """
+    Set up the metrics export for a run sampling on `priors`.
+    The running quantiles are of `parameter`.
+    """
+    global _state
+    keys = search_parameter_keys(priors)
+    index = keys.index(parameter) if parameter in keys else None
+    if index is None:
+        logger.warning("{} is not sampled: no running quantiles in the progress metrics".format(parameter))
+
+    bilby.core.utils.check_directory_exists_and_if_not_mkdir(outdir)
+    _state = _State(outdir, label, index, parameter, interval, dlogz)
+
+    if port is not None:
+        _state.server = _serve(port)
+        logger.info("Serving progress metrics on http://127.0.0.1:{}/metrics".format(port))
+    logger.info("Writing progress metrics to {}".format(_metrics_file()))
+
+def stop():
+    """
+    Shut down the HTTP server and stop recording.
+    """
+    global _state
+    if _state is None:
+        return
+    if _state.server is not None:
+        _state.server.shutdown()
+    _state = None
+
+def _metrics_file():
+    return os.path.join(_state.outdir, "{}_metrics.prom".format(_state.label))
+
+def _progress_file():
+    return os.path.join(_state.outdir, "{}_progress.jsonl".format(_state.label))
+
+def weighted_quantiles(values, logwt, quantiles):
+    values = np.asarray(values)
+    if len(values) == 0:
+        return [float("nan") for q in quantiles]
+    weights = np.exp(np.asarray(logwt) - np.max(logwt))
+    order = np.argsort(values)
+    cdf = np.cumsum(weights[order])
+    cdf /= cdf[-1]
+    return [float(np.interp(q, cdf, values[order])) for q in quantiles]
+
+def print_func(results, niter, ncall=None, dlogz=None, *args, **kwargs):
+    """
+    dynesty print_func: record the dead point, and export the metrics every interval seconds.
+    """
+    if _state is None:
+        return
+    if _state.index is not None:
+        _state.values.append(results.vstar[_state.index])
+        _state.logwt.append(results.logwt)
+
+    now = time.time()
+    if now - _state.last_export < _state.interval:
+        return
+    _state.last_export = now
+
+    if ncall is not None:
+        if _state.last_ncall is not None and ncall >= _state.last_ncall and now > _state.last_time:
+            _state.calls_per_second = (ncall - _state.last_ncall) / (now - _state.last_time)
+        _state.last_ncall = ncall
+        _state.last_time = now
+
+    quantiles = weighted_quantiles(_state.values, _state.logwt, QUANTILES)
+    delta_logz = results.delta_logz if results.delta_logz < 1e6 else float("inf")
+
+    record = dict(
+        time=now,
+        iteration=int(niter),
+        likelihood_calls=int(ncall) if ncall is not None else None,
+        calls_per_second=_state.calls_per_second,
+        efficiency_percent=float(results.eff),
+        delta_logz=float(delta_logz),
+        dlogz_target=dlogz if dlogz is not None else _state.dlogz,
+        logz=float(results.logz),
+        log_likelihood_threshold=float(results.loglstar),
+    )
+    for q, value in zip(QUANTILES, quantiles):
+        record["{}_q{:g}".format(_state.parameter, q)] = value
+
+    _export(record, quantiles)
+
+    logger.info("{}it ncall:{} calls/s:{:.3g} eff:{:.1f}% dlogz:{:.3g} {} 90%:{:.4g}".format(
+        niter, ncall, _state.calls_per_second, results.eff, delta_logz,
+        _state.parameter, quantiles[QUANTILES.index(0.9)]))
+
+def _format_value(value):
+    if value is None or np.isnan(value):
+        return "NaN"
+    if np.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+def _export(record, quantiles):
+    with open(_progress_file(), "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+    label = 'label="{}"'.format(_state.label)
+    lines = []
+    def metric(name, value, help, kind="gauge"):
+        lines.append("# HELP nrtidal_{} {}".format(name, help))
+        lines.append("# TYPE nrtidal_{} {}".format(name, kind))
+        if not isinstance(value, list):
+            value = [("", value)]
+        for labels, v in value:
+            lines.append("nrtidal_{}{{{}{}}} {}".format(name, label, labels, _format_value(v)))
+
+    metric("iteration", record["iteration"], "Current dynesty iteration.", "counter")
+    metric("likelihood_calls", record["likelihood_calls"], "Likelihood calls so far.", "counter")
+    metric("likelihood_calls_per_second", record["calls_per_second"], "Likelihood calls per second.")
+    metric("sampling_efficiency_percent", record["efficiency_percent"], "dynesty sampling efficiency (%).")
+    metric("delta_logz", record["delta_logz"], "Current estimate of the remaining ln evidence.")
+    metric("dlogz_target", record["dlogz_target"], "Stopping threshold on delta_logz.")
+    metric("log_evidence", record["logz"], "Current ln evidence estimate.")
+    metric("log_likelihood_threshold", record["log_likelihood_threshold"], "Current ln likelihood threshold.")
+    metric("{}_quantile".format(_state.parameter),
+           [(',quantile="{:g}"'.format(q), v) for q, v in zip(QUANTILES, quantiles)],
+           "Running weighted quantiles of the dead points.")
+    metric("last_update_timestamp_seconds", record["time"], "Unix time of the last update.")
+    _state.metrics = "\n".join(lines) + "\n"
+
+    tmp = _metrics_file() + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(_state.metrics)
+    os.replace(tmp, _metrics_file())
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") not in ["", "/metrics"] or _state is None:
+            self.send_error(404)
+            return
+        body = _state.metrics.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def _serve(port):
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
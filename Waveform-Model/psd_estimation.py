@@ -0,0 +1,202 @@
+"""
+PSDs estimated from the strain itself, cached on disk.
+
+For each detector the PSD is the median (bias corrected) of the Welch
+periodograms (Hann window, 50% overlap by default) of off-source data read from
+the same HDF5 strain files as the analysis:
+
+    + the psd_duration seconds before the analysis segment (as bilby_pipe),
+      completed with the data after it when the file starts too late
+    + segments of segment_duration seconds (default the analysis duration, so
+      that the PSD is on the frequency grid of the analysis), none of which
+      overlap the analysis segment
+
+The segments of all detectors are stacked and transformed with one batched
+FFT. The PSDs are cached in cache_dir, keyed by the sha256 of the strain files
+and of the settings, so that repeated runs (and other runs on the same data)
+do not repeat the FFTs.
+
+    python psd_estimation.py --files H1:H1.hdf5 L1:L1.hdf5 V1:V1.hdf5 --start_time 1187008755 --duration 128 -o GW170817_PSDs.dat
+
+writes the PSDs in the format of GWTC1_GW170817_PSDs.dat (frequency, then one
+column per detector), which PowerSpectralDensity and the runners can read.
+"""
+import hashlib
+import json
+import os
+
+import bilby
+import numpy as np
+from gwpy.timeseries import TimeSeries
+
+import run_cache
+
+logger = bilby.core.utils.logger
+
+# Default off-source duration, in units of the analysis duration (as bilby_pipe).
+PSD_DURATION_FACTOR = 32
+
+# Fewest periodograms for a median PSD (the median of a few is a noisy estimate).
+MINIMUM_SEGMENTS = 8
+
+def median_bias(segments):
+    """
+    Ratio of the median to the mean of `segments` chi^2_2 periodograms (as
+    scipy.signal.welch; ln 2 for many segments).
+    """
+    k = np.arange(1, (segments - 1) // 2 + 1)
+    return 1. + np.sum(1. / (2 * k + 1) - 1. / (2 * k))
+
+def off_source_spans(start_time, duration, data_start_time, data_end_time, psd_duration, segment_duration):
+    """
+    Stretches (start, end) of off-source data: psd_duration seconds before the
+    analysis segment, completed after it if the data start too late.
+    """
+    end_time = start_time + duration
+    before = (max(data_start_time, start_time - psd_duration), start_time)
+    missing = psd_duration - (before[1] - before[0])
+    after = (end_time, min(data_end_time, end_time + max(missing, 0.)))
+    return [(start, end) for start, end in [before, after] if end - start >= segment_duration]
+
+def segment_starts(spans, segment_duration, overlap):
+    """
+    Start times of the Welch segments in each stretch.
+    """
+    step = segment_duration * (1. - overlap)
+    return [start + step * np.arange(int(np.floor((end - start - segment_duration) / step + 1e-9)) + 1)
+            for start, end in spans]
+
+def read_strain(filenames, sampling_frequency=None, format="hdf5.gwosc"):
+    """
+    Strain of each detector {ifo: gwpy TimeSeries}, resampled to sampling_frequency (if given).
+    """
+    strain = {}
+    for det, filename in filenames.items():
+        logger.info("Reading strain of {} from {}".format(det, filename))
+        data = TimeSeries.read(filename, format=format)
+        if sampling_frequency is not None and data.sample_rate.value != sampling_frequency:
+            data = data.resample(sampling_frequency)
+        strain[det] = data
+    return strain
+
+def welch_psds(strain, starts, segment_duration):
+    """
+    Median Welch PSDs of the segments starting at `starts` of each detector
+    (the same segments for all), with one FFT of all the segments. Returns the
+    frequencies and the PSDs (detectors x frequencies).
+    """
+    sampling_frequency = strain[0].sample_rate.value
+    length = int(round(segment_duration * sampling_frequency))
+    segments = np.empty((len(strain), len(starts), length))
+    for i, data in enumerate(strain):
+        offsets = np.rint((starts - data.t0.value) * sampling_frequency).astype(int)
+        values = data.value
+        for j, offset in enumerate(offsets):
+            segments[i, j] = values[offset:offset + length]
+    segments -= np.mean(segments, axis=-1, keepdims=True)
+    window = np.hanning(length)
+    segments *= window
+    periodograms = np.abs(np.fft.rfft(segments, axis=-1)) ** 2
+    periodograms *= 2. / (sampling_frequency * np.sum(window ** 2))
+    psds = np.median(periodograms, axis=1) / median_bias(len(starts))
+    return np.fft.rfftfreq(length, 1. / sampling_frequency), psds
+
+def _cache_key(filenames, settings):
+    sha = hashlib.sha256()
+    for det in sorted(filenames):
+        sha.update(det.encode())
+        sha.update(run_cache.file_sha256(filenames[det]).encode())
+    sha.update(json.dumps(settings, sort_keys=True).encode())
+    return sha.hexdigest()
+
+def estimate_psds(filenames, start_time, duration, sampling_frequency=None, psd_duration=None,
+                  segment_duration=None, overlap=0.5, cache_dir=None, format="hdf5.gwosc"):
+    """
+    Off-source median Welch PSDs of the detectors {ifo: strain file} of an
+    analysis segment [start_time, start_time + duration], read from cache_dir
+    if they have been computed before. Returns the frequencies and {ifo: PSD}.
+    """
+    segment_duration = duration if segment_duration is None else segment_duration
+    psd_duration = PSD_DURATION_FACTOR * duration if psd_duration is None else psd_duration
+    settings = dict(
+        start_time=start_time, duration=duration, sampling_frequency=sampling_frequency,
+        psd_duration=psd_duration, segment_duration=segment_duration, overlap=overlap, format=format,
+        window="hann", average="median")
+
+    cache_file = None
+    if cache_dir is not None:
+        bilby.core.utils.check_directory_exists_and_if_not_mkdir(cache_dir)
+        cache_file = os.path.join(cache_dir, "psd_{}.npz".format(_cache_key(filenames, settings)))
+        if os.path.isfile(cache_file):
+            logger.info("Reading the PSDs from {}".format(cache_file))
+            with np.load(cache_file) as data:
+                return data["frequency_array"], {det: data[det] for det in filenames}
+
+    dets = list(filenames)
+    strain = read_strain(filenames, sampling_frequency, format)
+    data_start_time = max(strain[det].t0.value for det in dets)
+    data_end_time = min(strain[det].t0.value + strain[det].duration.value for det in dets)
+    spans = off_source_spans(start_time, duration, data_start_time, data_end_time, psd_duration, segment_duration)
+    starts = np.concatenate(segment_starts(spans, segment_duration, overlap) + [np.zeros(0)])
+    if len(starts) < MINIMUM_SEGMENTS:
+        logger.warning("Only {} off-source segments of {}s for the PSDs: the estimate is noisy".format(
+            len(starts), segment_duration))
+    if len(starts) == 0:
+        raise ValueError("No off-source data of the analysis segment in the strain files")
+
+    frequency_array, psds = welch_psds([strain[det] for det in dets], starts, segment_duration)
+    logger.info("PSDs of {} from {} segments of {}s in {}".format(
+        ", ".join(dets), len(starts), segment_duration,
+        ", ".join("[{:.0f}, {:.0f}]".format(start, end) for start, end in spans)))
+
+    psds = dict(zip(dets, psds))
+    if cache_file is not None:
+        tmp = cache_file + ".tmp.npz"
+        np.savez(tmp, frequency_array=frequency_array, **psds)
+        os.replace(tmp, cache_file)
+    return frequency_array, psds
+
+def write_psds(filename, frequency_array, psds):
+    """
+    PSDs as columns of a text file: frequency, then one column per detector.
+    """
+    np.savetxt(filename, np.column_stack([frequency_array] + list(psds.values())),
+               header="frequency " + " ".join(psds))
+
+#-------------------------------------------------------------
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Off-source median Welch PSDs from strain files.")
+
+    parser.add_argument("--files", type=str, nargs="+", required=True, metavar="IFO:FILE",
+                        help="Strain files, e.g. H1:H-H1_LOSC_CLN_4_V1-1187007040-2048_no_glitch.hdf5")
+
+    parser.add_argument("--start_time", type=float, required=True,
+                        help="Start time of the analysis segment.")
+
+    parser.add_argument("--duration", type=float, required=True,
+                        help="Duration of the analysis segment.")
+
+    parser.add_argument("--sampling_frequency", type=float, default=None,
+                        help="Resample the strain to this frequency (default: that of the files).")
+
+    parser.add_argument("--psd_duration", type=float, default=None,
+                        help="Off-source duration (default: {} times the analysis duration).".format(PSD_DURATION_FACTOR))
+
+    parser.add_argument("--segment_duration", type=float, default=None,
+                        help="Welch segment duration (default: the analysis duration).")
+
+    parser.add_argument("--cache_dir", type=str, default=None,
+                        help="Where to cache the PSDs.")
+
+    parser.add_argument("-o", "--output", type=str, required=True,
+                        help="Output text file (frequency, then one PSD column per detector).")
+
+    args = parser.parse_args()
+
+    frequency_array, psds = estimate_psds(
+        dict(item.split(":", 1) for item in args.files), args.start_time, args.duration,
+        sampling_frequency=args.sampling_frequency, psd_duration=args.psd_duration,
+        segment_duration=args.segment_duration, cache_dir=args.cache_dir)
+    write_psds(args.output, frequency_array, psds)
@@ -0,0 +1,193 @@
+"""
+Rapid maximum-likelihood point and coarse (lambda_s, xi_tilde) posterior of an
+NRTidal-D run, to check a configuration before the full dynesty run.
+
+    1. a batch of BATCH_DRAWS prior draws is evaluated on a pool of npool workers
+    2. bounded Nelder-Mead maximizations of the likelihood (in the unit cube of
+       the sampled parameters) start from the best draws, one per worker
+    3. the marginalized parameters (e.g. geocent_time, phase) of the best point
+       are reconstructed as bilby's conversion does
+    4. the likelihood is evaluated on a lambda_s x xi_tilde grid with the other
+       parameters at the best point (tidal_grid.py: one base waveform per lambda_s)
+
+The result, {outdir}/{label}_rapid.json, has the maximum-likelihood point (a
+starting point for the full run), the grid marginals and credible bounds, and
+sanity checks of the prior widths: sampled parameters that end at the edge of
+their prior, and grid posterior mass in the outer cells (a prior that cuts the
+posterior).
+"""
+import json
+import multiprocessing
+import os
+import time
+
+import bilby
+import numpy as np
+from scipy.optimize import minimize
+
+import tidal_grid
+
+logger = bilby.core.utils.logger
+
+# Prior draws whose likelihood is evaluated to choose the starting points.
+BATCH_DRAWS = 1000
+
+# Distance to the edge of the unit cube (the prior quantile) below which a parameter is at the edge of its prior.
+EDGE_TOLERANCE = 1e-3
+
+# Margin of the unit cube: its faces are infinite (Gaussian priors) or singular (lambda_s = 0) parameters.
+CUBE_MARGIN = 1e-9
+
+# Posterior mass in the outer grid cells above which the prior is reported as cutting the posterior.
+EDGE_MASS = 0.05
+
+_likelihood = None
+_priors = None
+_keys = None
+
+def _initialize(likelihood, priors, keys):
+    global _likelihood, _priors, _keys
+    _likelihood = likelihood
+    _priors = priors
+    _keys = keys
+
+def search_keys(priors):
+    """
+    Sampled parameters (the likelihood must be set up, so that marginalized parameters are fixed).
+    """
+    return [key for key in priors
+            if isinstance(priors[key], bilby.core.prior.Prior)
+            and not priors[key].is_fixed and not isinstance(priors[key], bilby.core.prior.Constraint)]
+
+def fixed_parameters(priors):
+    """
+    Parameters fixed by priors: delta functions and plain numbers.
+    """
+    fixed = {}
+    for key, prior in priors.items():
+        if isinstance(prior, bilby.core.prior.DeltaFunction):
+            fixed[key] = prior.peak
+        elif isinstance(prior, (int, float)):
+            fixed[key] = prior
+    return fixed
+
+def _parameters(x):
+    parameters = fixed_parameters(_priors)
+    parameters.update(zip(_keys, _priors.rescale(_keys, np.clip(x, CUBE_MARGIN, 1 - CUBE_MARGIN))))
+    return parameters
+
+def _log_likelihood_ratio(x):
+    parameters = _parameters(x)
+    if not _priors.evaluate_constraints(parameters):
+        return -np.inf
+    _likelihood.parameters.update(parameters)
+    log_likelihood_ratio = _likelihood.log_likelihood_ratio()
+    return float(log_likelihood_ratio) if np.isfinite(log_likelihood_ratio) else -np.inf
+
+def _evaluate(xs):
+    return [_log_likelihood_ratio(x) for x in xs]
+
+def _maximize(args):
+    x0, maxiter = args
+    result = minimize(lambda x: -_log_likelihood_ratio(x), x0, method="Nelder-Mead",
+                      bounds=[(0., 1.)] * len(x0),
+                      options=dict(maxiter=maxiter, maxfev=maxiter, xatol=1e-6, fatol=1e-3, adaptive=True))
+    return result.x, -float(result.fun), int(result.nfev)
+
+def _map(function, tasks, npool, likelihood, priors, keys):
+    if npool > 1:
+        with multiprocessing.Pool(npool, initializer=_initialize, initargs=(likelihood, priors, keys)) as pool:
+            return pool.map(function, tasks, chunksize=1)
+    _initialize(likelihood, priors, keys)
+    return [function(task) for task in tasks]
+
+def maximize_likelihood(likelihood, priors, npool=1, draws=BATCH_DRAWS, starts=None, maxiter=2000, seed=None):
+    """
+    Maximum-likelihood point over the sampled parameters of priors.
+    Returns the parameters (with the fixed ones), ln L/L_noise, the unit-cube
+    point and the number of likelihood calls.
+    """
+    keys = search_keys(priors)
+    starts = max(npool, 1) if starts is None else starts
+    rng = np.random.default_rng(seed)
+    cube = rng.uniform(size=(draws, len(keys)))
+
+    batches = np.array_split(cube, max(npool, 1) * 4)
+    log_likelihood_ratios = np.concatenate(_map(_evaluate, batches, npool, likelihood, priors, keys))
+    order = np.argsort(-log_likelihood_ratios)[:starts]
+    logger.info("Best ln L/L_noise of {} prior draws: {:.2f}; maximizing from the best {}".format(
+        draws, log_likelihood_ratios[order[0]], len(order)))
+
+    maxima = _map(_maximize, [(cube[i], maxiter) for i in order], npool, likelihood, priors, keys)
+    best = int(np.argmax([m[1] for m in maxima]))
+    x, log_likelihood_ratio, _ = maxima[best]
+    _initialize(likelihood, priors, keys)
+    return dict(
+        parameters=_parameters(x), log_likelihood_ratio=log_likelihood_ratio, unit_cube=dict(zip(keys, x)),
+        ncalls=draws + sum(m[2] for m in maxima),
+        maxima=[m[1] for m in maxima])
+
+def reconstruct_marginalized_parameters(likelihood, parameters):
+    """
+    The marginalized parameters (time, distance, phase) at the given point, as in bilby's conversion.
+    """
+    parameters = dict(parameters)
+    likelihood.parameters.update(parameters)
+    if any(getattr(likelihood, "{}_marginalization".format(name), False) for name in ["time", "distance", "phase"]):
+        parameters.update(likelihood.generate_posterior_sample_from_marginalized_likelihood())
+    return parameters
+
+def prior_edges(unit_cube):
+    """
+    Sampled parameters whose maximum-likelihood value is at the edge of their prior.
+    """
+    return {key: ("lower" if x < EDGE_TOLERANCE else "upper")
+            for key, x in unit_cube.items() if x < EDGE_TOLERANCE or x > 1 - EDGE_TOLERANCE}
+
+def grid_edge_mass(summary):
+    """
+    Grid posterior mass in the lower and upper cells of lambda_s and xi_tilde.
+    """
+    return {name: dict(lower=summary[name]["marginal"][0], upper=summary[name]["marginal"][-1])
+            for name in ["lambda_s", "xi_tilde"]}
+
+def run(likelihood, priors, outdir, label, npool=1, grid_points=(40, 50), seed=None, **kwargs):
+    """
+    Maximum likelihood, then the (lambda_s, xi_tilde) grid about it (if lambda_s is sampled).
+    Writes and returns the summary.
+    """
+    start = time.perf_counter()
+    maximum = maximize_likelihood(likelihood, priors, npool=npool, seed=seed, **kwargs)
+    logger.info("Maximum ln L/L_noise {:.2f} after {} likelihood calls ({:.0f}s)".format(
+        maximum["log_likelihood_ratio"], maximum["ncalls"], time.perf_counter() - start))
+    best_fit = reconstruct_marginalized_parameters(likelihood, maximum["parameters"])
+
+    summary = dict(
+        maximum_likelihood=best_fit, maximum_log_likelihood_ratio=maximum["log_likelihood_ratio"],
+        optimizer_maxima=maximum["maxima"], likelihood_calls=maximum["ncalls"],
+        prior_edges=prior_edges(maximum["unit_cube"]))
+
+    if "lambda_s" in priors and "xi_tilde" in priors:
+        grid = tidal_grid.TidalGrid(
+            likelihood.waveform_generator, best_fit, *tidal_grid.default_grid(priors, grid_points))
+        log_likelihood_ratio = grid.log_likelihood_ratio(likelihood.interferometers)
+        summary["grid"] = tidal_grid.summarize(grid, log_likelihood_ratio, priors)
+        summary["grid_edge_mass"] = grid_edge_mass(summary["grid"])
+        for name, mass in summary["grid_edge_mass"].items():
+            # the lower edges (0) are physical bounds
+            if mass["upper"] > EDGE_MASS:
+                logger.warning("{:.0%} of the grid posterior of {} is in its upper cell: the prior may cut the posterior".format(
+                    mass["upper"], name))
+    for key, edge in summary["prior_edges"].items():
+        logger.warning("The maximum likelihood {} is at the {} edge of its prior".format(key, edge))
+    summary["wall_time"] = time.perf_counter() - start
+
+    bilby.core.utils.check_directory_exists_and_if_not_mkdir(outdir)
+    filename = os.path.join(outdir, "{}_rapid.json".format(label))
+    with open(filename, "w") as f:
+        json.dump(summary, f, indent=2, default=float)
+    if "grid" in summary:
+        logger.info("Grid: xi_tilde 90% upper bound {:.4g}, lambda_s median {:.4g}".format(
+            summary["grid"]["xi_tilde"]["credible_bounds"]["0.9"], summary["grid"]["lambda_s"]["credible_bounds"]["0.5"]))
+    logger.info("Rapid analysis done in {:.0f}s, see {}".format(summary["wall_time"], filename))
+    return summary
@@ -0,0 +1,227 @@
+"""
+Content-addressed cache of NRTidal-D runs.
+
+The key of a run is the sha256 of its resolved configuration:
+
+    + the priors (after the likelihood has fixed the marginalized parameters)
+    + the likelihood class and marginalization settings
+    + the waveform generator (source model, conversion, waveform arguments, duration, ...)
+    + the data actually analysed: the frequency-domain strain and PSD of each
+      interferometer, and its frequency range
+    + the sha256 of the input files (strain, PSD/ASD files) and of the modules of
+      Waveform-Model (the source models, likelihoods, priors, conversions, ...)
+    + the sampler settings, and the bilby, dynesty and lalsimulation versions
+
+Settings that do not change the result (npool, checkpoint cadence, progress
+output, ...) are left out, so the same analysis submitted with another pool
+size or output directory has the same key.
+
+Each run is done in {cache_dir}/{key[:2]}/{key}/, which holds the resolved
+configuration (config.json), the sampler checkpoints and the result. Submitting
+an identical job returns the cached result at once, or resumes the sampler from
+the checkpoint of an interrupted run. The result is copied to the requested
+outdir/label. An entry is locked while it runs, so that identical jobs running
+at the same time do not share a checkpoint.
+"""
+import errno
+import fcntl
+import glob
+import hashlib
+import json
+import os
+import shutil
+
+import bilby
+import numpy as np
+
+logger = bilby.core.utils.logger
+
+RUN_LABEL = "run"
+
+# run_sampler keyword arguments that do not change the result.
+IGNORED_KWARGS = [
+    "npool", "pool", "queue_size", "print_func", "print_progress",
+    "check_point", "check_point_delta_t", "checkpoint_interval", "checkpoint_latency",
+    "resume", "plot", "save", "exit_code",
+]
+
+# Samplers that differ only in how they checkpoint.
+EQUIVALENT_SAMPLERS = {"preemptible_dynesty": "dynesty"}
+
+class RunInProgress(Exception):
+    pass
+
+def file_sha256(filename, chunk_size=1 << 20):
+    sha = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def array_sha256(array):
+    return hashlib.sha256(np.ascontiguousarray(array).tobytes()).hexdigest()
+
+def _name(function):
+    if function is None:
+        return None
+    return "{}.{}".format(getattr(function, "__module__", ""), getattr(function, "__qualname__", repr(function)))
+
+def _canonical(value):
+    """
+    JSON form of the values found in priors, waveform arguments and sampler settings.
+    """
+    if callable(value):
+        return _name(value)
+    if isinstance(value, np.ndarray):
+        return dict(dtype=str(value.dtype), shape=list(value.shape), sha256=array_sha256(value))
+    if isinstance(value, np.generic):
+        return value.item()
+    return repr(value)
+
+def _prior(prior):
+    """
+    bilby.run_sampler turns fixed parameters into DeltaFunction priors: treat both
+    alike. Tabulated (Interped) priors are keyed by their arrays.
+    """
+    if isinstance(prior, bilby.core.prior.DeltaFunction):
+        prior = prior.peak
+    if isinstance(prior, (int, float, np.number)):
+        return "fixed({!r})".format(prior)
+    if isinstance(prior, bilby.core.prior.Interped):
+        # numpy elides the middle of long arrays in repr: hash the tabulated density itself
+        return "{!r} xx={} yy={}".format(prior, array_sha256(prior.xx), array_sha256(prior.yy))
+    return repr(prior)
+
+def model_files(model_dir):
+    """
+    sha256 of every module in model_dir (the directory of this module), but the tests.
+    """
+    files = sorted(os.path.basename(f) for f in glob.glob(os.path.join(model_dir, "*.py")))
+    return {f: file_sha256(os.path.join(model_dir, f)) for f in files if not f.startswith("test_")}
+
+def versions():
+    import dynesty
+    import lalsimulation
+    return dict(bilby=bilby.__version__, dynesty=dynesty.__version__, lalsimulation=lalsimulation.__version__)
+
+def resolved_config(likelihood, priors, sampler_kwargs, input_files=()):
+    """
+    Everything that determines the result of bilby.run_sampler(likelihood, priors, **sampler_kwargs).
+    """
+    waveform_generator = likelihood.waveform_generator
+    model_dir = os.path.dirname(os.path.abspath(__file__))
+
+    data = {}
+    for ifo in likelihood.interferometers:
+        data[ifo.name] = dict(
+            minimum_frequency=ifo.minimum_frequency,
+            maximum_frequency=ifo.maximum_frequency,
+            start_time=ifo.strain_data.start_time,
+            duration=ifo.strain_data.duration,
+            sampling_frequency=ifo.strain_data.sampling_frequency,
+            frequency_domain_strain=array_sha256(ifo.strain_data.frequency_domain_strain),
+            power_spectral_density=array_sha256(ifo.power_spectral_density_array),
+        )
+
+    kwargs = {key: value for key, value in sampler_kwargs.items() if key not in IGNORED_KWARGS}
+    sampler = kwargs.pop("sampler", "dynesty")
+    if isinstance(sampler, str):
+        sampler = EQUIVALENT_SAMPLERS.get(sampler.lower(), sampler.lower())
+
+    config = dict(
+        priors={key: _prior(priors[key]) for key in priors},
+        likelihood=dict(
+            name=_name(type(likelihood)),
+            **{key: getattr(likelihood, key, None) for key in [
+                "time_marginalization", "phase_marginalization", "distance_marginalization",
+                "calibration_marginalization", "reference_frame", "time_reference", "jitter_time"]}),
+        waveform_generator=dict(
+            frequency_domain_source_model=_name(waveform_generator.frequency_domain_source_model),
+            time_domain_source_model=_name(waveform_generator.time_domain_source_model),
+            parameter_conversion=_name(waveform_generator.parameter_conversion),
+            waveform_arguments=waveform_generator.waveform_arguments,
+            duration=waveform_generator.duration,
+            sampling_frequency=waveform_generator.sampling_frequency,
+            start_time=waveform_generator.start_time,
+        ),
+        data=data,
+        input_files={os.path.basename(f): file_sha256(f) for f in input_files},
+        model_files=model_files(model_dir),
+        sampler=sampler,
+        sampler_kwargs=kwargs,
+        versions=versions(),
+    )
+    if "surrogate_file" in waveform_generator.waveform_arguments:
+        # the waveform arguments only have the path of the surrogate (see surrogate.py)
+        config["surrogate_file"] = file_sha256(waveform_generator.waveform_arguments["surrogate_file"])
+    if hasattr(priors, "transform_state"):
+        # a warm start changes the prior transform, and so the run (see warm_start.py)
+        config["prior_transform"] = priors.transform_state()
+    return config
+
+def config_key(config):
+    text = json.dumps(config, sort_keys=True, default=_canonical)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+class RunCache(object):
+    """
+    Runs keyed by their resolved configuration, in directory.
+    input_files: files the data was read from (strain, PSD/ASD files).
+    """
+    def __init__(self, directory, input_files=()):
+        self.directory = directory
+        self.input_files = list(input_files)
+
+    def entry(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def result_file(self, key):
+        return os.path.join(self.entry(key), "{}_result.json".format(RUN_LABEL))
+
+    def _lock(self, key):
+        f = open(os.path.join(self.entry(key), "lock"), "w")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as e:
+            f.close()
+            if e.errno in (errno.EAGAIN, errno.EACCES):
+                raise RunInProgress("An identical run is in progress in {}".format(self.entry(key)))
+            raise
+        return f
+
+    def run_sampler(self, likelihood, priors, outdir="outdir", label="label", **kwargs):
+        """
+        bilby.run_sampler, through the cache: the sampler only runs if there is
+        no result for this configuration yet, and resumes from the checkpoint
+        of an earlier identical run. The result is also saved to outdir/label.
+        """
+        config = resolved_config(likelihood, priors, kwargs, self.input_files)
+        key = config_key(config)
+        entry = self.entry(key)
+        bilby.core.utils.check_directory_exists_and_if_not_mkdir(entry)
+        logger.info("Run cache key {}".format(key))
+
+        config_file = os.path.join(entry, "config.json")
+        if not os.path.isfile(config_file):
+            with open(config_file + ".tmp", "w") as f:
+                json.dump(config, f, indent=2, sort_keys=True, default=_canonical)
+            os.replace(config_file + ".tmp", config_file)
+
+        lock = self._lock(key)
+        try:
+            if os.path.isfile(self.result_file(key)):
+                logger.info("Found cached result {}".format(self.result_file(key)))
+                result = bilby.core.result.read_in_result(self.result_file(key))
+            else:
+                logger.info("Running in {} (resuming from its checkpoint, if any)".format(entry))
+                result = bilby.run_sampler(
+                    likelihood=likelihood, priors=priors, outdir=entry, label=RUN_LABEL, **kwargs)
+        finally:
+            lock.close()
+
+        bilby.core.utils.check_directory_exists_and_if_not_mkdir(outdir)
+        if os.path.isfile(self.result_file(key)):
+            shutil.copyfile(self.result_file(key), os.path.join(outdir, "{}_result.json".format(label)))
+        result.outdir = outdir
+        result.label = label
+        return result
@@ -0,0 +1,157 @@
+"""
+Choose the dynesty settings (nlive, nact, dlogz) of an NRTidal-D run from a
+wall-clock or core-hour budget and a target precision on the xi_tilde upper bound.
+
+Cost model, for bilby's "rwalk" (ACT tracking random walk) with bound="live":
+
+    iterations        ~ nlive * (H + ln(1/dlogz))
+    calls/iteration   ~ nact * act
+    wall time         ~ iterations * calls/iteration * (likelihood cost) / (npool * efficiency)
+
+where H is the information (prior to posterior KL divergence, in nats), act the
+autocorrelation length of the walk in likelihood calls, and the parallel efficiency
+of K = npool queued proposals with N live points is N ln(1 + K/N) / K.
+
+Precision model, two targets:
+
+    + the statistical error of ln Z is sqrt(H/nlive) nats (Skilling 2006), so a
+      target error sigma on ln Z (nats) needs nlive = H/sigma^2; the evidence left
+      in the live points when the run stops is ~ dlogz (nats), which is kept
+      below sigma
+    + the effective number of posterior samples is ~ nlive / int p(t)^2 dt, where
+      p(t) = Gamma(ndim/2) is the posterior distribution of t = -ln(X) for a
+      roughly Gaussian posterior. The posterior mass 1-q behind the q upper bound
+      (xi_tilde is usually bounded from above) estimated from n_eff samples has
+      a standard error sqrt(q(1-q)/n_eff), a relative error
+      sqrt(q/((1-q) n_eff)): a target relative error `precision` needs
+      n_eff = q/((1-q) precision^2)
+
+At the defaults (5% on the mass behind the 90% bound) that is 3600 effective
+samples, ~420 live points for ndim = 13; the evidence target (750 live points)
+sets nlive unless the precision target is tighter or ndim smaller.
+"""
+import time
+
+import bilby
+import numpy as np
+from scipy.special import gammaln
+
+logger = bilby.core.utils.logger
+
+def measure_likelihood_cost(likelihood, priors, ncalls=20):
+    """
+    Median wall time (s) of a likelihood evaluation at draws from the prior.
+    """
+    times = np.zeros(ncalls)
+    for i in range(ncalls):
+        parameters = priors.sample()
+        likelihood.parameters.update(parameters)
+        start = time.perf_counter()
+        likelihood.log_likelihood_ratio()
+        times[i] = time.perf_counter() - start
+    return float(np.median(times))
+
+def effective_samples_per_live_point(ndim):
+    """
+    n_eff/nlive = 1/int p(t)^2 dt for p(t) = Gamma(k=ndim/2).
+    """
+    k = max(ndim / 2., 1.)
+    log_int_p2 = gammaln(2 * k - 1) - (2 * k - 1) * np.log(2) - 2 * gammaln(k)
+    return float(np.exp(-log_int_p2))
+
+def parallel_efficiency(npool, nlive):
+    return nlive * np.log1p(npool / nlive) / npool
+
+def projected_cost(nlive, nact, dlogz, likelihood_cost, npool, information, act):
+    """
+    Projected iterations, likelihood calls, wall time (s) and core hours.
+    """
+    npool = max(npool, 1)
+    iterations = nlive * (information + np.log(1. / dlogz))
+    calls = iterations * nact * act + nlive
+    wall = calls * likelihood_cost / (npool * parallel_efficiency(npool, nlive))
+    return dict(
+        iterations=iterations,
+        likelihood_calls=calls,
+        wall_hours=wall / 3600.,
+        core_hours=wall * npool / 3600.,
+    )
+
+def required_nlive(precision, ndim, quantile=0.9, information=30., log_evidence_error=0.2):
+    """
+    Live points for a relative standard error `precision` on the posterior mass
+    behind the `quantile` upper bound and a statistical error log_evidence_error (nats) on ln Z, for
+    an information of `information` nats.
+    """
+    n_eff = quantile / ((1 - quantile) * precision ** 2)
+    nlive_quantile = n_eff / effective_samples_per_live_point(ndim)
+    nlive_evidence = information / log_evidence_error ** 2
+    return int(np.ceil(max(nlive_quantile, nlive_evidence)))
+
+def choose_settings(
+        likelihood, priors, npool=1,
+        wall_hours=None, core_hours=None,
+        precision=0.05, quantile=0.9, log_evidence_error=0.2,
+        information=30., act=10.,
+        nact_options=(10, 5, 3), nlive_min=250, nlive_max=1500, dlogz_max=0.1):
+    """
+    Measure the likelihood cost and choose nlive, nact and dlogz so that the
+    projected run fits in the wall-clock (hours) and/or core-hour budget and
+    reaches a relative standard error `precision` on the posterior mass behind
+    the `quantile` upper bound on xi_tilde and an error log_evidence_error (nats) on ln Z.
+
+    nlive is the one needed for the targets (within [nlive_min, nlive_max]) and
+    the largest nact that fits is used; if none fits, nlive is reduced (down to
+    nlive_min) with a warning.
+    Returns the settings, to be passed on to bilby.run_sampler.
+    """
+    marginalized = getattr(likelihood, "_marginalized_parameters", [])
+    ndim = len([key for key in priors
+                if isinstance(priors[key], bilby.core.prior.Prior) and not priors[key].is_fixed
+                and not isinstance(priors[key], bilby.core.prior.Constraint) and key not in marginalized])
+    likelihood_cost = measure_likelihood_cost(likelihood, priors)
+
+    dlogz = float(np.clip(log_evidence_error, 1e-3, dlogz_max))
+
+    nlive_needed = int(np.clip(
+        required_nlive(precision, ndim, quantile, information, log_evidence_error), nlive_min, nlive_max))
+
+    def fits(nlive, nact):
+        cost = projected_cost(nlive, nact, dlogz, likelihood_cost, npool, information, act)
+        return ((wall_hours is None or cost["wall_hours"] <= wall_hours) and
+                (core_hours is None or cost["core_hours"] <= core_hours))
+
+    nact = None
+    for option in sorted(nact_options, reverse=True):
+        if fits(nlive_needed, option):
+            nact = option
+            break
+
+    if nact is None:
+        nact = min(nact_options)
+        nlive = nlive_needed
+        while nlive > nlive_min and not fits(nlive, nact):
+            nlive = max(int(0.9 * nlive), nlive_min)
+        logger.warning(
+            "Sampler budget too small for the target precision {} on the {} quantile of xi_tilde: "
+            "using nlive={} instead of {}".format(precision, quantile, nlive, nlive_needed))
+    else:
+        nlive = nlive_needed
+
+    cost = projected_cost(nlive, nact, dlogz, likelihood_cost, npool, information, act)
+    n_eff = nlive * effective_samples_per_live_point(ndim)
+    achieved = np.sqrt(quantile / ((1 - quantile) * n_eff))
+    achieved_log_evidence_error = np.sqrt(information / nlive)
+
+    logger.info("Sampler budget: likelihood cost {:.3g} s/call, ndim={}, npool={}".format(
+        likelihood_cost, ndim, npool))
+    logger.info("Sampler budget: budget wall_hours={}, core_hours={}, target precision {} on the {} quantile, "
+                "{} nats on ln Z".format(wall_hours, core_hours, precision, quantile, log_evidence_error))
+    logger.info("Sampler budget: chose nlive={}, nact={}, dlogz={:.3g}".format(nlive, nact, dlogz))
+    logger.info("Sampler budget: projected {:.3g} iterations, {:.3g} likelihood calls, "
+                "{:.3g} wall hours, {:.3g} core hours, precision {:.3g}, {:.3g} nats on ln Z "
+                "(assuming H={} nats, act={})".format(
+        cost["iterations"], cost["likelihood_calls"], cost["wall_hours"], cost["core_hours"],
+        achieved, achieved_log_evidence_error, information, act))
+
+    return dict(nlive=nlive, nact=nact, dlogz=dlogz)
@@ -0,0 +1,211 @@
+"""
+Stacking of xi_tilde constraints over events.
+
+If xi_tilde (or any other parameter) is shared by the events, the combined
+posterior is
+
+    p(xi | d_1, ..., d_N)  ~  pi_pop(xi) * prod_i L_i(xi),    L_i(xi) ~ p(xi | d_i) / pi_i(xi)
+
+where p(xi | d_i) is the marginal posterior of event i and pi_i its sampling prior
+(e.g. Uniform(0, 1000)), which is divided out. Each marginal posterior is
+estimated once on a shared grid, by a binned Gaussian KDE (reflected at the
+edges of the prior, as xi_tilde = 0 is an edge) or a histogram (which needs a
+grid coarse enough for the bins to be well populated), so that
+combining N events costs O(N x grid).
+
+The posteriors are read from posterior stores ({label}_posterior.h5, see
+posterior_store.py) or bilby result files:
+
+    python stacking.py */output/*_posterior.h5 -o stacked
+"""
+import json
+
+import bilby
+import numpy as np
+
+import posterior_store
+
+logger = bilby.core.utils.logger
+
+# Kernel half-width, in bandwidths.
+KERNEL_WIDTH = 5
+
+# Floor of the density estimates, in samples spread over the grid, so that an
+# event does not veto the grid points beyond its kernel (ln 0).
+FLOOR_SAMPLES = 0.5
+
+def read_event(filename, parameter="xi_tilde"):
+    """
+    Samples of parameter and its sampling prior, from a posterior store or a result file.
+    """
+    if filename.endswith(".h5"):
+        with posterior_store.PosteriorStore(filename) as store:
+            samples = store[parameter]
+            prior = store.attrs["priors"].get(parameter)
+        if prior is not None:
+            prior = bilby.core.prior.PriorDict(dictionary={parameter: prior})[parameter]
+    else:
+        result = bilby.core.result.read_in_result(filename)
+        samples = result.posterior[parameter].to_numpy()
+        prior = result.priors.get(parameter)
+    return np.asarray(samples, dtype=float), prior
+
+def scott_bandwidth(samples):
+    return np.std(samples) * len(samples) ** (-1. / 5)
+
+def histogram_density(samples, grid):
+    """
+    Normalized histogram of the samples, at the points of the (uniform) grid.
+    """
+    dx = grid[1] - grid[0]
+    edges = np.append(grid - dx / 2, grid[-1] + dx / 2)
+    counts, _ = np.histogram(samples, bins=edges)
+    return counts / (len(samples) * dx)
+
+def kde_density(samples, grid, bandwidth=None, lower=None, upper=None):
+    """
+    Gaussian KDE of the samples on the (uniform) grid: the samples are binned
+    on the grid and the counts convolved with the kernel. Samples are reflected
+    about the lower/upper edges of their support, if given.
+    """
+    if bandwidth is None:
+        bandwidth = scott_bandwidth(samples)
+    dx = grid[1] - grid[0]
+    bandwidth = max(bandwidth, dx)
+
+    reflected = [samples]
+    if lower is not None and np.isfinite(lower):
+        reflected.append(2 * lower - samples)
+    if upper is not None and np.isfinite(upper):
+        reflected.append(2 * upper - samples)
+
+    m = int(np.ceil(KERNEL_WIDTH * bandwidth / dx))
+    extended = grid[0] + dx * np.arange(-m, len(grid) + m)
+    counts = histogram_density(np.concatenate(reflected), extended) * len(reflected)
+
+    offsets = dx * np.arange(-m, m + 1)
+    kernel = np.exp(-0.5 * (offsets / bandwidth) ** 2)
+    kernel /= np.sum(kernel)
+    return np.convolve(counts, kernel, mode="same")[m:m + len(grid)]
+
+def log_likelihood_on_grid(samples, prior, grid, method="kde", bandwidth=None):
+    """
+    ln L(x) = ln p(x|d) - ln pi(x) on the grid (up to a constant), the sampling
+    prior pi divided out. The density estimate is floored (see FLOOR_SAMPLES),
+    and ln L is -inf only outside the prior.
+    """
+    lower = getattr(prior, "minimum", None)
+    upper = getattr(prior, "maximum", None)
+    if method == "kde":
+        density = np.maximum(kde_density(samples, grid, bandwidth, lower, upper),
+                             FLOOR_SAMPLES / (len(samples) * (grid[-1] - grid[0])))
+    elif method == "histogram":
+        # at least half a sample per bin, so that empty bins do not veto the other events
+        density = np.maximum(histogram_density(samples, grid), 0.5 / (len(samples) * (grid[1] - grid[0])))
+    else:
+        raise ValueError("Unknown method {}, must be kde or histogram".format(method))
+
+    prior_density = prior.prob(grid) if prior is not None else np.ones_like(grid)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_likelihood = np.log(density) - np.log(prior_density)
+    log_likelihood[~(prior_density > 0)] = -np.inf
+    return log_likelihood
+
+def stack(log_likelihoods, grid, log_population_prior=None):
+    """
+    Combined (normalized) posterior density on the grid, from the per-event
+    ln likelihoods (an N x grid array), and the flat or given population prior.
+    """
+    log_posterior = np.sum(log_likelihoods, axis=0)
+    if log_population_prior is not None:
+        log_posterior = log_posterior + log_population_prior
+    if not np.any(np.isfinite(log_posterior)):
+        raise ValueError("The events have no common support on the grid")
+    posterior = np.exp(log_posterior - np.max(log_posterior[np.isfinite(log_posterior)]))
+    return posterior / _cumulative_integral(posterior, grid)[-1]
+
+def _cumulative_integral(density, grid):
+    return np.concatenate([[0], np.cumsum(0.5 * (density[1:] + density[:-1]) * np.diff(grid))])
+
+def credible_bounds(density, grid, quantiles=(0.05, 0.5, 0.9, 0.95)):
+    cdf = _cumulative_integral(density, grid)
+    cdf /= cdf[-1]
+    return {q: float(np.interp(q, cdf, grid)) for q in quantiles}
+
+def stack_events(filenames, parameter="xi_tilde", grid=None, method="kde", bandwidth=None, scale=1.):
+    """
+    Read the events and stack them on the grid (default: 1000 points over the
+    prior of the first event). Returns the grid, the per-event ln likelihoods
+    and the combined posterior density, with parameter multiplied by scale.
+    """
+    events = [read_event(f, parameter) for f in filenames]
+    lowest = np.argmax([np.min(samples) for samples, _ in events])
+    highest = np.argmin([np.max(samples) for samples, _ in events])
+    if np.min(events[lowest][0]) > np.max(events[highest][0]):
+        logger.warning("The {} samples of {} (all above {:.4g}) and {} (all below {:.4g}) do not overlap: "
+                       "the events are in tension, and the stacked posterior between them is set by the "
+                       "floor of the density estimates".format(
+                           parameter, filenames[lowest], np.min(events[lowest][0]),
+                           filenames[highest], np.max(events[highest][0])))
+    if grid is None:
+        prior = events[0][1]
+        grid = np.linspace(prior.minimum, prior.maximum, 1000)
+    grid = np.asarray(grid, dtype=float)
+
+    log_likelihoods = np.empty((len(events), len(grid)))
+    for i, (samples, prior) in enumerate(events):
+        log_likelihoods[i] = log_likelihood_on_grid(samples, prior, grid, method, bandwidth)
+    posterior = stack(log_likelihoods, grid)
+    return grid * scale, log_likelihoods, posterior / scale
+
+#-----------------------------------------------------------------
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    import nrtidal_d
+
+    parser = argparse.ArgumentParser(description="Stack the xi_tilde constraints of several events.")
+
+    parser.add_argument("files", type=str, nargs="+",
+                        help="Posterior stores ({label}_posterior.h5) or bilby result files.")
+
+    parser.add_argument("-p", "--parameter", type=str, default="xi_tilde",
+                        help="Parameter shared by the events.")
+
+    parser.add_argument("-g", "--grid", type=float, nargs=3, default=None, metavar=("MIN", "MAX", "N"),
+                        help="Grid (default: 1000 points over the prior of the first event).")
+
+    parser.add_argument("-m", "--method", type=str, default="kde", choices=["kde", "histogram"],
+                        help="Density estimate of each event.")
+
+    parser.add_argument("-b", "--bandwidth", type=float, default=None,
+                        help="KDE bandwidth (default: Scott's rule, per event).")
+
+    parser.add_argument("-o", "--output", type=str, default="stacked",
+                        help="Output file stem (.json and .csv are written).")
+
+    parser.add_argument("--paper_units", action="store_true",
+                        help="Report xi_tilde with the factor of 8 of our papers.")
+
+    args = parser.parse_args()
+
+    grid = np.linspace(args.grid[0], args.grid[1], int(args.grid[2])) if args.grid is not None else None
+    scale = nrtidal_d.XI_TILDE_PAPER_FACTOR if args.paper_units and args.parameter == "xi_tilde" else 1.
+
+    start = time.perf_counter()
+    grid, log_likelihoods, posterior = stack_events(
+        args.files, args.parameter, grid, args.method, args.bandwidth, scale)
+    bounds = credible_bounds(posterior, grid)
+    logger.info("Stacked {} events on {} grid points in {:.2f}s".format(
+        len(args.files), len(grid), time.perf_counter() - start))
+
+    with open(args.output + ".json", "w") as f:
+        json.dump(dict(
+            files=args.files, parameter=args.parameter, method=args.method, scale=scale,
+            credible_bounds={"{:g}".format(q): v for q, v in bounds.items()}), f, indent=2)
+    np.savetxt(args.output + ".csv", np.column_stack([grid, posterior]), delimiter=",",
+               header="{},posterior_density".format(args.parameter), comments="")
+
+    for q, value in bounds.items():
+        print("{} {:g} quantile: {:.4g}".format(args.parameter, q, value))
@@ -0,0 +1,412 @@
+"""
+Streaming low-latency xi_tilde analysis.
+
+Strain arrives in chunks, per detector, from a local source: a replay of strain
+files (optionally at the real rate) or a local socket, a stand-in for a live
+frame feed. For each detector we keep
+
+    + a ring buffer of the last `duration` + `post_trigger_duration` seconds
+    + a rolling PSD: the median (bias corrected) of the Welch periodograms of
+      the last `psd_segments` segments of `psd_segment_duration` seconds
+
+and when the data up to trigger_time + post_trigger_duration have arrived, the
+analysis segment is cut from the buffers and the (lambda_s, xi_tilde) posterior
+is evaluated on a grid (tidal_grid.py) with the other parameters fixed to a
+reference point (e.g. the parameters of the low-latency alert). The base
+waveforms of the grid are cached, so that later triggers with the same
+reference point only cost the inner products.
+
+Socket protocol: each chunk is a JSON header line
+
+    {"ifo": "H1", "start_time": ..., "sampling_frequency": ..., "length": n}
+
+followed by n little-endian float64 samples.
+
+    python streaming.py replay --files H1:H1.hdf5 L1:L1.hdf5 --port 5555 --speed 1
+    python streaming.py analyse --port 5555 --trigger_time 1187008882.43 --reference alert.json
+    python streaming.py analyse --files H1:H1.hdf5 L1:L1.hdf5 --trigger_time ... --reference alert.json
+
+The reference JSON holds the waveform parameters of source_binary_love except
+lambda_s and xi_tilde (chirp_mass and mass_ratio may replace the masses).
+"""
+import collections
+import json
+import os
+import socket
+import time
+
+import bilby
+import numpy as np
+
+import nrtidal_d
+import tidal_grid
+
+logger = bilby.core.utils.logger
+
+Chunk = collections.namedtuple("Chunk", ["ifo", "start_time", "sampling_frequency", "data"])
+
+#-----------------------------------------------------------------
+# Sources of strain chunks
+
+class ReplaySource(object):
+    """
+    Chunks of `chunk_duration` seconds of the given gwpy TimeSeries {ifo: series},
+    in time order. With speed > 0 the chunks are released at `speed` times the
+    rate at which the data were taken.
+    """
+    def __init__(self, timeseries, chunk_duration=1., speed=0.):
+        self.timeseries = timeseries
+        self.chunk_duration = chunk_duration
+        self.speed = speed
+
+    @classmethod
+    def from_files(cls, filenames, start_time=None, end_time=None, format="hdf5.gwosc", **kwargs):
+        """
+        Replay of strain files {ifo: filename}, read with gwpy.
+        """
+        from gwpy.timeseries import TimeSeries
+        timeseries = {ifo: TimeSeries.read(filename, start=start_time, end=end_time, format=format)
+                      for ifo, filename in filenames.items()}
+        return cls(timeseries, **kwargs)
+
+    def __iter__(self):
+        start_time = max(series.t0.value for series in self.timeseries.values())
+        end_time = min(series.t0.value + series.duration.value for series in self.timeseries.values())
+        wall_start = time.time()
+        t = start_time
+        while t + self.chunk_duration <= end_time + 1e-9:
+            if self.speed > 0:
+                time.sleep(max(wall_start + (t + self.chunk_duration - start_time) / self.speed - time.time(), 0.))
+            for ifo, series in self.timeseries.items():
+                sampling_frequency = series.sample_rate.value
+                first = int(round((t - series.t0.value) * sampling_frequency))
+                length = int(round(self.chunk_duration * sampling_frequency))
+                yield Chunk(ifo, t, sampling_frequency, np.asarray(series.value[first:first + length], dtype=float))
+            t += self.chunk_duration
+
+def _send(connection, chunk):
+    header = dict(ifo=chunk.ifo, start_time=chunk.start_time,
+                  sampling_frequency=chunk.sampling_frequency, length=len(chunk.data))
+    connection.sendall(json.dumps(header).encode() + b"\n")
+    connection.sendall(np.ascontiguousarray(chunk.data, dtype="<f8").tobytes())
+
+def serve(source, port, host="127.0.0.1"):
+    """
+    Send the chunks of source to the first client that connects to host:port.
+    """
+    with socket.create_server((host, port)) as server:
+        logger.info("Waiting for a client on {}:{}".format(host, port))
+        connection, address = server.accept()
+        with connection:
+            logger.info("Streaming strain to {}".format(address))
+            for chunk in source:
+                _send(connection, chunk)
+
+class SocketSource(object):
+    """
+    Chunks received from a local socket (see serve).
+    """
+    def __init__(self, port, host="127.0.0.1", timeout=None):
+        self.port = port
+        self.host = host
+        self.timeout = timeout
+
+    def __iter__(self):
+        with socket.create_connection((self.host, self.port), timeout=self.timeout) as connection:
+            stream = connection.makefile("rb")
+            while True:
+                line = stream.readline()
+                if not line:
+                    return
+                header = json.loads(line)
+                data = np.frombuffer(stream.read(8 * header["length"]), dtype="<f8")
+                if len(data) < header["length"]:
+                    logger.warning("Stream ended in the middle of a chunk")
+                    return
+                yield Chunk(header["ifo"], header["start_time"], header["sampling_frequency"], data.astype(float))
+
+#-----------------------------------------------------------------
+# Rolling data buffer and PSD
+
+class StrainBuffer(object):
+    """
+    Ring buffer of the last `duration` seconds of strain of a detector.
+    """
+    def __init__(self, duration, sampling_frequency):
+        self.sampling_frequency = sampling_frequency
+        self.data = np.zeros(int(round(duration * sampling_frequency)))
+        self.filled = 0
+        self.end_time = None
+
+    @property
+    def start_time(self):
+        return self.end_time - self.filled / self.sampling_frequency
+
+    def append(self, start_time, data):
+        if self.end_time is not None and abs(start_time - self.end_time) > 0.5 / self.sampling_frequency:
+            logger.warning("Gap in the strain at {}: resetting the buffer".format(self.end_time))
+            self.filled = 0
+        data = data[-len(self.data):]
+        n = len(data)
+        self.data[:-n] = self.data[n:]
+        self.data[-n:] = data
+        self.filled = min(self.filled + n, len(self.data))
+        self.end_time = start_time + n / self.sampling_frequency
+
+    def segment(self, start_time, end_time):
+        """
+        The strain between start_time and end_time, or None if it is not (or no longer) buffered.
+        """
+        if self.end_time is None or start_time < self.start_time - 1e-9 or end_time > self.end_time + 1e-9:
+            return None
+        first = len(self.data) - int(round((self.end_time - start_time) * self.sampling_frequency))
+        return self.data[first:first + int(round((end_time - start_time) * self.sampling_frequency))].copy()
+
+class RollingPSD(object):
+    """
+    Median of the Welch periodograms (Hann window, 50% overlap) of the last
+    `segments` segments, updated as the strain arrives.
+    """
+    def __init__(self, sampling_frequency, segment_duration=4., segments=32):
+        self.sampling_frequency = sampling_frequency
+        self.length = int(round(segment_duration * sampling_frequency))
+        self.window = np.hanning(self.length)
+        self.normalization = 2. / (sampling_frequency * np.sum(self.window ** 2))
+        self.periodograms = collections.deque(maxlen=segments)
+        self.pending = np.zeros(0)
+        self.frequency_array = np.fft.rfftfreq(self.length, 1. / sampling_frequency)
+
+    def reset(self):
+        self.periodograms.clear()
+        self.pending = np.zeros(0)
+
+    def update(self, data):
+        self.pending = np.concatenate([self.pending, data])
+        step = self.length // 2
+        while len(self.pending) >= self.length:
+            segment = self.pending[:self.length]
+            self.periodograms.append(
+                self.normalization * np.abs(np.fft.rfft((segment - np.mean(segment)) * self.window)) ** 2)
+            self.pending = self.pending[step:]
+
+    def __len__(self):
+        return len(self.periodograms)
+
+    def psd(self):
+        """
+        Frequencies and PSD. The median of chi^2_2 periodograms is ln 2 times their mean.
+        """
+        return self.frequency_array, np.median(np.array(self.periodograms), axis=0) / np.log(2)
+
+#-----------------------------------------------------------------
+# Analysis
+
+class StreamingAnalysis(object):
+    """
+    Buffers the strain of each detector and evaluates the (lambda_s, xi_tilde)
+    grid around the trigger times, once their data have arrived.
+    """
+    def __init__(self, reference_parameters, priors=None, duration=128, post_trigger_duration=2.,
+                 sampling_frequency=4096, minimum_frequency=20., waveform_arguments=None,
+                 psd_segment_duration=4., psd_segments=32, grid_points=(40, 50), outdir=".", label="streaming"):
+        self.reference_parameters = dict(reference_parameters)
+        self.priors = priors if priors is not None else default_priors()
+        self.duration = duration
+        self.post_trigger_duration = post_trigger_duration
+        self.sampling_frequency = sampling_frequency
+        self.minimum_frequency = minimum_frequency
+        self.psd_segment_duration = psd_segment_duration
+        self.psd_segments = psd_segments
+        self.outdir = outdir
+        self.label = label
+
+        if waveform_arguments is None:
+            waveform_arguments = dict(waveform_approximant="IMRPhenomD_NRTidal", reference_frequency=20.,
+                                      minimum_frequency=minimum_frequency)
+        self.waveform_generator = bilby.gw.WaveformGenerator(
+            duration=duration,
+            sampling_frequency=sampling_frequency,
+            frequency_domain_source_model=nrtidal_d.source_binary_love,
+            parameter_conversion=bilby.gw.conversion.convert_to_lal_binary_neutron_star_parameters,
+            waveform_arguments=waveform_arguments
+        )
+        self.grid = tidal_grid.TidalGrid(
+            self.waveform_generator, self.reference_parameters, *tidal_grid.default_grid(self.priors, grid_points))
+
+        self.buffers = {}
+        self.psds = {}
+        self.results = {}
+
+    def push(self, chunk):
+        data = chunk.data
+        if chunk.sampling_frequency != self.sampling_frequency:
+            data = _resample(data, chunk.sampling_frequency, self.sampling_frequency)
+        if chunk.ifo not in self.buffers:
+            self.buffers[chunk.ifo] = StrainBuffer(self.duration + self.post_trigger_duration, self.sampling_frequency)
+            self.psds[chunk.ifo] = RollingPSD(self.sampling_frequency, self.psd_segment_duration, self.psd_segments)
+        buffer = self.buffers[chunk.ifo]
+        if buffer.end_time is not None and abs(chunk.start_time - buffer.end_time) > 0.5 / self.sampling_frequency:
+            self.psds[chunk.ifo].reset()
+        buffer.append(chunk.start_time, data)
+        self.psds[chunk.ifo].update(data)
+
+    def ready(self, trigger_time):
+        """
+        Whether all detectors have the analysis segment of trigger_time, and a PSD.
+        """
+        end_time = trigger_time + self.post_trigger_duration
+        return len(self.buffers) > 0 and all(
+            buffer.end_time is not None and buffer.end_time >= end_time and len(self.psds[ifo]) > 0
+            for ifo, buffer in self.buffers.items())
+
+    def interferometers(self, trigger_time):
+        """
+        Interferometers with the analysis segment of trigger_time and the current PSDs.
+        """
+        end_time = trigger_time + self.post_trigger_duration
+        start_time = end_time - self.duration
+        ifo_list = bilby.gw.detector.InterferometerList([])
+        for ifo_name, buffer in self.buffers.items():
+            data = buffer.segment(start_time, end_time)
+            if data is None:
+                logger.warning("No data of {} for the trigger at {}".format(ifo_name, trigger_time))
+                continue
+            ifo = bilby.gw.detector.get_empty_interferometer(ifo_name)
+            ifo.strain_data.set_from_time_domain_strain(
+                data, sampling_frequency=self.sampling_frequency, duration=self.duration, start_time=start_time)
+            frequency_array, psd = self.psds[ifo_name].psd()
+            ifo.power_spectral_density = bilby.gw.detector.PowerSpectralDensity(
+                frequency_array=frequency_array[1:], psd_array=psd[1:])
+            ifo.minimum_frequency = self.minimum_frequency
+            ifo_list.append(ifo)
+        return ifo_list
+
+    def estimate(self, trigger_time):
+        """
+        Rapid (lambda_s, xi_tilde) estimate for the trigger, written to
+        {outdir}/{label}_{trigger_time}_rapid.json.
+        """
+        start = time.perf_counter()
+        self.grid.parameters["geocent_time"] = self.reference_parameters.get("geocent_time", trigger_time)
+        ifo_list = self.interferometers(trigger_time)
+        log_likelihood_ratio = self.grid.log_likelihood_ratio(ifo_list)
+        summary = tidal_grid.summarize(self.grid, log_likelihood_ratio, self.priors)
+        summary.update(
+            trigger_time=trigger_time, detectors=[ifo.name for ifo in ifo_list],
+            reference_parameters=self.grid.parameters, wall_time=time.perf_counter() - start)
+
+        bilby.core.utils.check_directory_exists_and_if_not_mkdir(self.outdir)
+        filename = os.path.join(self.outdir, "{}_{:.3f}_rapid.json".format(self.label, trigger_time))
+        with open(filename, "w") as f:
+            json.dump(summary, f, indent=2, default=float)
+        logger.info("Trigger {:.3f}: xi_tilde 90% upper bound {:.4g}, lambda_s median {:.4g} ({:.1f}s), see {}".format(
+            trigger_time, summary["xi_tilde"]["credible_bounds"].get("0.9", np.nan),
+            summary["lambda_s"]["credible_bounds"].get("0.5", np.nan), summary["wall_time"], filename))
+        self.results[trigger_time] = summary
+        return summary
+
+    def run(self, source, trigger_times):
+        """
+        Consume the source, and estimate each trigger as soon as its data have arrived.
+        """
+        pending = sorted(trigger_times)
+        for chunk in source:
+            self.push(chunk)
+            while len(pending) > 0 and self.ready(pending[0]):
+                self.estimate(pending.pop(0))
+            if len(pending) == 0:
+                break
+        for trigger_time in pending:
+            logger.warning("The stream ended before the data of the trigger at {}".format(trigger_time))
+        return self.results
+
+def _resample(data, sampling_frequency, new_sampling_frequency):
+    from scipy.signal import resample_poly
+    from fractions import Fraction
+    ratio = Fraction(new_sampling_frequency / sampling_frequency).limit_denominator(1000)
+    return resample_poly(data, ratio.numerator, ratio.denominator)
+
+def default_priors():
+    """
+    lambda_s and xi_tilde priors of the GW170817 binary Love runners.
+    """
+    priors = bilby.core.prior.PriorDict()
+    priors["lambda_s"] = bilby.core.prior.Triangular(name="lambda_s", mode=1500, minimum=0, maximum=3000)
+    priors["xi_tilde"] = bilby.core.prior.Uniform(0, 1000, name="xi_tilde")
+    return priors
+
+def _parse_files(items):
+    return dict(item.split(":", 1) for item in items)
+
+#-----------------------------------------------------------------
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Streaming low-latency xi tilde analysis.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    replay = subparsers.add_parser("replay", help="Serve strain files on a local socket.")
+    analyse = subparsers.add_parser("analyse", help="Rapid xi tilde estimates of triggers in a strain stream.")
+
+    for subparser in [replay, analyse]:
+        subparser.add_argument("--files", type=str, nargs="+", default=None, metavar="IFO:FILE",
+                               help="Strain files, e.g. H1:H-H1_GWOSC_4KHZ_R1-1187006835-4096.hdf5")
+
+        subparser.add_argument("--format", type=str, default="hdf5.gwosc",
+                               help="gwpy format of the strain files.")
+
+        subparser.add_argument("--port", type=int, default=None,
+                               help="Local port of the stream.")
+
+        subparser.add_argument("--chunk_duration", type=float, default=1.,
+                               help="Seconds of strain per chunk.")
+
+        subparser.add_argument("--speed", type=float, default=0.,
+                               help="Replay at this multiple of the real rate (0: as fast as possible).")
+
+    analyse.add_argument("--trigger_time", type=float, nargs="+", required=True,
+                         help="GPS trigger times.")
+
+    analyse.add_argument("--reference", type=str, required=True,
+                         help="JSON file of the reference parameters (e.g. of the alert).")
+
+    analyse.add_argument("--duration", type=float, default=128,
+                         help="Analysis segment duration.")
+
+    analyse.add_argument("--sampling_frequency", type=float, default=4096,
+                         help="Sampling frequency of the analysis.")
+
+    analyse.add_argument("--minimum_frequency", type=float, default=20.,
+                         help="Low frequency cutoff of the likelihood.")
+
+    analyse.add_argument("--grid_points", type=int, nargs=2, default=[40, 50], metavar=("LAMBDA_S", "XI_TILDE"),
+                         help="Points of the lambda_s and xi tilde grids.")
+
+    analyse.add_argument("-o", "--outdir", type=str, default="outdir_streaming",
+                         help="Output directory.")
+
+    analyse.add_argument("-l", "--label", type=str, default="streaming",
+                         help="Label of the output files.")
+
+    args = parser.parse_args()
+
+    if args.files is not None:
+        source = ReplaySource.from_files(_parse_files(args.files), format=args.format,
+                                         chunk_duration=args.chunk_duration, speed=args.speed)
+    elif args.port is not None and args.command == "analyse":
+        source = SocketSource(args.port)
+    else:
+        parser.error("give --files (and --port to serve them), or --port to analyse a stream")
+
+    if args.command == "replay":
+        if args.port is None:
+            parser.error("replay needs --port")
+        serve(source, args.port)
+    else:
+        with open(args.reference) as f:
+            reference_parameters = json.load(f)
+        analysis = StreamingAnalysis(
+            reference_parameters, duration=args.duration, sampling_frequency=args.sampling_frequency,
+            minimum_frequency=args.minimum_frequency, grid_points=args.grid_points,
+            outdir=args.outdir, label=args.label)
+        analysis.run(source, args.trigger_time)
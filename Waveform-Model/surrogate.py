@@ -0,0 +1,654 @@
+"""
+Reduced-basis surrogate of the base (xi_tilde = 0) NRTidal waveform over a box
+of chirp mass, mass ratio, aligned spins and kappa2T, the tidal parameter of NRTidal.
+
+For aligned spins the polarizations of lal_binary_neutron_star are
+
+    h_plus  = h_0(f) (1 + cos^2 theta_jn)/2 exp(2i phase) / d_L
+    h_cross = -i cos theta_jn h_0(f) exp(2i phase) / d_L
+
+with h_0 the plus polarization at theta_jn = phase = 0, d_L = 1 Mpc.
+
+NRTidal depends on the tidal deformabilities only through kappa2T = 3/13
+[(1 + 12 m_2/m_1) (m_1/M)^5 Lambda_1 + (1 + 12 m_1/m_2) (m_2/M)^5 Lambda_2] =
+3/16 lambda_tilde (LAL's XLALSimNRTunedTidesComputeKappa2T); IMRPhenomPv2_NRTidal
+also through the spin-induced quadrupoles Q(Lambda_i). At
+a point of the box, h_0 is that of the binary Love pair (binary_love_residual =
+0) with its kappa2T: the pairs that the binary Love runners draw at the same
+kappa2T have the same h_0 to a mismatch ~1e-5 (~2e-4 for equal Lambdas).
+
+The surrogate models h_0 by
+
+    amplitude   A(f)/A_N(f),  A_N = Mc^(5/6) f^(-7/6) the Newtonian amplitude
+    phase       arg h_0(f) + Psi(f), the TaylorF2 phase to 2PN (spin-orbit at 1.5PN) and leading tidal order
+
+on NODES sparse frequency nodes (uniform in 1/f, where the phase varies fastest,
+and uniform in f, where the merger and the tidal taper are). Both are smooth over
+the box: an SVD of the training set gives a reduced basis of each, truncated at
+the tolerances, and the coefficients are fitted over the (unit-scaled) box by
+least squares, with products of Legendre polynomials of total degree DEGREE. The phase is modelled relative to its value at the
+reference frequency: the phase alignment of IMRPhenomPv2 wraps around many times
+over the box, and a constant phase of h_0 is the same as a change of the phase
+parameter, which our runners marginalize over (the surrogate is LAL up to a
+constant phase, and the phase posterior of a run that samples it is shifted). An evaluation is a few small matrix products and a
+cubic spline from the nodes to the frequency array, for a whole batch of samples.
+
+The training and validation waveforms are computed with LAL on a pool. The
+validation reports the mismatch 1 - |<h, h_s>|/|h||h_s| (maximized over the
+constant phase only, not over time) with the aLIGO design PSD at independent
+random points of the box, with the binary Love pairs of the runners (lambda_s
+uniform in VALIDATION_LAMBDA_S, binary_love_residual unit normal), and the
+largest phase error against LAL (after the same constant phase) where the
+signal has power. A surrogate passes its
+validation if both are within MISMATCH_TOLERANCE and PHASE_ERROR_TOLERANCE.
+
+    python surrogate.py build -o GW170817_surrogate.npz --approximant IMRPhenomPv2_NRTidal -n 8
+    python surrogate.py validate GW170817_surrogate.npz --points 1000 -n 8
+
+source_binary_love is a drop-in for nrtidal_d.source_binary_love (waveform
+argument surrogate_file) that applies the dissipative phase on top, selected in
+the binary Love runners by --surrogate_file. The surrogate has aligned spins
+only: check() rejects a run with precessing spin priors (e.g. the IMRPhenomPv2
+GW170817 script), with another approximant, or with a surrogate that did not
+pass its validation, and warns if the priors extend beyond the box. A sample with
+an in-plane spin above max_in_plane_spin (waveform argument, default
+MAX_IN_PLANE_SPIN), or outside the box, is computed with LAL.
+"""
+import argparse
+import functools
+import itertools
+import json
+import multiprocessing
+import os
+import time
+
+import bilby
+import numpy as np
+from numpy.polynomial import legendre
+from scipy.interpolate import CubicSpline
+from scipy.optimize import brentq
+from scipy.stats import qmc
+
+import nrtidal_d
+import profiling
+
+logger = bilby.core.utils.logger
+
+# Parameters of the surrogate, in the order of its box.
+PARAMETERS = ["chirp_mass", "mass_ratio", "chi_1", "chi_2", "kappa2T"]
+
+# Prior box of the GW170817 and injection analyses (detector-frame chirp mass).
+GW170817_BOX = dict(
+    chirp_mass=(1.184, 1.25), mass_ratio=(0.5, 1.), chi_1=(-0.05, 0.05), chi_2=(-0.05, 0.05),
+    kappa2T=(0., 562.5))
+
+# Parameters fitted in their square root (the phase varies fastest at small kappa2T).
+SQRT_PARAMETERS = ["kappa2T"]
+
+# Padding of the training box, as a fraction of its width: the fits are least
+# accurate at the edges. Below 0 the square root coordinates continue the
+# waveform evenly.
+PADDING = 0.05
+
+# Frequency nodes uniform in 1/f and uniform in f.
+NODES = (400, 200)
+
+# Duration (s) of the frequency array of the training waveforms. The waveforms are
+# analytic in f, so that the frequency bins only have to resolve the phase.
+TRAINING_DURATION = 4
+
+# Largest reconstruction error of the training set kept by the truncation of the
+# bases: relative amplitude, and phase (rad).
+AMPLITUDE_TOLERANCE = 1e-4
+PHASE_TOLERANCE = 1e-3
+
+# Largest mismatch and phase error (rad) against LAL of a validated surrogate. A
+# mismatch M costs ~ SNR^2 M in ln L: 0.1 at SNR 30.
+MISMATCH_TOLERANCE = 1e-4
+PHASE_ERROR_TOLERANCE = 0.1
+
+# Frequencies at which the phase error is measured: those where |h|^2/S is above
+# this fraction of its maximum.
+PHASE_ERROR_POWER = 1e-3
+
+# Total degree of the polynomial fits of the coefficients.
+DEGREE = 10
+
+# In-plane spin (a sin tilt) above which source_binary_love computes the waveform with LAL (aligned spins, to rounding).
+MAX_IN_PLANE_SPIN = 1e-6
+
+# Validation waveforms held in memory at once.
+VALIDATION_CHUNK = 100
+
+# Range of lambda_s of the validation (that of the binary Love runners' prior).
+VALIDATION_LAMBDA_S = (0., 3000.)
+
+# lambda_s below which the fits of the binary Love relations are not monotonic in
+# lambda_s: smaller kappa2T are those of the pair at this lambda_s, scaled.
+BINARY_LOVE_MINIMUM_LAMBDA_S = 20.
+
+_frequency_array = None
+_waveform_arguments = None
+_surrogates = {}
+
+def _initialize(frequency_array, waveform_arguments):
+    global _frequency_array, _waveform_arguments
+    _frequency_array = frequency_array
+    _waveform_arguments = waveform_arguments
+
+def _map(function, tasks, npool, frequency_array, waveform_arguments):
+    if npool > 1:
+        with multiprocessing.Pool(npool, initializer=_initialize, initargs=(frequency_array, waveform_arguments)) as pool:
+            return pool.map(function, tasks, chunksize=max(len(tasks) // (4 * npool), 1))
+    _initialize(frequency_array, waveform_arguments)
+    return [function(task) for task in tasks]
+
+def component_masses(chirp_mass, mass_ratio):
+    total_mass = bilby.gw.conversion.chirp_mass_and_mass_ratio_to_total_mass(chirp_mass, mass_ratio)
+    mass_1 = total_mass / (1 + mass_ratio)
+    return mass_1, mass_1 * mass_ratio
+
+def kappa2T(mass_1, mass_2, lambda_1, lambda_2):
+    """
+    kappa2T of NRTidal (as XLALSimNRTunedTidesComputeKappa2T), 3/16 lambda_tilde.
+    """
+    x_1, x_2 = mass_1 / (mass_1 + mass_2), mass_2 / (mass_1 + mass_2)
+    return 3. / 13. * ((1 + 12 * x_2 / x_1) * x_1 ** 5 * lambda_1 + (1 + 12 * x_1 / x_2) * x_2 ** 5 * lambda_2)
+
+def binary_love_pair(mass_1, mass_2, kappa):
+    """
+    lambda_1, lambda_2 of the binary Love relations (binary_love_residual = 0) with kappa2T = kappa.
+    """
+    def difference(lambda_s):
+        return kappa2T(mass_1, mass_2, *nrtidal_d.binary_love_lambdas(mass_1, mass_2, lambda_s, 0.)) - kappa
+
+    minimum = difference(BINARY_LOVE_MINIMUM_LAMBDA_S)
+    if minimum >= 0:
+        lambda_1, lambda_2 = nrtidal_d.binary_love_lambdas(mass_1, mass_2, BINARY_LOVE_MINIMUM_LAMBDA_S, 0.)
+        scale = kappa / (minimum + kappa)
+        return lambda_1 * scale, lambda_2 * scale
+    maximum = 2 * BINARY_LOVE_MINIMUM_LAMBDA_S
+    while difference(maximum) < 0:
+        maximum *= 2
+    lambda_s = brentq(difference, BINARY_LOVE_MINIMUM_LAMBDA_S, maximum, xtol=1e-10, rtol=1e-14)
+    return nrtidal_d.binary_love_lambdas(mass_1, mass_2, lambda_s, 0.)
+
+def base_waveform(point, lambda_1=None, lambda_2=None):
+    """
+    h_0 of LAL (plus polarization, theta_jn = phase = 0, 1 Mpc) at a point of
+    the box, with the binary Love pair of its kappa2T (or lambda_1, lambda_2).
+    """
+    parameters = dict(zip(PARAMETERS, point))
+    mass_1, mass_2 = component_masses(parameters["chirp_mass"], parameters["mass_ratio"])
+    if lambda_1 is None:
+        lambda_1, lambda_2 = binary_love_pair(mass_1, mass_2, parameters["kappa2T"])
+    return bilby.gw.source.lal_binary_neutron_star(
+        _frequency_array, mass_1, mass_2, 1.,
+        abs(parameters["chi_1"]), 0. if parameters["chi_1"] >= 0 else np.pi, 0.,
+        abs(parameters["chi_2"]), 0. if parameters["chi_2"] >= 0 else np.pi, 0., 0., 0.,
+        lambda_1, lambda_2, **_waveform_arguments)["plus"]
+
+def reference_phase(frequency, chirp_mass, mass_ratio, chi_1, chi_2, kappa2T):
+    """
+    TaylorF2 phase to 2PN (spin-orbit at 1.5PN) plus the leading (5PN) tidal
+    phase, Psi with h ~ exp(-i Psi); frequency (nodes), parameters (samples).
+    """
+    chirp_mass, mass_ratio, chi_1, chi_2, kappa2T = [
+        np.atleast_1d(x)[:, None] for x in [chirp_mass, mass_ratio, chi_1, chi_2, kappa2T]]
+    eta = mass_ratio / (1 + mass_ratio) ** 2
+    x_1, x_2 = 1 / (1 + mass_ratio), mass_ratio / (1 + mass_ratio)
+    beta = ((113. * x_1 ** 2 + 75. * eta) * chi_1 + (113. * x_2 ** 2 + 75. * eta) * chi_2) / 12.
+    total_mass = chirp_mass * eta ** (-3. / 5.)
+    # powers of 1/v by products, on many frequencies
+    inverse_v = 1. / (np.cbrt(np.pi * nrtidal_d.GC * total_mass) * np.cbrt(frequency))
+    inverse_v2 = inverse_v * inverse_v
+    inverse_v3 = inverse_v2 * inverse_v
+    inverse_v5 = inverse_v3 * inverse_v2
+    return 3. / (128. * eta) * (
+        inverse_v5 + (3715. / 756. + 55. / 9. * eta) * inverse_v3 + (4. * beta - 16. * np.pi) * inverse_v2 +
+        (15293365. / 508032. + 27145. / 504. * eta + 3085. / 72. * eta ** 2) * inverse_v -
+        104. * kappa2T / inverse_v5)
+
+def newtonian_amplitude(frequency, chirp_mass):
+    return np.atleast_1d(chirp_mass)[:, None] ** (5. / 6.) * frequency ** (-7. / 6.)
+
+def frequency_nodes(minimum_frequency, maximum_frequency, frequency_array, nodes=NODES):
+    """
+    Indices of the frequency array nearest to nodes uniform in 1/f and in f.
+    """
+    targets = np.concatenate([
+        1. / np.linspace(1. / minimum_frequency, 1. / maximum_frequency, nodes[0]),
+        np.linspace(minimum_frequency, maximum_frequency, nodes[1])])
+    in_band = np.flatnonzero((frequency_array >= minimum_frequency) & (frequency_array <= maximum_frequency))
+    index = in_band[np.clip(np.searchsorted(frequency_array[in_band], targets), 0, len(in_band) - 1)]
+    return np.unique(index)
+
+def _training_data(point, index):
+    """
+    Amplitude and phase residuals at the nodes `index` of the frequency array, at a point of the box.
+    """
+    h = base_waveform(point)
+    frequency = _frequency_array[index[0]:index[-1] + 1]
+    h = h[index[0]:index[-1] + 1]
+    amplitude = np.abs(h) / newtonian_amplitude(frequency, point[0])[0]
+    phase = np.angle(h * np.exp(1j * reference_phase(frequency, *point)[0]))
+    # beyond the taper the phase is undefined: hold the last value
+    valid = np.flatnonzero(np.abs(h) > 0)
+    phase[valid[-1] + 1:] = phase[valid[-1]]
+    phase = np.unwrap(phase)
+    nodes = index - index[0]
+    return amplitude[nodes], phase[nodes]
+
+def _training_task(args):
+    point, index = args
+    return _training_data(point, index)
+
+def _lal_task(args):
+    point, lambda_1, lambda_2 = args
+    return base_waveform(point, lambda_1, lambda_2)
+
+def reduced_basis(data, tolerance):
+    """
+    Orthonormal basis (rows) of the SVD of the training data (points x nodes), with
+    the fewest vectors that reconstruct every training point to within tolerance.
+    """
+    _, singular_values, basis = np.linalg.svd(data, full_matrices=False)
+    for size in range(1, len(singular_values) + 1):
+        error = np.max(np.abs(data - data @ basis[:size].T @ basis[:size]))
+        if error < tolerance:
+            break
+    logger.info("Reduced basis of {} vectors, training reconstruction error {:.2g}".format(size, error))
+    return basis[:size]
+
+def _coordinate(key, x):
+    with np.errstate(invalid="ignore"):
+        return np.sqrt(x) if key in SQRT_PARAMETERS else np.asarray(x, dtype=float)
+
+def to_unit(box, points):
+    """
+    Points of the box (samples x PARAMETERS) in the unit box of the coordinates of the fits.
+    """
+    points = np.atleast_2d(points)
+    return np.column_stack([
+        (_coordinate(key, points[:, i]) - _coordinate(key, box[key][0])) /
+        (_coordinate(key, box[key][1]) - _coordinate(key, box[key][0])) for i, key in enumerate(PARAMETERS)])
+
+def from_unit(box, unit):
+    unit = np.atleast_2d(unit)
+    points = []
+    for i, key in enumerate(PARAMETERS):
+        lower, upper = _coordinate(key, box[key][0]), _coordinate(key, box[key][1])
+        x = lower + (upper - lower) * unit[:, i]
+        points.append(x ** 2 if key in SQRT_PARAMETERS else x)
+    return np.column_stack(points)
+
+def training_points(box, points, seed=None):
+    """
+    Scrambled Sobol points of the unit box (at least `points`, a power of 2), plus its corners.
+    """
+    sobol = qmc.Sobol(len(box), seed=seed).random_base2(int(np.ceil(np.log2(points))))
+    corners = np.array(np.meshgrid(*[[0., 1.]] * len(box), indexing="ij")).reshape(len(box), -1).T
+    return np.concatenate([corners, sobol])
+
+@functools.lru_cache()
+def polynomial_terms(dimension, degree):
+    """
+    Exponents (terms x dimension) of the products of Legendre polynomials of total degree <= degree.
+    """
+    return np.array([term for term in itertools.product(range(degree + 1), repeat=dimension) if sum(term) <= degree])
+
+def polynomial_design(unit, degree):
+    """
+    The products of Legendre polynomials of the unit box (samples x terms).
+    """
+    terms = polynomial_terms(unit.shape[1], degree)
+    design = np.ones((len(unit), len(terms)))
+    for i in range(unit.shape[1]):
+        design *= legendre.legvander(2 * unit[:, i] - 1, degree)[:, terms[:, i]]
+    return design
+
+class Surrogate(object):
+    """
+    Reduced-basis surrogate of h_0 over box (dict of parameter: (minimum, maximum)):
+    the coefficients of the amplitude and phase bases are polynomials (fits, terms x
+    basis vectors) of the unit box.
+    """
+    def __init__(self, box, frequency_nodes, amplitude_basis, phase_basis, degree,
+                 amplitude_fit, phase_fit, waveform_arguments, validation=None):
+        self.box = {key: tuple(float(x) for x in box[key]) for key in PARAMETERS}
+        self.frequency_nodes = np.asarray(frequency_nodes, dtype=float)
+        self.amplitude_basis = np.asarray(amplitude_basis, dtype=float)
+        self.phase_basis = np.asarray(phase_basis, dtype=float)
+        self.degree = int(degree)
+        self.amplitude_fit = np.asarray(amplitude_fit, dtype=float)
+        self.phase_fit = np.asarray(phase_fit, dtype=float)
+        self.waveform_arguments = dict(waveform_arguments)
+        self.validation = validation
+
+    @classmethod
+    def build(cls, box=GW170817_BOX, sampling_frequency=4096, waveform_arguments=None,
+              points=16384, degree=DEGREE, nodes=NODES, npool=1, seed=None):
+        """
+        Train a surrogate on LAL waveforms at `points` Sobol points of the (padded)
+        box and its corners, up to the Nyquist frequency of sampling_frequency.
+        """
+        waveform_arguments = dict(dict(waveform_approximant="IMRPhenomPv2_NRTidal", reference_frequency=20.,
+                                       minimum_frequency=20.), **(waveform_arguments or {}))
+        waveform_arguments.setdefault("maximum_frequency", sampling_frequency / 2.)
+        frequency_array = bilby.core.utils.create_frequency_series(sampling_frequency, TRAINING_DURATION)
+        index = frequency_nodes(waveform_arguments["minimum_frequency"], waveform_arguments["maximum_frequency"],
+                                frequency_array, nodes)
+        # LAL orders the masses: the waveform is not smooth across mass_ratio = 1
+        upper = np.array([0. if key == "mass_ratio" and box[key][1] >= 1 else PADDING for key in PARAMETERS])
+        unit = -PADDING + (1 + PADDING + upper) * training_points(box, points, seed)
+
+        start = time.perf_counter()
+        data = _map(_training_task, [(point, index) for point in from_unit(box, unit)],
+                    npool, frequency_array, waveform_arguments)
+        logger.info("{} training waveforms in {:.0f}s".format(len(unit), time.perf_counter() - start))
+        amplitude = np.array([d[0] for d in data])
+        phase = np.array([d[1] for d in data])
+        reference = np.argmin(np.abs(frequency_array[index] - waveform_arguments["reference_frequency"]))
+        phase -= phase[:, reference:reference + 1]
+
+        amplitude_basis = reduced_basis(amplitude, AMPLITUDE_TOLERANCE * np.max(amplitude))
+        phase_basis = reduced_basis(phase, PHASE_TOLERANCE)
+        design = polynomial_design(unit, degree)
+        amplitude_fit = np.linalg.lstsq(design, amplitude @ amplitude_basis.T, rcond=None)[0]
+        phase_fit = np.linalg.lstsq(design, phase @ phase_basis.T, rcond=None)[0]
+        inside = np.all((unit >= 0) & (unit <= 1), axis=1)
+        # at all the nodes, past the merger too: the phase error that counts is that of validate
+        logger.info("Fits of {} terms, largest phase error of the training set in the box {:.2g} rad".format(
+            design.shape[1], np.max(np.abs(design[inside] @ phase_fit @ phase_basis - phase[inside]))))
+        return cls(box, frequency_array[index], amplitude_basis, phase_basis, degree,
+                   amplitude_fit, phase_fit, waveform_arguments)
+
+    def save(self, filename):
+        np.savez_compressed(
+            filename, parameters=PARAMETERS, box=np.array([self.box[key] for key in PARAMETERS]),
+            frequency_nodes=self.frequency_nodes, amplitude_basis=self.amplitude_basis,
+            phase_basis=self.phase_basis, degree=self.degree,
+            amplitude_fit=self.amplitude_fit, phase_fit=self.phase_fit,
+            waveform_arguments=json.dumps(self.waveform_arguments), validation=json.dumps(self.validation))
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as f:
+            if list(f["parameters"]) != PARAMETERS:
+                raise ValueError("The surrogate {} is of {}, not {}: build it again".format(
+                    filename, ", ".join(f["parameters"]), ", ".join(PARAMETERS)))
+            return cls(
+                dict(zip(f["parameters"], f["box"])), f["frequency_nodes"], f["amplitude_basis"], f["phase_basis"],
+                f["degree"], f["amplitude_fit"], f["phase_fit"],
+                json.loads(str(f["waveform_arguments"])), json.loads(str(f["validation"])))
+
+    def unit(self, **parameters):
+        """
+        Points of the unit box (samples x PARAMETERS) of arrays of the PARAMETERS.
+        """
+        return to_unit(self.box, np.column_stack([np.atleast_1d(parameters[key]) for key in PARAMETERS]))
+
+    def in_box(self, **parameters):
+        unit = self.unit(**parameters)
+        return np.all((unit >= 0) & (unit <= 1), axis=1)
+
+    def evaluate(self, frequency_array, phase_shift=0., **parameters):
+        """
+        h_0 exp(i phase_shift) on frequency_array for arrays of the PARAMETERS:
+        (samples x frequencies), zero outside the frequency nodes. phase_shift:
+        a scalar or an array on frequency_array.
+        """
+        design = polynomial_design(self.unit(**parameters), self.degree)
+        amplitude = design @ self.amplitude_fit @ self.amplitude_basis
+        phase = design @ self.phase_fit @ self.phase_basis
+
+        frequency_array = np.asarray(frequency_array, dtype=float)
+        h = np.zeros((len(design), len(frequency_array)), dtype=complex)
+        band = (frequency_array >= self.frequency_nodes[0]) & (frequency_array <= self.frequency_nodes[-1])
+        frequency = frequency_array[band]
+        if np.ndim(phase_shift) > 0:
+            phase_shift = phase_shift[..., band]
+        amplitude = CubicSpline(self.frequency_nodes, amplitude, axis=1)(frequency)
+        phase = CubicSpline(self.frequency_nodes, phase, axis=1)(frequency)
+        h[:, band] = (np.maximum(amplitude, 0.) * newtonian_amplitude(frequency, parameters["chirp_mass"]) *
+                      np.exp(1j * (phase + phase_shift - reference_phase(frequency, *[parameters[key] for key in PARAMETERS]))))
+        return h
+
+    def validation_points(self, points, seed=None):
+        """
+        Random points of the box (points x PARAMETERS) and their lambda_1,
+        lambda_2 (points x 2): the masses and spins uniform in the box, and the
+        binary Love pairs of lambda_s uniform in VALIDATION_LAMBDA_S and a unit
+        normal binary_love_residual, with kappa2T in the box.
+        """
+        rng = np.random.default_rng(seed)
+        lower = np.array([self.box[key][0] for key in PARAMETERS[:-1]])
+        width = np.array([self.box[key][1] - self.box[key][0] for key in PARAMETERS[:-1]])
+        draws, lambdas = [], []
+        while len(draws) < points:
+            point = lower + width * rng.uniform(size=len(lower))
+            mass_1, mass_2 = component_masses(point[0], point[1])
+            pair = nrtidal_d.binary_love_lambdas(
+                mass_1, mass_2, rng.uniform(*VALIDATION_LAMBDA_S), rng.standard_normal())
+            kappa = kappa2T(mass_1, mass_2, *pair)
+            if self.box["kappa2T"][0] <= kappa <= self.box["kappa2T"][1]:
+                draws.append(np.append(point, kappa))
+                lambdas.append(pair)
+        return np.array(draws), np.array(lambdas, dtype=float)
+
+    def validate(self, points=1000, duration=128, sampling_frequency=4096, psd=None, npool=1, seed=None):
+        """
+        Mismatches and phase errors with LAL at random points of the box (with
+        binary Love pairs, see validation_points), and whether they are within
+        MISMATCH_TOLERANCE and PHASE_ERROR_TOLERANCE; stored in self.validation.
+        psd: PowerSpectralDensity (default the aLIGO design).
+        """
+        psd = psd or bilby.gw.detector.PowerSpectralDensity.from_aligo()
+        frequency_array = bilby.core.utils.create_frequency_series(sampling_frequency, duration)
+        draws, lambdas = self.validation_points(points, seed)
+
+        band = (frequency_array >= self.frequency_nodes[0]) & (frequency_array <= self.frequency_nodes[-1])
+        weight = 1. / psd.power_spectral_density_interpolated(frequency_array[band])
+        weight[~np.isfinite(weight)] = 0.
+
+        mismatch, phase_error, lal_time, surrogate_time = [], [], 0., 0.
+        for chunk, chunk_lambdas in zip(*[np.array_split(x, max(points // VALIDATION_CHUNK, 1)) for x in [draws, lambdas]]):
+            start = time.perf_counter()
+            lal = np.array(_map(_lal_task, [(point, *pair) for point, pair in zip(chunk, chunk_lambdas)],
+                                npool, frequency_array, self.waveform_arguments))[:, band]
+            lal_time += time.perf_counter() - start
+            start = time.perf_counter()
+            h = self.evaluate(frequency_array, **dict(zip(PARAMETERS, chunk.T)))[:, band]
+            surrogate_time += time.perf_counter() - start
+            overlap = np.sum(np.conj(lal) * h * weight, axis=1)
+            power = np.abs(lal) ** 2 * weight
+            mismatch.append(1. - np.abs(overlap) / np.sqrt(
+                np.sum(power, axis=1) * np.sum(np.abs(h) ** 2 * weight, axis=1)))
+            # the phase of h relative to LAL, after the constant phase of the overlap
+            error = np.abs(np.angle(h * np.conj(lal) * np.exp(-1j * np.angle(overlap))[:, None]))
+            phase_error.append(np.max(np.where(
+                power >= PHASE_ERROR_POWER * np.max(power, axis=1, keepdims=True), error, 0.), axis=1))
+        mismatch = np.concatenate(mismatch)
+        phase_error = np.concatenate(phase_error)
+        worst = int(np.argmax(mismatch))
+        self.validation = dict(
+            points=points, duration=duration, sampling_frequency=sampling_frequency,
+            maximum_mismatch=float(np.max(mismatch)), mismatch_99=float(np.percentile(mismatch, 99)),
+            median_mismatch=float(np.median(mismatch)),
+            worst_point=dict(zip(PARAMETERS + ["lambda_1", "lambda_2"], draws[worst].tolist() + lambdas[worst].tolist())),
+            maximum_phase_error=float(np.max(phase_error)), phase_error_99=float(np.percentile(phase_error, 99)),
+            mismatch_tolerance=MISMATCH_TOLERANCE, phase_error_tolerance=PHASE_ERROR_TOLERANCE,
+            passed=bool(np.max(mismatch) <= MISMATCH_TOLERANCE and np.max(phase_error) <= PHASE_ERROR_TOLERANCE),
+            lal_seconds_per_waveform=lal_time * max(npool, 1) / points, surrogate_seconds_per_waveform=surrogate_time / points)
+        logger.info("Validated mismatch bound {:.2e} (99th percentile {:.2e}, median {:.2e}) at {} points".format(
+            self.validation["maximum_mismatch"], self.validation["mismatch_99"], self.validation["median_mismatch"], points))
+        logger.info("Largest phase error {:.2g} rad (99th percentile {:.2g} rad)".format(
+            self.validation["maximum_phase_error"], self.validation["phase_error_99"]))
+        if not self.validation["passed"]:
+            logger.warning("The surrogate fails its validation (tolerances: mismatch {}, phase error {} rad)".format(
+                MISMATCH_TOLERANCE, PHASE_ERROR_TOLERANCE))
+        logger.info("{:.2g}s per LAL waveform, {:.2g}s per surrogate waveform".format(
+            self.validation["lal_seconds_per_waveform"], self.validation["surrogate_seconds_per_waveform"]))
+        return self.validation
+
+def load(filename):
+    """
+    Surrogate of a file (cached).
+    """
+    filename = os.path.abspath(filename)
+    if filename not in _surrogates:
+        _surrogates[filename] = Surrogate.load(filename)
+    return _surrogates[filename]
+
+def _precessing(prior):
+    """
+    Whether a tilt prior allows in-plane spins.
+    """
+    if isinstance(prior, bilby.core.prior.Prior):
+        if not prior.is_fixed:
+            return True
+        prior = prior.peak
+    return not (np.isclose(prior, 0.) or np.isclose(prior, np.pi))
+
+def check(filename, priors, waveform_arguments):
+    """
+    Check that the surrogate in filename can be used for a run with priors and
+    waveform_arguments: raises ValueError for precessing spin priors, another
+    approximant or a surrogate that did not pass its validation; warns if the
+    priors extend beyond the box (those samples are computed with LAL).
+    """
+    surrogate = load(filename)
+    precessing = [key for key in ["tilt_1", "tilt_2"] if key in priors and _precessing(priors[key])]
+    if len(precessing) > 0:
+        raise ValueError("The surrogate {} has aligned spins only, but the priors on {} are precessing".format(
+            filename, ", ".join(precessing)))
+    approximant = surrogate.waveform_arguments["waveform_approximant"]
+    if approximant != waveform_arguments.get("waveform_approximant"):
+        raise ValueError("The surrogate {} is of {}, not {}".format(
+            filename, approximant, waveform_arguments.get("waveform_approximant")))
+    validation = surrogate.validation or {}
+    if not validation.get("passed", False):
+        raise ValueError("The surrogate {} has not passed its validation (mismatch {}, phase error {} rad, "
+                         "tolerances {} and {} rad): see surrogate.py validate".format(
+                             filename, validation.get("maximum_mismatch"), validation.get("maximum_phase_error"),
+                             MISMATCH_TOLERANCE, PHASE_ERROR_TOLERANCE))
+
+    for key in ["chirp_mass", "mass_ratio", "chi_1", "chi_2"]:
+        prior = priors.get(key)
+        if not isinstance(prior, bilby.core.prior.Prior) or prior.is_fixed:
+            continue
+        if prior.minimum < surrogate.box[key][0] or prior.maximum > surrogate.box[key][1]:
+            logger.warning("The prior on {} [{:.4g}, {:.4g}] extends beyond the surrogate box [{:.4g}, {:.4g}]: "
+                           "samples outside are computed with LAL".format(
+                               key, prior.minimum, prior.maximum, *surrogate.box[key]))
+    return surrogate
+
+def source_binary_love(
+        frequency_array,
+        mass_1, mass_2,
+        luminosity_distance,
+        a_1, tilt_1, phi_12, a_2, tilt_2, phi_jl, theta_jn, phase,
+        lambda_s, xi_tilde, binary_love_residual,
+        **kwargs):
+    """
+    nrtidal_d.source_binary_love with the base waveform of the surrogate in
+    kwargs['surrogate_file'] (LAL if the sample is not in the surrogate's box or
+    has an in-plane spin above kwargs['max_in_plane_spin']).
+    """
+    kwargs = dict(kwargs)
+    surrogate = load(kwargs.pop("surrogate_file"))
+    max_in_plane_spin = kwargs.pop("max_in_plane_spin", MAX_IN_PLANE_SPIN)
+
+    with profiling.timer("binary_love"):
+        lambda_1, lambda_2 = nrtidal_d.binary_love_lambdas(mass_1, mass_2, lambda_s, binary_love_residual)
+
+    parameters = dict(
+        chirp_mass=bilby.gw.conversion.component_masses_to_chirp_mass(mass_1, mass_2),
+        mass_ratio=mass_2 / mass_1, chi_1=a_1 * np.cos(tilt_1), chi_2=a_2 * np.cos(tilt_2),
+        kappa2T=kappa2T(mass_1, mass_2, lambda_1, lambda_2))
+    in_plane_spin = max(abs(a_1 * np.sin(tilt_1)), abs(a_2 * np.sin(tilt_2)))
+    if in_plane_spin > max_in_plane_spin or not surrogate.in_box(**parameters)[0]:
+        return nrtidal_d.source_binary_love(
+            frequency_array, mass_1, mass_2, luminosity_distance,
+            a_1, tilt_1, phi_12, a_2, tilt_2, phi_jl, theta_jn, phase,
+            lambda_s, xi_tilde, binary_love_residual, **kwargs)
+
+    with profiling.timer("dissipative_phase"):
+        phi = nrtidal_d._dissipative_tidal_phase_xi_tilde(frequency_array, mass_1, mass_2, xi_tilde)
+
+    with profiling.timer("surrogate"):
+        h = surrogate.evaluate(frequency_array, 2 * phase - phi, **parameters)[0] / luminosity_distance
+        minimum_frequency = kwargs.get("minimum_frequency", surrogate.frequency_nodes[0])
+        maximum_frequency = kwargs.get("maximum_frequency", surrogate.frequency_nodes[-1])
+        h[(frequency_array < minimum_frequency) | (frequency_array > maximum_frequency)] = 0.
+
+    cos_theta_jn = np.cos(theta_jn)
+    return dict(plus=h * (1 + cos_theta_jn ** 2) / 2, cross=-1j * cos_theta_jn * h)
+
+#-------------------------------------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reduced-basis surrogate of the base NRTidal waveform")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser("build", help="train and validate a surrogate")
+
+    build.add_argument("-o", "--output", type=str, required=True, help="surrogate file (.npz)")
+
+    build.add_argument("--approximant", type=str, default="IMRPhenomPv2_NRTidal")
+
+    build.add_argument("--reference_frequency", type=float, default=20.)
+
+    build.add_argument("--minimum_frequency", type=float, default=20.)
+
+    build.add_argument("--sampling_frequency", type=float, default=4096)
+
+    build.add_argument("--box", type=str, nargs=3, action="append", default=[], metavar=("PARAMETER", "MIN", "MAX"),
+                       help="change the box of a parameter (default the GW170817 prior box)")
+
+    build.add_argument("--training_points", type=int, default=16384)
+
+    build.add_argument("--degree", type=int, default=DEGREE, help="of the polynomial fits")
+
+    build.add_argument("--validation_points", type=int, default=1000)
+
+    build.add_argument("--duration", type=float, default=128, help="of the validation frequency array")
+
+    build.add_argument("-n", "--npool", type=int, default=1)
+
+    build.add_argument("--seed", type=int, default=None)
+
+    validate = subparsers.add_parser("validate", help="validate a surrogate again")
+
+    validate.add_argument("surrogate", type=str)
+
+    validate.add_argument("--points", type=int, default=1000)
+
+    validate.add_argument("--duration", type=float, default=None, help="default that of the last validation")
+
+    validate.add_argument("--sampling_frequency", type=float, default=None)
+
+    validate.add_argument("-n", "--npool", type=int, default=1)
+
+    validate.add_argument("--seed", type=int, default=None)
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        box = dict(GW170817_BOX)
+        for key, minimum, maximum in args.box:
+            box[key] = (float(minimum), float(maximum))
+        surrogate = Surrogate.build(
+            box, args.sampling_frequency,
+            dict(waveform_approximant=args.approximant, reference_frequency=args.reference_frequency,
+                 minimum_frequency=args.minimum_frequency),
+            points=args.training_points, degree=args.degree, npool=args.npool, seed=args.seed)
+        surrogate.validate(args.validation_points, args.duration, args.sampling_frequency, npool=args.npool, seed=args.seed)
+        surrogate.save(args.output)
+    else:
+        surrogate = Surrogate.load(args.surrogate)
+        last = surrogate.validation or {}
+        surrogate.validate(args.points, args.duration or last.get("duration", 128),
+                           args.sampling_frequency or last.get("sampling_frequency", 4096),
+                           npool=args.npool, seed=args.seed)
+        surrogate.save(args.surrogate)
+    logger.info("Surrogate {}: {}".format(args.output if args.command == "build" else args.surrogate, surrogate.validation))
@@ -0,0 +1,455 @@
+"""
+Inspiral-only NRTidal-D model: TaylorF2 in pure NumPy, evaluated for a batch of
+samples at once (samples x frequencies).
+
+For inspiral-dominated analyses (e.g. Cosmic Explorer with the low-frequency
+tuned cosmic_explorer_40km_lf_strain.txt) the merger of IMRPhenomPv2_NRTidal is
+not needed, and calling LAL once per sample prevents vectorization. Here
+
+    h_plus  = A(f) (1 + cos^2 theta_jn)/2 exp(-i (Psi(f) + phi_xi(f)) + 2i phase)
+    h_cross = -i cos theta_jn A(f) exp(-i (Psi(f) + phi_xi(f)) + 2i phase)
+
+    A   = sqrt(5/24) pi^(-2/3) c/d_L (G Mc/c^3)^(5/6) f^(-7/6)     (Newtonian amplitude)
+    Psi = 3/(128 eta v^5) sum_k phi_k v^k,     v = (pi G M f/c^3)^(1/3)
+
+with the point-particle TaylorF2 phase to 3.5PN (aligned spin-orbit terms to
+3.5PN, spin-spin at 2PN and 3PN with the spin-induced quadrupole of each star
+from its tidal deformability), the adiabatic tidal
+phase of each star at 5PN and 6PN, and the dissipative tidal phase phi_xi of
+nrtidal_d._dissipative_tidal_phase_xi_tilde. In-plane spins are ignored (a cos
+tilt are the aligned spins). The waveform is zero below minimum_frequency and
+above the cutoff frequency (waveform argument cutoff_frequency, default the ISCO
+frequency of the total mass, where TaylorF2 stops being valid).
+
+TaylorF2 and IMRPhenom differ by the convention of the coalescence time and
+phase, a constant time and phase that the runners marginalize over. The
+validation reports the mismatch with the LAL-based nrtidal_d.source below a
+cutoff frequency, maximized over time and phase, with a PSD:
+
+    python taylorf2.py validate --asd ../ASD-Files/cosmic_explorer_40km_lf_strain.txt --cutoff_frequency 400 -n 8
+
+(with --approximant TaylorF2 it is a check of this implementation against LAL's).
+source and source_binary_love are drop-ins for those of nrtidal_d.py;
+log_likelihood_ratio gives the likelihood of a whole batch of samples, for
+Fisher checks and reweighting.
+"""
+import argparse
+import json
+import multiprocessing
+import time
+
+from astropy.constants import c, pc
+import bilby
+import numpy as np
+from scipy.optimize import minimize_scalar
+from scipy.special import i0e
+
+import nrtidal_d
+import profiling
+
+logger = bilby.core.utils.logger
+
+# Largest block (samples x frequencies) of waveforms held in memory by log_likelihood_ratio.
+MAX_BLOCK_SIZE = 2 ** 20
+
+# Box of the validation draws: masses (detector frame), aligned spins, tidal
+# deformabilities and xi_tilde of the GW170817 and injection analyses.
+VALIDATION_BOX = dict(
+    chirp_mass=(1.184, 1.25), mass_ratio=(0.5, 1.), chi_1=(-0.05, 0.05), chi_2=(-0.05, 0.05),
+    lambda_1=(0., 3000.), lambda_2=(0., 3000.), xi_tilde=(0., 1000.))
+
+# Zero padding of the inverse FFT of the time maximization of the matches.
+MATCH_PADDING = 4
+
+_frequency_array = None
+_waveform_arguments = None
+
+def _initialize(frequency_array, waveform_arguments):
+    global _frequency_array, _waveform_arguments
+    _frequency_array = frequency_array
+    _waveform_arguments = waveform_arguments
+
+def _map(function, tasks, npool, frequency_array, waveform_arguments):
+    if npool > 1:
+        with multiprocessing.Pool(npool, initializer=_initialize, initargs=(frequency_array, waveform_arguments)) as pool:
+            return pool.map(function, tasks, chunksize=max(len(tasks) // (4 * npool), 1))
+    _initialize(frequency_array, waveform_arguments)
+    return [function(task) for task in tasks]
+
+def _column(x):
+    return np.atleast_1d(np.asarray(x, dtype=float))[:, None]
+
+def isco_frequency(mass_1, mass_2):
+    """
+    Gravitational-wave frequency of the innermost stable circular orbit of the total mass.
+    """
+    return 1. / (6. ** 1.5 * np.pi * nrtidal_d.GC * (np.asarray(mass_1) + np.asarray(mass_2)))
+
+def quadrupole_monopole(lambda_):
+    """
+    Spin-induced quadrupole parameter of a star from its tidal deformability
+    (universal relation of Yagi and Yunes, as in LAL; 1, a black hole, at lambda = 0).
+    """
+    lambda_ = np.asarray(lambda_, dtype=float)
+    log_lambda = np.log(np.where(lambda_ > 0., lambda_, 1.))
+    log_kappa = 0.1940 + 0.09163 * log_lambda + 0.04812 * log_lambda ** 2 - 4.283e-3 * log_lambda ** 3 + 1.245e-4 * log_lambda ** 4
+    return np.where(lambda_ > 0., np.exp(log_kappa), 1.)
+
+def pn_phase(frequency, mass_1, mass_2, chi_1, chi_2, lambda_1, lambda_2, xi_tilde=0.):
+    """
+    TaylorF2 phase Psi (h ~ exp(-i Psi)) with the adiabatic tidal terms and the
+    dissipative tidal phase of nrtidal_d._dissipative_tidal_phase_xi_tilde, on
+    frequency (> 0) for arrays of samples: samples x frequencies.
+    """
+    mass_1, mass_2, chi_1, chi_2, lambda_1, lambda_2, xi_tilde = [
+        _column(x) for x in [mass_1, mass_2, chi_1, chi_2, lambda_1, lambda_2, xi_tilde]]
+    total_mass = mass_1 + mass_2
+    x_1, x_2 = mass_1 / total_mass, mass_2 / total_mass
+    eta = x_1 * x_2
+    delta = x_1 - x_2
+    chi_s, chi_a = (chi_1 + chi_2) / 2, (chi_1 - chi_2) / 2
+
+    phi_2 = 3715. / 756. + 55. / 9. * eta
+    phi_3 = -16. * np.pi + 113. / 3. * delta * chi_a + (113. / 3. - 76. / 3. * eta) * chi_s
+    kappa_1, kappa_2 = quadrupole_monopole(lambda_1), quadrupole_monopole(lambda_2)
+    phi_4 = (15293365. / 508032. + 27145. / 504. * eta + 3085. / 72. * eta ** 2 - 395. / 4. * eta * chi_1 * chi_2 -
+             sum((50. * kappa + 5. / 8.) * x ** 2 * chi ** 2 for x, chi, kappa in [(x_1, chi_1, kappa_1), (x_2, chi_2, kappa_2)]))
+    gamma = ((732985. / 2268. - 24260. / 81. * eta - 340. / 9. * eta ** 2) * chi_s +
+             (732985. / 2268. + 140. / 9. * eta) * delta * chi_a)
+    phi_5 = 38645. / 756. * np.pi - 65. / 9. * np.pi * eta - gamma
+    phi_6 = (11583231236531. / 4694215680. - 640. / 3. * np.pi ** 2 - 6848. / 21. * (np.euler_gamma + np.log(4.)) +
+             (-15737765635. / 3048192. + 2255. / 12. * np.pi ** 2) * eta + 76055. / 1728. * eta ** 2 -
+             127825. / 1296. * eta ** 3 + np.pi * ((2270. / 3. - 520. * eta) * chi_s + 2270. / 3. * delta * chi_a) +
+             (326.75 / 1.12 + 557.5 / 1.8 * eta) * eta * chi_1 * chi_2 +
+             sum(((4703.5 / 8.4 + 2935. / 6. * x - 120. * x ** 2) * kappa +
+                  (-4108.25 / 6.72 - 108.5 / 1.2 * x + 125.5 / 3.6 * x ** 2)) * x ** 2 * chi ** 2
+                 for x, chi, kappa in [(x_1, chi_1, kappa_1), (x_2, chi_2, kappa_2)]))
+    phi_7 = (np.pi * (77096675. / 254016. + 378515. / 1512. * eta - 74045. / 756. * eta ** 2) +
+             (-25150083775. / 3048192. + 10566655595. / 762048. * eta - 1042165. / 3024. * eta ** 2 +
+              5345. / 36. * eta ** 3) * chi_s +
+             (-25150083775. / 3048192. + 26804935. / 6048. * eta - 1985. / 48. * eta ** 2) * delta * chi_a)
+    phi_10 = sum((-288. + 264. * x) * x ** 4 * lambda_ for x, lambda_ in [(x_1, lambda_1), (x_2, lambda_2)])
+    phi_12 = sum((-15895. / 28. + 4595. / 28. * x + 5715. / 14. * x ** 2 - 325. / 14. * x ** 3) * x ** 4 * lambda_
+                 for x, lambda_ in [(x_1, lambda_1), (x_2, lambda_2)])
+    # the dissipative phase, -225/512 xi_tilde/eta v^3 ln v, in units of 3/(128 eta)
+    phi_xi = -75. / 4. * xi_tilde
+
+    # v = (pi G M f)^(1/3) is separable: the cube roots and logarithms are of vectors only
+    cbrt_frequency = np.cbrt(np.asarray(frequency, dtype=float))
+    v_0 = np.cbrt(np.pi * nrtidal_d.GC * total_mass)
+    v = v_0 * cbrt_frequency
+    log_v = np.log(v_0) + np.log(cbrt_frequency)
+    v2 = v * v
+    v3 = v2 * v
+    # Horner's scheme in v, from v^-5 to v^7
+    psi = phi_4 * v + phi_3
+    psi *= v
+    psi += phi_2
+    psi *= v2
+    psi += 1.
+    psi /= v2 * v3
+    psi += phi_5 + phi_6 * v + v2 * (phi_7 + v3 * (phi_10 + phi_12 * v2))
+    psi += log_v * (3. * phi_5 - 6848. / 21. * v + phi_xi * v3)
+    psi *= 3. / (128. * eta)
+    return psi
+
+def amplitude(frequency, mass_1, mass_2, luminosity_distance):
+    """
+    Newtonian amplitude (samples x frequencies), luminosity_distance in Mpc.
+    """
+    return _amplitude_factor(mass_1, mass_2, luminosity_distance) * np.asarray(frequency, dtype=float) ** (-7. / 6.)
+
+def _amplitude_factor(mass_1, mass_2, luminosity_distance):
+    mass_1, mass_2, luminosity_distance = [_column(x) for x in [mass_1, mass_2, luminosity_distance]]
+    chirp_mass = bilby.gw.conversion.component_masses_to_chirp_mass(mass_1, mass_2)
+    return (np.sqrt(5. / 24.) * np.pi ** (-2. / 3.) * c.value / (luminosity_distance * 1e6 * pc.value) *
+            (nrtidal_d.GC * chirp_mass) ** (5. / 6.))
+
+def _cutoff(mass_1, mass_2, cutoff_frequency):
+    return _column(isco_frequency(mass_1, mass_2) if cutoff_frequency is None else cutoff_frequency)
+
+def polarizations(
+        frequency_array, mass_1, mass_2, luminosity_distance, chi_1, chi_2, theta_jn, phase,
+        lambda_1, lambda_2, xi_tilde, minimum_frequency=0., cutoff_frequency=None):
+    """
+    plus and cross polarizations (samples x frequencies) for arrays of samples,
+    zero outside [minimum_frequency, cutoff_frequency] (default the ISCO frequency of each sample).
+    """
+    frequency_array = np.asarray(frequency_array, dtype=float)
+    cutoff = _cutoff(mass_1, mass_2, cutoff_frequency)
+    band = (frequency_array > 0.) & (frequency_array >= minimum_frequency) & (frequency_array <= np.max(cutoff))
+    frequency = frequency_array[band]
+
+    with profiling.timer("taylorf2"):
+        psi = pn_phase(frequency, mass_1, mass_2, chi_1, chi_2, lambda_1, lambda_2, xi_tilde)
+        h = amplitude(frequency, mass_1, mass_2, luminosity_distance) * np.exp(1j * (2. * _column(phase) - psi))
+        h *= frequency <= cutoff
+
+    cos_theta_jn = _column(np.cos(theta_jn))
+    plus = np.zeros((len(h), len(frequency_array)), dtype=complex)
+    cross = np.zeros((len(h), len(frequency_array)), dtype=complex)
+    plus[:, band] = h * (1 + cos_theta_jn ** 2) / 2
+    cross[:, band] = -1j * cos_theta_jn * h
+    return dict(plus=plus, cross=cross)
+
+def source(
+        frequency_array,
+        mass_1, mass_2,
+        luminosity_distance,
+        a_1, tilt_1, phi_12, a_2, tilt_2, phi_jl, theta_jn, phase,
+        lambda_1, lambda_2,
+        xi_tilde,
+        **kwargs):
+    """
+    Inspiral-only nrtidal_d.source (waveform arguments minimum_frequency and cutoff_frequency).
+    """
+    return {key: value[0] for key, value in polarizations(
+        frequency_array, mass_1, mass_2, luminosity_distance, a_1 * np.cos(tilt_1), a_2 * np.cos(tilt_2),
+        theta_jn, phase, lambda_1, lambda_2, xi_tilde,
+        minimum_frequency=kwargs.get("minimum_frequency", 0.), cutoff_frequency=kwargs.get("cutoff_frequency")).items()}
+
+def source_binary_love(
+        frequency_array,
+        mass_1, mass_2,
+        luminosity_distance,
+        a_1, tilt_1, phi_12, a_2, tilt_2, phi_jl, theta_jn, phase,
+        lambda_s, xi_tilde, binary_love_residual,
+        **kwargs):
+    """
+    Inspiral-only nrtidal_d.source_binary_love.
+    """
+    with profiling.timer("binary_love"):
+        lambda_1, lambda_2 = nrtidal_d.binary_love_lambdas(mass_1, mass_2, lambda_s, binary_love_residual)
+    return source(
+        frequency_array, mass_1, mass_2, luminosity_distance, a_1, tilt_1, phi_12, a_2, tilt_2, phi_jl,
+        theta_jn, phase, lambda_1, lambda_2, xi_tilde, **kwargs)
+
+def _batch_parameters(parameters):
+    """
+    Arguments of polarizations of a batch of samples (dict or DataFrame of arrays
+    of the parameters of source, or of source_binary_love with lambda_s).
+    """
+    mass_1, mass_2 = np.asarray(parameters["mass_1"], dtype=float), np.asarray(parameters["mass_2"], dtype=float)
+    if "lambda_1" in parameters:
+        lambda_1, lambda_2 = parameters["lambda_1"], parameters["lambda_2"]
+    else:
+        lambda_1, lambda_2 = nrtidal_d.binary_love_lambdas(
+            mass_1, mass_2, np.asarray(parameters["lambda_s"], dtype=float),
+            np.asarray(parameters["binary_love_residual"], dtype=float))
+    return dict(
+        mass_1=mass_1, mass_2=mass_2, luminosity_distance=parameters["luminosity_distance"],
+        chi_1=np.asarray(parameters.get("a_1", 0.)) * np.cos(parameters.get("tilt_1", 0.)),
+        chi_2=np.asarray(parameters.get("a_2", 0.)) * np.cos(parameters.get("tilt_2", 0.)),
+        theta_jn=parameters["theta_jn"], phase=parameters["phase"],
+        lambda_1=lambda_1, lambda_2=lambda_2, xi_tilde=parameters["xi_tilde"])
+
+def batch_polarizations(frequency_array, parameters, minimum_frequency=0., cutoff_frequency=None):
+    """
+    polarizations of a batch of samples (dict or DataFrame of arrays of the
+    parameters of source, or of source_binary_love with lambda_s).
+    """
+    return polarizations(frequency_array, minimum_frequency=minimum_frequency, cutoff_frequency=cutoff_frequency,
+                         **_batch_parameters(parameters))
+
+def _time_shift(dt, frequency, duration):
+    """
+    exp(-2 pi i f dt) (samples x frequencies), frequency on the grid of spacing
+    1/duration. With f = f_0 + (a n + b)/duration, the product of two tables of
+    about sqrt(len(frequency)) exponentials each.
+    """
+    index = np.rint((frequency - frequency[0]) * duration).astype(int)
+    n = int(np.ceil(np.sqrt(index[-1] + 1)))
+    coarse = np.exp(-2j * np.pi * np.outer(dt, np.arange(index[-1] // n + 1) * n / duration))
+    fine = np.exp(-2j * np.pi * np.outer(dt, frequency[0] + np.arange(n) / duration))
+    return coarse[:, index // n] * fine[:, index % n]
+
+def log_likelihood_ratio(interferometers, parameters, phase_marginalization=True, cutoff_frequency=None):
+    """
+    ln L/L_noise of a batch of samples (dict or DataFrame of arrays, with the
+    extrinsic parameters and geocent_time; no time marginalization), in blocks
+    of MAX_BLOCK_SIZE. With the phase marginalized as in
+    bilby.gw.GravitationalWaveTransient(phase_marginalization=True).
+
+    With h = A f^(-7/6) exp(-i Psi) and the detector response c_i h
+    exp(-2 pi i f dt_i) of sample i, <h, h> is A^2 |c_i|^2 sum f^(-7/3)/S (no
+    waveform needed), and <d, h> needs exp(-i Psi) once for all the
+    interferometers (and a time shift, see _time_shift), summed as a
+    matrix-vector product with conj(d) f^(-7/6)/S.
+    """
+    parameters = {key: np.atleast_1d(np.asarray(value)) for key, value in dict(parameters).items()}
+    size = max(len(value) for value in parameters.values())
+    parameters = {key: np.broadcast_to(value, size) for key, value in parameters.items()}
+    frequency_array = interferometers[0].frequency_array
+    band = np.any([ifo.frequency_mask for ifo in interferometers], axis=0)
+    frequency = frequency_array[band]
+    block = max(MAX_BLOCK_SIZE // max(len(frequency), 1), 1)
+
+    result = np.empty(size)
+    for start in range(0, size, block):
+        batch = {key: value[start:start + block] for key, value in parameters.items()}
+        source_parameters = _batch_parameters(batch)
+        with profiling.timer("taylorf2"):
+            psi = pn_phase(frequency, *[source_parameters[key] for key in [
+                "mass_1", "mass_2", "chi_1", "chi_2", "lambda_1", "lambda_2", "xi_tilde"]])
+        inside = (frequency <= _cutoff(source_parameters["mass_1"], source_parameters["mass_2"], cutoff_frequency))
+        with profiling.timer("taylorf2"):
+            # one complex exponential per sample and frequency, for all the interferometers
+            h_phase = np.exp(-1j * psi)
+            h_phase *= inside
+        cos_theta_jn = np.cos(np.asarray(source_parameters["theta_jn"], dtype=float))
+        factor = (_amplitude_factor(source_parameters["mass_1"], source_parameters["mass_2"],
+                                    source_parameters["luminosity_distance"])[:, 0] *
+                  np.exp(2j * np.asarray(source_parameters["phase"], dtype=float)))
+
+        d_inner_h = np.zeros(len(psi), dtype=complex)
+        optimal_snr_squared = np.zeros(len(psi))
+        for ifo in interferometers:
+            mask = ifo.frequency_mask[band]
+            ifo_frequency = frequency[mask]
+            response, dt = np.empty(len(psi), dtype=complex), np.empty(len(psi))
+            for i in range(len(psi)):
+                ra, dec, psi_i, geocent_time = [batch[key][i] for key in ["ra", "dec", "psi", "geocent_time"]]
+                response[i] = (ifo.antenna_response(ra, dec, geocent_time, psi_i, "plus") * (1 + cos_theta_jn[i] ** 2) / 2 -
+                               1j * ifo.antenna_response(ra, dec, geocent_time, psi_i, "cross") * cos_theta_jn[i])
+                # the GPS times first, as in bilby
+                dt[i] = (geocent_time - ifo.strain_data.start_time) + ifo.time_delay_from_geocenter(ra, dec, geocent_time)
+            response *= factor
+            weight = 4. / ifo.strain_data.duration / ifo.power_spectral_density_array[ifo.frequency_mask]
+            data = np.conj(ifo.frequency_domain_strain[ifo.frequency_mask]) * weight * ifo_frequency ** (-7. / 6.)
+
+            with profiling.timer("taylorf2_inner_products"):
+                h_ifo = h_phase[:, mask] if not np.all(mask) else h_phase.copy()
+                h_ifo *= _time_shift(dt, ifo_frequency, ifo.strain_data.duration)
+                d_inner_h += response * (h_ifo @ data)
+                inside_ifo = inside[:, mask] if not np.all(mask) else inside
+                optimal_snr_squared += np.abs(response) ** 2 * (inside_ifo @ (weight * ifo_frequency ** (-7. / 3.)))
+        if phase_marginalization:
+            result[start:start + block] = np.log(i0e(np.abs(d_inner_h))) + np.abs(d_inner_h) - optimal_snr_squared / 2
+        else:
+            result[start:start + block] = np.real(d_inner_h) - optimal_snr_squared / 2
+    return result
+
+def match(h_1, h_2, weight, df):
+    """
+    |<h_1, h_2>|/|h_1||h_2| of rows of waveforms on a frequency grid of spacing
+    df (weight = 1/PSD), maximized over a time shift (inverse FFT, then a bounded
+    refinement about its peak) and a phase.
+    """
+    integrand = np.conj(h_1) * h_2 * weight
+    norm = np.sqrt(np.sum(np.abs(h_1) ** 2 * weight, axis=-1) * np.sum(np.abs(h_2) ** 2 * weight, axis=-1))
+    size = MATCH_PADDING * integrand.shape[-1]
+    overlap = np.abs(np.fft.ifft(integrand, n=size, axis=-1)) * size
+    frequency = np.arange(integrand.shape[-1]) * df
+    matches = []
+    for row, peak, n in zip(np.atleast_2d(integrand), np.atleast_2d(overlap), np.atleast_1d(norm)):
+        shift = np.argmax(peak) / (size * df)
+        resolution = 1. / (size * df)
+        best = minimize_scalar(lambda t: -np.abs(np.sum(row * np.exp(2j * np.pi * frequency * t))),
+                               bounds=(shift - resolution, shift + resolution), method="bounded")
+        matches.append(max(-best.fun, np.max(peak)) / n)
+    return np.array(matches)
+
+def validation_draws(points, seed=None, box=VALIDATION_BOX):
+    """
+    Uniform draws of the box (dict of arrays), with the component masses.
+    """
+    rng = np.random.default_rng(seed)
+    draws = {key: rng.uniform(*bounds, size=points) for key, bounds in box.items()}
+    total_mass = bilby.gw.conversion.chirp_mass_and_mass_ratio_to_total_mass(draws["chirp_mass"], draws["mass_ratio"])
+    draws["mass_1"] = total_mass / (1 + draws["mass_ratio"])
+    draws["mass_2"] = draws["mass_1"] * draws["mass_ratio"]
+    return draws
+
+def _lal_task(point):
+    mass_1, mass_2, chi_1, chi_2, lambda_1, lambda_2, xi_tilde = point
+    return nrtidal_d.source(
+        _frequency_array, mass_1, mass_2, 1., abs(chi_1), 0. if chi_1 >= 0 else np.pi, 0.,
+        abs(chi_2), 0. if chi_2 >= 0 else np.pi, 0., 0., 0., lambda_1, lambda_2, xi_tilde, **_waveform_arguments)["plus"]
+
+def validate(psd, cutoff_frequency, waveform_arguments, points=200, duration=128, sampling_frequency=2048,
+             npool=1, seed=None, chunk=50):
+    """
+    Mismatches with the LAL-based nrtidal_d.source (plus polarization, face on)
+    below cutoff_frequency, maximized over time and phase, at random points of VALIDATION_BOX.
+    psd: PowerSpectralDensity.
+    """
+    frequency_array = bilby.core.utils.create_frequency_series(sampling_frequency, duration)
+    band = (frequency_array >= waveform_arguments["minimum_frequency"]) & (frequency_array <= cutoff_frequency)
+    weight = 1. / psd.power_spectral_density_interpolated(frequency_array)
+    weight[~(band & np.isfinite(weight))] = 0.
+    draws = validation_draws(points, seed)
+    keys = ["mass_1", "mass_2", "chi_1", "chi_2", "lambda_1", "lambda_2", "xi_tilde"]
+
+    mismatch, lal_time, taylorf2_time = [], 0., 0.
+    for start in range(0, points, chunk):
+        batch = {key: draws[key][start:start + chunk] for key in keys}
+        t = time.perf_counter()
+        lal = np.array(_map(_lal_task, list(np.column_stack([batch[key] for key in keys])), npool,
+                            frequency_array, waveform_arguments))
+        lal_time += time.perf_counter() - t
+        t = time.perf_counter()
+        h = polarizations(
+            frequency_array, batch["mass_1"], batch["mass_2"], 1., batch["chi_1"], batch["chi_2"], 0., 0.,
+            batch["lambda_1"], batch["lambda_2"], batch["xi_tilde"],
+            minimum_frequency=waveform_arguments["minimum_frequency"], cutoff_frequency=cutoff_frequency)["plus"]
+        taylorf2_time += time.perf_counter() - t
+        mismatch.append(1. - match(lal, h, weight, frequency_array[1] - frequency_array[0]))
+    mismatch = np.concatenate(mismatch)
+    worst = int(np.argmax(mismatch))
+    return dict(
+        points=points, duration=duration, sampling_frequency=sampling_frequency, cutoff_frequency=cutoff_frequency,
+        waveform_arguments=waveform_arguments,
+        maximum_mismatch=float(np.max(mismatch)), mismatch_99=float(np.percentile(mismatch, 99)),
+        median_mismatch=float(np.median(mismatch)), worst_point={key: float(draws[key][worst]) for key in keys},
+        lal_seconds_per_waveform=lal_time * max(npool, 1) / points, taylorf2_seconds_per_waveform=taylorf2_time / points)
+
+#-------------------------------------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate the TaylorF2 inspiral model against LAL")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    validate_parser = subparsers.add_parser("validate", help="mismatches with LAL below a cutoff frequency")
+
+    validate_parser.add_argument("--asd", type=str, default=None, help="ASD file (default the aLIGO design PSD)")
+
+    validate_parser.add_argument("--cutoff_frequency", type=float, required=True)
+
+    validate_parser.add_argument("--approximant", type=str, default="IMRPhenomPv2_NRTidal")
+
+    validate_parser.add_argument("--minimum_frequency", type=float, default=40.)
+
+    validate_parser.add_argument("--reference_frequency", type=float, default=50.)
+
+    validate_parser.add_argument("--duration", type=float, default=128)
+
+    validate_parser.add_argument("--sampling_frequency", type=float, default=2048)
+
+    validate_parser.add_argument("--points", type=int, default=200)
+
+    validate_parser.add_argument("-o", "--output", type=str, default=None, help="validation summary (.json)")
+
+    validate_parser.add_argument("-n", "--npool", type=int, default=1)
+
+    validate_parser.add_argument("--seed", type=int, default=None)
+
+    args = parser.parse_args()
+
+    if args.asd is None:
+        psd = bilby.gw.detector.PowerSpectralDensity.from_aligo()
+    else:
+        asd = np.loadtxt(args.asd)
+        psd = bilby.gw.detector.PowerSpectralDensity(frequency_array=asd[:, 0], asd_array=asd[:, 1])
+    validation = validate(
+        psd, args.cutoff_frequency,
+        dict(waveform_approximant=args.approximant, reference_frequency=args.reference_frequency,
+             minimum_frequency=args.minimum_frequency),
+        points=args.points, duration=args.duration, sampling_frequency=args.sampling_frequency,
+        npool=args.npool, seed=args.seed)
+    logger.info("Mismatch with {} below {:g} Hz: maximum {:.2e}, 99th percentile {:.2e}, median {:.2e} at {} points".format(
+        args.approximant, args.cutoff_frequency, validation["maximum_mismatch"], validation["mismatch_99"],
+        validation["median_mismatch"], args.points))
+    logger.info("{:.2g}s per LAL waveform, {:.2g}s per TaylorF2 waveform".format(
+        validation["lal_seconds_per_waveform"], validation["taylorf2_seconds_per_waveform"]))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(validation, f, indent=2)
@@ -0,0 +1,48 @@
+import os
+import signal
+
+import bilby
+import numpy as np
+import pytest
+
+import checkpointing
+
+class _Likelihood(bilby.core.likelihood.Likelihood):
+    """
+    Unit Gaussian in 3 dimensions, which sends SIGTERM to the process at call interrupt.
+    """
+    def __init__(self, interrupt=None):
+        super(_Likelihood, self).__init__()
+        self.calls = 0
+        self.interrupt = interrupt
+
+    def log_likelihood(self, parameters=None):
+        self.calls += 1
+        if self.calls == self.interrupt:
+            os.kill(os.getpid(), signal.SIGTERM)
+        return -0.5 * sum(parameters[key] ** 2 for key in "abc")
+
+def _run(outdir, interrupt=None, resume=False):
+    # as in a new process: fresh walk state, and bilby seeded by the runner
+    for name, attribute in checkpointing.WALK_STATE:
+        walk = getattr(checkpointing.dynesty3_utils, name, None)
+        if walk is not None and hasattr(walk, attribute):
+            setattr(walk, attribute, [] if attribute == "_cache" else None)
+    bilby.core.utils.random.seed(4)
+    priors = bilby.core.prior.PriorDict({key: bilby.core.prior.Uniform(-5, 5, key) for key in "abc"})
+    return bilby.run_sampler(
+        _Likelihood(interrupt), priors, sampler=checkpointing.register(), sample="rwalk", nlive=50, seed=4,
+        outdir=str(outdir), label="gaussian", check_point=True, checkpoint_interval=0., checkpoint_latency=0.,
+        resume=resume, check_point_plot=False, save=False, npool=1, print_progress=False)
+
+def test_resume_reproduces_uninterrupted_run(tmp_path):
+    uninterrupted = _run(tmp_path / "uninterrupted")
+
+    with pytest.raises(SystemExit):
+        _run(tmp_path / "resumed", interrupt=1500)
+    assert os.path.isfile(tmp_path / "resumed" / "gaussian_dead_points.log")
+    resumed = _run(tmp_path / "resumed", resume=True)
+
+    assert resumed.log_evidence == uninterrupted.log_evidence
+    assert np.array_equal(resumed.nested_samples.to_numpy(), uninterrupted.nested_samples.to_numpy())
+    assert np.array_equal(resumed.posterior[list("abc")].to_numpy(), uninterrupted.posterior[list("abc")].to_numpy())
@@ -0,0 +1,56 @@
+import bilby
+import numpy as np
+
+import sampler_budget
+
+class _Likelihood(object):
+    def __init__(self):
+        self.parameters = dict()
+
+    def log_likelihood_ratio(self):
+        return 0.
+
+def _priors(ndim=5, constraints=0):
+    priors = bilby.core.prior.PriorDict({
+        "x{}".format(i): bilby.core.prior.Uniform(0, 1, name="x{}".format(i)) for i in range(ndim)})
+    for i in range(constraints):
+        priors["c{}".format(i)] = bilby.core.prior.Constraint(0, 1, name="c{}".format(i))
+    return priors
+
+def test_required_nlive_from_evidence_target():
+    # H/sigma^2 dominates the quantile requirement
+    assert sampler_budget.required_nlive(0.2, 5, information=30., log_evidence_error=0.2) == 750
+    assert sampler_budget.required_nlive(0.2, 5, information=30., log_evidence_error=0.3) == 334
+
+def test_required_nlive_from_precision_target():
+    # n_eff = q/((1-q) precision^2) = 3600 at the defaults, and n_eff/nlive = 8.5 for ndim = 13
+    n_eff = 0.9 / (0.1 * 0.05 ** 2)
+    assert np.isclose(n_eff, 3600)
+    assert sampler_budget.required_nlive(0.05, 13, log_evidence_error=1.) == int(np.ceil(
+        n_eff / sampler_budget.effective_samples_per_live_point(13)))
+    assert sampler_budget.required_nlive(0.03, 13, log_evidence_error=0.3) == 1176
+
+def test_target_sets_nlive():
+    nlive = {}
+    for log_evidence_error in [0.15, 0.2, 0.3]:
+        settings = sampler_budget.choose_settings(
+            _Likelihood(), _priors(), wall_hours=1e3, precision=0.2, log_evidence_error=log_evidence_error)
+        nlive[log_evidence_error] = settings["nlive"]
+        assert settings["dlogz"] <= log_evidence_error
+    assert nlive == {0.15: 1334, 0.2: 750, 0.3: 334}
+    assert all(250 < n < 1500 for n in nlive.values())
+
+def test_precision_sets_nlive():
+    nlive = {}
+    for precision in [0.03, 0.04]:
+        settings = sampler_budget.choose_settings(
+            _Likelihood(), _priors(13, constraints=2), wall_hours=1e3, precision=precision, log_evidence_error=0.3)
+        nlive[precision] = settings["nlive"]
+    # the constraints are not sampled dimensions: ndim = 13
+    assert nlive == {0.03: 1176, 0.04: 662}
+
+def test_small_budget_reduces_nlive():
+    settings = sampler_budget.choose_settings(
+        _Likelihood(), _priors(), wall_hours=1e-9, log_evidence_error=0.2)
+    assert settings["nlive"] == 250
+    assert settings["nact"] == 3
@@ -0,0 +1,36 @@
+import bilby
+import numpy as np
+import pandas as pd
+
+import warm_start
+
+class _Likelihood(bilby.core.likelihood.Likelihood):
+    """
+    Unit Gaussian in 3 dimensions: Z = (2 pi)^(3/2) / 10^3 on the priors below.
+    """
+    def log_likelihood(self, parameters=None):
+        return -0.5 * sum(parameters[key] ** 2 for key in "abc")
+
+def _priors():
+    return bilby.core.prior.PriorDict({key: bilby.core.prior.Uniform(-5, 5, key) for key in "abc"})
+
+def test_warm_start_recovers_evidence(tmp_path):
+    # an earlier posterior that is offset from and narrower than this one
+    rng = np.random.default_rng(1)
+    earlier = bilby.core.result.Result(
+        label="earlier", outdir=str(tmp_path), search_parameter_keys=list("abc"), priors=_priors(),
+        posterior=pd.DataFrame({key: rng.normal(0.3, 0.7, 4000) for key in "abc"}))
+    earlier.save_to_file(extension="json")
+
+    priors = warm_start.start(_priors(), str(tmp_path / "earlier_result.json"), seed=2)
+    assert isinstance(priors, warm_start.WarmStartPriorDict)
+    bilby.core.utils.random.seed(3)
+    result = bilby.run_sampler(
+        _Likelihood(), priors, sampler="dynesty", nlive=300, seed=3, outdir=str(tmp_path), label="warm",
+        conversion_function=warm_start.conversion_function, check_point=False, print_progress=False)
+    result = warm_start.finish(result)
+
+    log_evidence = 1.5 * np.log(2 * np.pi) - 3 * np.log(10)
+    assert abs(result.log_evidence - log_evidence) < result.log_evidence_err
+    assert result.meta_data["warm_start"]["keys"] == list("abc")
+    assert np.allclose(result.posterior[list("abc")].std(), 1., atol=0.15)
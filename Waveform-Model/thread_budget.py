@@ -0,0 +1,200 @@
+import multiprocessing
+import os
+
+import bilby
+from bilby.core.sampler import base_sampler
+
+logger = bilby.core.utils.logger
+
+THREAD_ENVIRONMENT_VARIABLES = [
+    "OMP_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "BLIS_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "MPI_NUM_THREADS",
+]
+
+AFFINITY_MODES = ["none", "core", "numa"]
+
+_original_initializer = base_sampler._initialize_global_variables
+
+def set_thread_environment(threads):
+    """
+    Set the thread count environment variables read by BLAS, FFTW and OpenMP.
+    These only take effect for libraries loaded after this call
+    (and are inherited by any subprocesses), so we also limit the
+    threads of already loaded libraries with limit_library_threads.
+    """
+    for name in THREAD_ENVIRONMENT_VARIABLES:
+        os.environ[name] = str(threads)
+
+def limit_library_threads(threads):
+    """
+    Limit the threads of the BLAS/OpenMP libraries that have already been
+    loaded into this process (e.g. by numpy or LAL).
+    Returns a description of the limited libraries.
+    """
+    try:
+        from threadpoolctl import threadpool_limits, threadpool_info
+    except ImportError:
+        logger.warning("threadpoolctl is not installed: only setting thread environment variables.")
+        return []
+
+    threadpool_limits(limits=threads)
+
+    return [
+        "{}={}".format(info["internal_api"], info["num_threads"])
+        for info in threadpool_info()
+    ]
+
+def available_cores():
+    """
+    Cores this process is allowed to run on, sorted.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count()))
+
+def numa_domains():
+    """
+    List of the (allowed) cores in each NUMA domain.
+    Falls back to a single domain if the topology is not exposed in /sys.
+    """
+    allowed = set(available_cores())
+    node_dir = "/sys/devices/system/node"
+
+    domains = []
+    if os.path.isdir(node_dir):
+        for name in sorted(os.listdir(node_dir)):
+            if not (name.startswith("node") and name[4:].isdigit()):
+                continue
+            with open(os.path.join(node_dir, name, "cpulist")) as f:
+                cores = [c for c in _parse_cpulist(f.read()) if c in allowed]
+            if len(cores) > 0:
+                domains.append(cores)
+
+    if len(domains) == 0:
+        domains = [sorted(allowed)]
+    return domains
+
+def _parse_cpulist(cpulist):
+    """
+    Parse a Linux cpulist string, e.g. "0-3,8,10-11".
+    """
+    cores = []
+    for part in cpulist.strip().split(","):
+        if part == "":
+            continue
+        if "-" in part:
+            lo, hi = part.split("-")
+            cores.extend(range(int(lo), int(hi) + 1))
+        else:
+            cores.append(int(part))
+    return cores
+
+def worker_layout(npool, threads_per_worker=1, affinity="none"):
+    """
+    Set of cores each of the npool workers is allowed to run on.
+
+    affinity="none": every worker may run on every available core.
+    affinity="core": each worker gets its own block of threads_per_worker cores.
+    affinity="numa": workers are spread round-robin over the NUMA domains,
+                     and may run on any core of their domain.
+    """
+    if affinity not in AFFINITY_MODES:
+        raise ValueError("affinity must be one of {}, not {}".format(AFFINITY_MODES, affinity))
+
+    cores = available_cores()
+    npool = max(npool, 1)
+
+    if affinity == "none":
+        return [cores for i in range(npool)]
+
+    if affinity == "numa":
+        domains = numa_domains()
+        return [domains[i % len(domains)] for i in range(npool)]
+
+    if npool * threads_per_worker > len(cores):
+        logger.warning(
+            "Thread budget npool*threads_per_worker={} exceeds the {} available cores: "
+            "workers will share cores.".format(npool * threads_per_worker, len(cores))
+        )
+    layout = []
+    for i in range(npool):
+        start = (i * threads_per_worker) % len(cores)
+        layout.append([cores[(start + j) % len(cores)] for j in range(threads_per_worker)])
+    return layout
+
+def _worker_index(npool):
+    """
+    Index of this pool worker (0 for the main process).
+    """
+    identity = multiprocessing.current_process()._identity
+    if len(identity) == 0:
+        return None
+    return (identity[-1] - 1) % npool
+
+def _pin_and_limit(threads_per_worker, layout):
+    """
+    Limit library threads and set the core affinity of the calling worker.
+    """
+    set_thread_environment(threads_per_worker)
+    limit_library_threads(threads_per_worker)
+
+    index = _worker_index(len(layout))
+    if index is None or not hasattr(os, "sched_setaffinity"):
+        return
+    os.sched_setaffinity(0, layout[index])
+    logger.debug("Worker {} (pid {}) pinned to cores {}".format(index, os.getpid(), layout[index]))
+
+def apply(npool, threads_per_worker=1, affinity="none"):
+    """
+    Fix the number of library threads per worker and optionally pin the
+    bilby npool workers to cores or NUMA domains.
+
+    The main process is limited immediately. The workers are limited/pinned
+    when bilby starts its multiprocessing pool, by wrapping the pool initializer.
+    Logs the effective layout.
+    """
+    if threads_per_worker < 1:
+        raise ValueError("threads_per_worker must be >= 1, not {}".format(threads_per_worker))
+
+    layout = worker_layout(npool, threads_per_worker, affinity)
+
+    set_thread_environment(threads_per_worker)
+    libraries = limit_library_threads(threads_per_worker)
+
+    def initializer(*args, **kwargs):
+        _pin_and_limit(threads_per_worker, layout)
+        return _original_initializer(*args, **kwargs)
+
+    base_sampler._initialize_global_variables = initializer
+
+    cores = available_cores()
+    logger.info("Thread budget: npool={}, threads_per_worker={}, total threads={}, available cores={}".format(
+        npool, threads_per_worker, max(npool, 1) * threads_per_worker, len(cores)))
+    logger.info("Library threads limited: {}".format(", ".join(libraries) if len(libraries) > 0 else "none loaded"))
+    logger.info("Worker affinity ({}):".format(affinity))
+    for i, worker_cores in enumerate(layout):
+        logger.info("  worker {}: cores {}".format(i, _format_cpulist(worker_cores)))
+
+    return layout
+
+def _format_cpulist(cores):
+    """
+    Inverse of _parse_cpulist.
+    """
+    cores = sorted(cores)
+    parts = []
+    start = prev = None
+    for c in cores + [None]:
+        if start is None:
+            start = prev = c
+        elif c is not None and c == prev + 1:
+            prev = c
+        else:
+            parts.append(str(start) if start == prev else "{}-{}".format(start, prev))
+            start = prev = c
+    return ",".join(parts)
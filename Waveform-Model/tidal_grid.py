@@ -0,0 +1,132 @@
+"""
+Phase-marginalized likelihood on a (lambda_s, xi_tilde) grid, the other
+parameters held fixed.
+
+In nrtidal_d.source_binary_love xi_tilde only enters through the phase factor
+exp(-i xi_tilde phi_1(f)), with phi_1 the dissipative phase for xi_tilde = 1.
+Hence on a row of the grid (fixed lambda_s)
+
+    <h, h>          does not depend on xi_tilde
+    <d, h>(xi)  =   4/T sum_f conj(d) h_0 / S * exp(-i xi phi_1)
+
+with h_0 the waveform at xi_tilde = 0, so that one base waveform per lambda_s
+is computed (and cached), and each row is one matrix-vector product. With the
+phase marginalized over,
+
+    ln L/L_noise = ln I_0(|<d, h>|) - <h, h>/2
+
+as in bilby.gw.GravitationalWaveTransient(phase_marginalization=True).
+"""
+import bilby
+import numpy as np
+from scipy.special import i0e
+
+import nrtidal_d
+import stacking
+
+logger = bilby.core.utils.logger
+
+# Largest block (xi_tilde points x frequencies) of phase factors held in memory.
+MAX_BLOCK_SIZE = 2 ** 22
+
+def _centres(minimum, maximum, points):
+    edges = np.linspace(minimum, maximum, points + 1)
+    return 0.5 * (edges[1:] + edges[:-1])
+
+def default_grid(priors, points=(40, 50)):
+    """
+    lambda_s and xi_tilde grids: the centres of `points` equal cells over the
+    support of their priors (the binary Love relations are singular at lambda_s = 0).
+    """
+    return (_centres(priors["lambda_s"].minimum, priors["lambda_s"].maximum, points[0]),
+            _centres(priors["xi_tilde"].minimum, priors["xi_tilde"].maximum, points[1]))
+
+class TidalGrid(object):
+    """
+    ln likelihood ratio on a lambda_s x xi_tilde grid, for a waveform generator
+    of nrtidal_d.source_binary_love and the other parameters fixed to `parameters`.
+    The base waveforms are cached, so that the grid can be evaluated again on new
+    data (or a new PSD) at the cost of the inner products only.
+    """
+    def __init__(self, waveform_generator, parameters, lambda_s, xi_tilde):
+        self.waveform_generator = waveform_generator
+        self.parameters = dict(parameters)
+        self.parameters["phase"] = 0.
+        # the median binary Love relation, unless given
+        self.parameters.setdefault("binary_love_residual", 0.)
+        self.lambda_s = np.asarray(lambda_s, dtype=float)
+        self.xi_tilde = np.asarray(xi_tilde, dtype=float)
+        self._polarizations = {}
+
+        converted, _ = bilby.gw.conversion.convert_to_lal_binary_neutron_star_parameters(self.parameters)
+        self._phase_per_xi = nrtidal_d._dissipative_tidal_phase_xi_tilde(
+            waveform_generator.frequency_array, converted["mass_1"], converted["mass_2"], 1.)
+
+    def base_polarizations(self, lambda_s):
+        """
+        Polarizations at this lambda_s and xi_tilde = 0 (cached).
+        """
+        if lambda_s not in self._polarizations:
+            parameters = dict(self.parameters, lambda_s=lambda_s, xi_tilde=0.)
+            polarizations = self.waveform_generator.frequency_domain_strain(parameters)
+            self._polarizations[lambda_s] = {k: v.copy() for k, v in polarizations.items()}
+        return self._polarizations[lambda_s]
+
+    def _row(self, interferometers, lambda_s):
+        weights = np.zeros(len(self._phase_per_xi), dtype=complex)
+        optimal_snr_squared = 0.
+        polarizations = self.base_polarizations(lambda_s)
+        for ifo in interferometers:
+            response = ifo.get_detector_response(polarizations, self.parameters)
+            mask = ifo.frequency_mask
+            psd = ifo.power_spectral_density_array[mask]
+            duration = ifo.strain_data.duration
+            weights[mask] += 4. / duration * np.conj(ifo.frequency_domain_strain[mask]) * response[mask] / psd
+            optimal_snr_squared += 4. / duration * np.sum(np.abs(response[mask]) ** 2 / psd)
+
+        used = weights != 0
+        weights, phase = weights[used], self._phase_per_xi[used]
+        d_inner_h = np.empty(len(self.xi_tilde), dtype=complex)
+        block = max(MAX_BLOCK_SIZE // max(len(phase), 1), 1)
+        for start in range(0, len(self.xi_tilde), block):
+            xi = self.xi_tilde[start:start + block]
+            d_inner_h[start:start + block] = np.exp(-1j * np.outer(xi, phase)) @ weights
+        log_likelihood_ratio = np.log(i0e(np.abs(d_inner_h))) + np.abs(d_inner_h) - optimal_snr_squared / 2
+        return np.nan_to_num(log_likelihood_ratio, nan=-np.inf)
+
+    def log_likelihood_ratio(self, interferometers):
+        """
+        ln L/L_noise on the grid (lambda_s x xi_tilde).
+        """
+        return np.array([self._row(interferometers, lambda_s) for lambda_s in self.lambda_s])
+
+    def log_prior(self, priors):
+        """
+        ln prior on the grid, from the lambda_s and xi_tilde priors.
+        """
+        with np.errstate(divide="ignore"):
+            return (np.log(priors["lambda_s"].prob(self.lambda_s))[:, None] +
+                    np.log(priors["xi_tilde"].prob(self.xi_tilde))[None, :])
+
+def normalize(log_posterior):
+    posterior = np.exp(log_posterior - np.max(log_posterior[np.isfinite(log_posterior)]))
+    return posterior / np.sum(posterior)
+
+def summarize(grid, log_likelihood_ratio, priors, quantiles=(0.05, 0.5, 0.9, 0.95)):
+    """
+    Maximum-likelihood grid point, and the marginal posteriors and credible
+    bounds of lambda_s and xi_tilde on the grid.
+    """
+    posterior = normalize(log_likelihood_ratio + grid.log_prior(priors))
+    i, j = np.unravel_index(np.argmax(log_likelihood_ratio), log_likelihood_ratio.shape)
+    summary = dict(
+        maximum_log_likelihood_ratio=float(log_likelihood_ratio[i, j]),
+        maximum_likelihood=dict(lambda_s=float(grid.lambda_s[i]), xi_tilde=float(grid.xi_tilde[j])),
+    )
+    for axis, name, values in [(1, "lambda_s", grid.lambda_s), (0, "xi_tilde", grid.xi_tilde)]:
+        marginal = np.sum(posterior, axis=axis)
+        bounds = stacking.credible_bounds(marginal, values, quantiles) if len(values) > 1 else {}
+        summary[name] = dict(
+            grid=values.tolist(), marginal=marginal.tolist(),
+            credible_bounds={"{:g}".format(q): v for q, v in bounds.items()})
+    return summary
@@ -1,6 +1,6 @@
 import numpy as np
 
-def convert_lambda_s_to_lambda_a_marginalized(lambda_s,q):
+def convert_lambda_s_to_lambda_a_marginalized(lambda_s,q,residual=None):
     """
     Marginalized Binary Love relations. 
     
@@ -18,6 +18,10 @@ def convert_lambda_s_to_lambda_a_marginalized(lambda_s,q):
     times with the same input, unless you manually reset the random seed every
     time you call this function.
 
+    Alternatively, pass the error in units of its standard deviation as
+    residual (e.g. sampled from a unit normal prior): the result is then
+    deterministic, Lambda_a = Lambda_a(binary Love) + mean + residual * std.
+
     [1] https://arxiv.org/abs/1903.03909
 
     DOI: https://doi.org/10.1103/PhysRevD.99.083016
@@ -63,6 +67,9 @@ def convert_lambda_s_to_lambda_a_marginalized(lambda_s,q):
     sigma_r_q=sigma_6*q**3+sigma_7*q**2+sigma_8*q+sigma_9
     mu_r=(mu_r_lambda_s+mu_r_q)/2.
     sigma_r=(sigma_r_lambda_s**2+sigma_r_q**2)**(0.5)
-    lambda_a_marginalized=lambda_a+np.random.normal(loc=mu_r,scale=sigma_r)
+    if residual is None:
+        lambda_a_marginalized=lambda_a+np.random.normal(loc=mu_r,scale=sigma_r)
+    else:
+        lambda_a_marginalized=lambda_a+mu_r+sigma_r*residual
 
     return lambda_a_marginalized
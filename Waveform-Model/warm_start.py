@@ -0,0 +1,254 @@
+"""
+Warm start of a nested sampling run from an earlier, related posterior.
+
+Nested sampling spends most of its iterations compressing the prior down to the
+posterior. Given the posterior of a related run (another base waveform, another
+xi_tilde injection, ...) we sample instead on the warm-start prior
+
+    p(theta) = q(u(theta)) pi(theta),      u = the prior quantiles (unit cube) of theta
+
+where q is a Gaussian on the unit cube with the mean and (inflated) covariance
+of the earlier posterior, truncated to the cube. It is drawn from as a sequence
+of truncated conditional normals (Cholesky factor), so that dynesty's initial
+live points, bounds and random-walk proposal scales all start from the earlier
+posterior. q > 0 on the whole cube, so the support of the prior is unchanged.
+
+The posterior and evidence are recovered by importance weighting, with
+w = pi/p = 1/q(u):
+
+    posterior   the posterior of the run is rejection sampled with weights w
+                (in the conversion function, before the NRTidal-D conversion)
+    evidence    Z = Z_p <w>_p, with <w>_p the mean weight over the posterior of the run
+
+The effective sample size of the weights is logged: if the earlier posterior is
+much narrower than, or offset from, the new one, the weights are uneven and the
+warm start inefficient (but still unbiased). Parameters that the earlier
+posterior does not have, or with periodic priors, keep their prior. If less than
+MIN_IN_PRIOR of the earlier samples are in the support of the prior, the run is
+not warm started.
+
+In the runners (flag --warm_start {result file or posterior store}):
+
+    priors = warm_start.start(priors, args.warm_start, conversion_function)
+    result = run_sampler(..., priors=priors, conversion_function=warm_start.conversion_function)
+    warm_start.finish(result)
+
+The results record the original priors, and the log evidence correction in
+result.meta_data["warm_start"]; the nested samples are reweighted.
+"""
+import bilby
+import numpy as np
+import pandas as pd
+from scipy.stats import truncnorm
+
+import posterior_store
+
+logger = bilby.core.utils.logger
+
+# Inflation of the standard deviations of the earlier posterior.
+INFLATION = 2.
+
+# Minimum fraction of the earlier posterior samples in the support of the prior.
+MIN_IN_PRIOR = 0.9
+
+# Effective sample fraction of the weights below which the warm start is reported as inefficient.
+MIN_EFFICIENCY = 0.1
+
+_state = None
+
+class _State:
+    def __init__(self, priors, conversion_function, seed=None):
+        self.priors = priors
+        self.conversion_function = conversion_function
+        self.seed = seed
+        self.log_evidence_correction = None
+        self.log_evidence_correction_err = None
+        self.efficiency = None
+
+def read_posterior(filename):
+    """
+    Posterior samples of a bilby result file or a posterior store (.h5).
+    """
+    if filename.endswith(".h5"):
+        with posterior_store.PosteriorStore(filename) as store:
+            return store.read([column for column in store.columns if store.dataset(column).dtype.kind in "biuf"])
+    return bilby.core.result.read_in_result(filename).posterior
+
+class WarmStartPriorDict(bilby.core.prior.PriorDict):
+    """
+    The priors, with the search parameters `keys` drawn from q on their unit cube
+    (mean, lower triangular Cholesky factor of the covariance). ln_prob, sample
+    and the JSON of the results are those of the original priors.
+    """
+    def __init__(self, dictionary=None, filename=None, conversion_function=None, keys=(), mean=None, cholesky=None):
+        super(WarmStartPriorDict, self).__init__(
+            dictionary=dictionary, filename=filename, conversion_function=conversion_function)
+        self.warm_keys = list(keys)
+        self.mean = np.asarray(mean, dtype=float) if mean is not None else np.zeros(0)
+        self.cholesky = np.asarray(cholesky, dtype=float) if cholesky is not None else np.zeros((0, 0))
+
+    def copy(self):
+        return self.__class__(
+            dictionary=dict(self), conversion_function=self.conversion_function,
+            keys=self.warm_keys, mean=self.mean, cholesky=self.cholesky)
+
+    def _get_json_dict(self):
+        total_dict = super(WarmStartPriorDict, self)._get_json_dict()
+        total_dict["__module__"] = bilby.core.prior.PriorDict.__module__
+        total_dict["__name__"] = bilby.core.prior.PriorDict.__name__
+        return total_dict
+
+    def transform_state(self):
+        """
+        What determines the prior transform, besides the priors (for run_cache.py).
+        """
+        return dict(keys=self.warm_keys, mean=self.mean.tolist(), cholesky=self.cholesky.tolist())
+
+    def _bounds(self, i, z):
+        """
+        Conditional mean of u_i given z_0...z_{i-1}, and truncation of z_i to the cube.
+        """
+        m = self.mean[i] + sum(self.cholesky[i, j] * z[j] for j in range(i))
+        return (0. - m) / self.cholesky[i, i], (1. - m) / self.cholesky[i, i], m
+
+    def to_cube(self, v):
+        """
+        u (the unit cube of the priors) of the uniform draws v, for the keys.
+        """
+        z = []
+        u = np.empty(len(self.warm_keys))
+        for i in range(len(self.warm_keys)):
+            a, b, m = self._bounds(i, z)
+            z.append(truncnorm.ppf(v[i], a, b))
+            u[i] = np.clip(m + self.cholesky[i, i] * z[i], 0., 1.)
+        return u
+
+    def log_q(self, u):
+        """
+        ln q(u), for u of shape (len(keys), ...).
+        """
+        z = []
+        log_q = 0.
+        for i in range(len(self.warm_keys)):
+            a, b, m = self._bounds(i, z)
+            z.append((u[i] - m) / self.cholesky[i, i])
+            log_q = log_q + truncnorm.logpdf(z[i], a, b) - np.log(self.cholesky[i, i])
+        return log_q
+
+    def rescale(self, keys, theta):
+        theta = np.array(theta, dtype=float)
+        index = [list(keys).index(key) for key in self.warm_keys]
+        theta[index] = self.to_cube(theta[index])
+        return super(WarmStartPriorDict, self).rescale(keys, theta)
+
+    def log_weight(self, sample):
+        """
+        ln w = ln pi/p = -ln q of the samples (dict or DataFrame of the keys).
+        """
+        u = np.array([self[key].cdf(np.asarray(sample[key], dtype=float)) for key in self.warm_keys])
+        return -self.log_q(u)
+
+def warm_start_priors(priors, posterior, inflation=INFLATION):
+    """
+    WarmStartPriorDict from the samples of an earlier posterior (DataFrame),
+    or None if they do not fit the priors.
+    """
+    keys = [key for key in priors.non_fixed_keys
+            if not isinstance(priors[key], bilby.core.prior.Constraint)
+            and getattr(priors[key], "boundary", None) != "periodic" and key in posterior]
+    if len(keys) == 0:
+        logger.warning("The warm-start posterior has none of the sampled parameters: sampling from the prior")
+        return None
+
+    u = np.array([priors[key].cdf(posterior[key].to_numpy(dtype=float)) for key in keys])
+    inside = np.all((u > 0) & (u < 1), axis=0)
+    if np.mean(inside) < MIN_IN_PRIOR:
+        logger.warning("Only {:.0%} of the warm-start posterior is in the prior: sampling from the prior".format(
+            np.mean(inside)))
+        return None
+
+    u = u[:, inside]
+    covariance = np.atleast_2d(np.cov(u)) * inflation ** 2
+    # numerically positive definite
+    covariance += np.diag(np.full(len(keys), 1e-8))
+    cholesky = np.linalg.cholesky(covariance)
+    logger.info("Warm start of {} from {} samples".format(", ".join(keys), u.shape[1]))
+    return WarmStartPriorDict(
+        dictionary=dict(priors), conversion_function=priors.conversion_function,
+        keys=keys, mean=np.mean(u, axis=1), cholesky=cholesky)
+
+def start(priors, filename, conversion_function=None, inflation=INFLATION, seed=None):
+    """
+    Warm-start priors from an earlier result (file), to sample on with
+    conversion_function=warm_start.conversion_function (which then calls
+    conversion_function). Returns the priors unchanged if the result does not fit them.
+    seed: of the reweighting (default bilby's random generator, as bilby's own
+    draw of the posterior).
+    """
+    global _state
+    warm_priors = warm_start_priors(priors, read_posterior(filename), inflation)
+    if warm_priors is None:
+        _state = _State(None, conversion_function, seed)
+        return priors
+    _state = _State(warm_priors, conversion_function, seed)
+    return warm_priors
+
+def reweight(sample, priors, seed=None):
+    """
+    Rejection sample the posterior of the warm-start run with the weights
+    pi/p. Returns the samples, the log mean weight and its standard error, and
+    the effective sample fraction of the weights. seed: default bilby's
+    random generator (seeded with the run).
+    """
+    log_weight = priors.log_weight(sample)
+    weight = np.exp(log_weight - np.max(log_weight))
+    efficiency = np.sum(weight) ** 2 / np.sum(weight ** 2) / len(weight)
+    log_mean_weight = np.max(log_weight) + np.log(np.mean(weight))
+    log_mean_weight_err = np.std(weight) / (np.mean(weight) * np.sqrt(len(weight)))
+
+    rng = np.random.default_rng(seed) if seed is not None else bilby.core.utils.random.rng
+    keep = rng.uniform(size=len(weight)) < weight
+    return sample[keep].reset_index(drop=True), log_mean_weight, log_mean_weight_err, efficiency
+
+def conversion_function(sample, likelihood=None, priors=None, npool=1):
+    """
+    Reweight the posterior (of the warm-start priors) to the original priors,
+    then the conversion function given to start.
+    """
+    if isinstance(sample, pd.DataFrame) and _state is not None and _state.priors is not None:
+        sample, _state.log_evidence_correction, _state.log_evidence_correction_err, _state.efficiency = reweight(
+            sample, _state.priors, _state.seed)
+        logger.info("Warm start: {} posterior samples after reweighting, effective sample fraction {:.2f}".format(
+            len(sample), _state.efficiency))
+        if _state.efficiency < MIN_EFFICIENCY:
+            logger.warning("The warm-start posterior is a poor match: the reweighted posterior is noisy")
+    if _state is None or _state.conversion_function is None:
+        return sample
+    return _state.conversion_function(sample, likelihood=likelihood, priors=priors, npool=npool)
+
+def finish(result):
+    """
+    Correct the evidence of the result for the warm start, reweight its nested
+    samples, and save it again.
+    """
+    if _state is None or _state.priors is None or "warm_start" in result.meta_data:
+        return result
+    if _state.log_evidence_correction is None:
+        logger.warning("The posterior was not reweighted: no warm-start correction")
+        return result
+
+    result.log_evidence += _state.log_evidence_correction
+    result.log_evidence_err = np.sqrt(result.log_evidence_err ** 2 + _state.log_evidence_correction_err ** 2)
+    if result.log_noise_evidence is not None and np.isfinite(result.log_noise_evidence):
+        result.log_bayes_factor = result.log_evidence - result.log_noise_evidence
+
+    if getattr(result, "nested_samples", None) is not None and "weights" in result.nested_samples:
+        log_weight = _state.priors.log_weight(result.nested_samples) + np.log(result.nested_samples["weights"].to_numpy())
+        weights = np.exp(log_weight - np.max(log_weight))
+        result.nested_samples["weights"] = weights / np.sum(weights)
+
+    result.meta_data["warm_start"] = dict(
+        keys=_state.priors.warm_keys, log_evidence_correction=_state.log_evidence_correction,
+        effective_sample_fraction=_state.efficiency)
+    result.save_to_file(overwrite=True)
+    return result